@@ -2,7 +2,7 @@
 '''
 Dump the documents from trift document set
 
-fuzzy-match.py <list> <thrift_dir>
+dump-docs.py <list> <thrift_dir> [<thrift_dir> ...] [--workers N] [--batch-size N]
 '''
 
 import re
@@ -39,6 +39,10 @@ from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
 
 import redis
 from temp_config import RedisDB
+import normalize
+import scanner
+import corpus
+from sink import ResultSink
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
@@ -52,6 +56,7 @@ class FuzzyMatch():
   _doc_hash = {}
   _write_to_db = False
   #_write_to_db = True
+  _sink = None
 
   _oair_doc_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.oair_doc_train_db)
@@ -81,107 +86,86 @@ class FuzzyMatch():
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str )
+    return normalize.sanitize(str)
 
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str )
-
-    return str.lower()
-
-  def process_stream_item(self, fname, stream_id, stream_data):
+  def match_stream_item(self, stream_id, stream_data):
     '''
-    process the streaming item: applying exact match for each of the query
-    entity
+    process the streaming item: keep it for every query it is listed for,
+    returns the list of matches
     '''
-    #new_stream_data = self.sanitize(stream_data)
+    matches = []
+    if stream_id in self._doc_hash:
+      for query in self._doc_hash[stream_id]:
+        matches.append((query, stream_id, stream_data))
+    return matches
 
+  def save_match(self, fpath, match):
+    '''
+    save one match to the DB, called in the writer process only
+    '''
+    query, stream_id, stream_data = match
     try:
-      ## use the query entity as the regex to apply exact match
-      if stream_id in self._doc_hash:
-        for query in self._doc_hash[stream_id]:
-          id = self._oair_doc_db.llen(RedisDB.ret_item_list)
-          if self._write_to_db:
-            self._oair_doc_db.rpush(RedisDB.ret_item_list, id)
-
-          ## create a hash record
-          ret_item = {'id' : id}
-          ret_item['query'] = query
-          ret_item['file'] = fname
-          ret_item['stream_id'] = stream_id
-          ret_item['stream_data'] = stream_data
-          ret_item['score'] = 1000
-          if self._write_to_db:
-            self._oair_doc_db.hmset(id, ret_item)
-
-          ## verbose output
-          print 'Match: %d - %s - %s' %(id, query, stream_id)
+      ## create a hash record
+      ret_item = {}
+      ret_item['query'] = query
+      ret_item['file'] = os.path.basename(fpath)
+      ret_item['stream_id'] = stream_id
+      ret_item['stream_data'] = stream_data
+      ret_item['score'] = 1000
+      if self._write_to_db:
+        self._sink.add(ret_item)
+
+      ## verbose output
+      print 'Match: %s - %s' %(query, stream_id)
     except:
       # Catch any unicode errors while printing to console
       # and just ignore them to avoid breaking application.
-      print "Exception in process_stream_item()"
+      print "Exception in save_match()"
       print '-'*60
       traceback.print_exc(file=sys.stdout)
       print '-'*60
       pass
 
-  def parse_thift_data(self, thrift_dir):
+  def match_file(self, fpath):
     '''
-    Parse the thift data in a given directory, apply exact matching over
-    the streaming documents
+    collect the listed documents of one thrift file, runs in the worker
+    processes
     '''
-    for fname in os.listdir(thrift_dir):
-      ## ignore other files, e.g. stats.json
-      if fname.endswith('.gpg'): continue
-      if fname.endswith('.xz'): continue
-
-      ## verbose output
-      print 'Process %s' % fname
+    matches = []
+    ## iterate over all thrift items
+    for stream_item in corpus.read_stream_items(fpath,
+        fields=['stream_id', 'body.cleansed']):
+      ## process data
+      matches.extend(self.match_stream_item(stream_item.stream_id,
+        stream_item.body.cleansed))
 
-      ### reverse the steps from above:
-      ## load the encrypted data
-      fpath = os.path.join(thrift_dir, fname)
-      thrift_data = open(fpath).read()
+    return matches
 
-      assert len(thrift_data) > 0, "failed to load: %s" % fpath
-
-      ## wrap it in a file obj, thrift transport, and thrift protocol
-      transport = StringIO(thrift_data)
-      transport.seek(0)
-      transport = TTransport.TBufferedTransport(transport)
-      protocol = TBinaryProtocol.TBinaryProtocol(transport)
-
-      ## iterate over all thrift items
-      while 1:
-        stream_item = StreamItem()
-        try:
-          stream_item.read(protocol)
-        except EOFError:
-          break
-
-        ## process data
-        self.process_stream_item(fname, stream_item.stream_id, stream_item.body.cleansed)
-        ## suppress the verbose output
-        #print '%s' % stream_item.doc_id
-
-      ## close that transport
-      transport.close()
-
-      # free memory
-      thrift_data = None
+  def parse_thift_data(self, thrift_dirs, num_workers=None, batch_size=500):
+    '''
+    Parse the thift data in the given directories and collect the listed
+    documents with a pool of worker processes
+    '''
+    ## the documents are buffered and saved in batches by the writer
+    self._sink = ResultSink(self._oair_doc_db, RedisDB.ret_item_list,
+        batch_size, first_id=0)
+    scanner.scan(thrift_dirs, self.match_file, self.save_match, num_workers)
+    self._sink.flush()
 
 def main():
   import argparse
   parser = argparse.ArgumentParser(usage=__doc__)
   parser.add_argument('doc_list')
-  parser.add_argument('thrift_dir')
+  parser.add_argument('thrift_dir', nargs='+')
+  parser.add_argument('--workers', type=int, default=None,
+      help='number of worker processes, defaults to the number of cores')
+  parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+      help='number of documents written to the DB at once')
   args = parser.parse_args()
 
   match = FuzzyMatch()
   match.parse_doc_list(args.doc_list)
-  match.parse_thift_data(args.thrift_dir)
+  match.parse_thift_data(args.thrift_dir, args.workers, args.batch_size)
 
 if __name__ == '__main__':
   try:
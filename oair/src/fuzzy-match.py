@@ -39,6 +39,7 @@ from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
 
 import redis
 from config import RedisDB
+import normalize
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
@@ -97,39 +98,13 @@ class FuzzyMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query )
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query )
-
-    ## compress multiple spaces to single one
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query )
-
-    space_regex = re.compile ( '^\s+' )
-    query = space_regex.sub( '', query )
-
-    space_regex = re.compile ( '\s+$' )
-    query = space_regex.sub( '', query )
-
-    return query.lower()
+    return normalize.format_query(query, strip=True)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str )
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str )
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def fuzzy_match(self, index, doc):
     '''
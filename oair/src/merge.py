@@ -12,6 +12,7 @@ import datetime
 
 import redis
 from config import RedisDB
+from sink import ResultSink
 
 from thrift import Thrift
 from thrift.transport import TTransport
@@ -95,11 +96,12 @@ class Merger():
 
     print 'Saving %d merged results' % num
 
+    ## the merged results keep their ids, they are saved in batches
+    sink = ResultSink(self._merge_db, RedisDB.ret_item_list)
     for ret_item in self._ret_items:
-      id = ret_item['id']
-      print '%s / %d ' %( id, num )
-      self._merge_db.rpush(RedisDB.ret_item_list, id)
-      self._merge_db.hmset(id, ret_item)
+      sink.add(ret_item)
+    sink.flush()
+    print '%d saved' % sink.num_saved
 
     print 'Done.'
 
@@ -24,6 +24,7 @@ from cStringIO import StringIO
 import redis
 import csv
 from config import RedisDB
+import normalize
 
 QUERY_ENT_MATCH_SCORE = 100
 WIKI_ENT_MATCH_SCORE = 1
@@ -84,19 +85,7 @@ class WikiMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    return query.lower()
+    return normalize.format_query(query)
 
   def load_annotation (self, path_to_annotation_file, include_relevant, include_neutral):
     '''
@@ -147,15 +136,7 @@ class WikiMatch():
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def load_wiki_ent(self):
     num = self._wiki_ent_list_db.llen(RedisDB.wiki_ent_list)
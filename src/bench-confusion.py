@@ -0,0 +1,111 @@
+#!/usr/bin/python
+'''
+benchmark the confusion matrices of a scored run, the former loops over the
+cutoffs against the confusion module, on random runs
+
+bench-confusion.py [--docs N] [--judged N] [--max-score N] [--step N]
+                   [--rounds N] [--seed N]
+'''
+
+import time
+import random
+
+import confusion
+
+def old_score_confusion_matrix(scored_doc_list, annotation, cutoffs,
+    unannotated_is_TN):
+  CM = dict()
+  for cutoff in cutoffs:
+    CM[cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
+
+  for did in scored_doc_list:
+    score = scored_doc_list[did]
+    in_annotation_set = did in annotation
+    if in_annotation_set and annotation[did]:
+      for cutoff in cutoffs:
+        if score > cutoff:
+          CM[cutoff]['TP'] += 1
+    elif in_annotation_set or unannotated_is_TN:
+      for cutoff in cutoffs:
+        if score > cutoff:
+          CM[cutoff]['FP'] += 1
+        else:
+          CM[cutoff]['TN'] += 1
+
+  annotation_positives = 0
+  for did in annotation:
+    annotation_positives += annotation[did]
+  for cutoff in CM:
+    CM[cutoff]['FN'] = annotation_positives - CM[cutoff]['TP']
+  return CM
+
+def random_run(num_docs, num_judged, max_score, integer):
+  '''
+  ({did: score}, {did: rel}), some of the judged documents not being in the
+  run
+  '''
+  dids = ['%d-%032x' %(random.randint(1317995000, 1338508000),
+      random.getrandbits(128)) for i in range(num_docs + num_judged // 4)]
+  scored_doc_list = {}
+  for did in dids[:num_docs]:
+    if integer:
+      scored_doc_list[did] = random.randint(0, max_score)
+    else:
+      scored_doc_list[did] = random.uniform(0, max_score)
+  annotation = {}
+  for did in random.sample(dids, num_judged):
+    annotation[did] = random.randint(0, 1)
+  return scored_doc_list, annotation
+
+def bench(func, rounds):
+  '''
+  the seconds of the best of several calls of func
+  '''
+  best = None
+  for round in range(rounds):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(usage=__doc__)
+  parser.add_argument('--docs', type=int, default=20000)
+  parser.add_argument('--judged', type=int, default=2000)
+  parser.add_argument('--max-score', type=int, default=100, dest='max_score')
+  parser.add_argument('--step', type=int, default=1,
+      help='increment between the cutoffs of [0, max-score)')
+  parser.add_argument('--rounds', type=int, default=3)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  cutoffs = range(0, args.max_score, args.step)
+
+  ## the results have to be the same before anything is measured, with
+  ## integer scores equal to the cutoffs and with float ones
+  for integer in [True, False]:
+    scored_doc_list, annotation = random_run(args.docs, args.judged,
+        args.max_score, integer)
+    for unannotated_is_TN in [False, True]:
+      assert confusion.score_confusion_matrix(scored_doc_list, annotation,
+          cutoffs, unannotated_is_TN) == old_score_confusion_matrix(
+          scored_doc_list, annotation, cutoffs, unannotated_is_TN)
+
+  print '%d documents, %d judged, %d cutoffs' %(len(scored_doc_list),
+      len(annotation), len(cutoffs))
+  for name, func in [
+      ('loops', old_score_confusion_matrix),
+      ('sorted', confusion.score_confusion_matrix)]:
+    elapsed = bench(lambda: func(scored_doc_list, annotation, cutoffs, True),
+        args.rounds)
+    print '%-8s %.3f s' %(name, elapsed)
+
+if __name__ == '__main__':
+  try:
+    main()
+  except KeyboardInterrupt:
+    print '\nGoodbye!'
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+'''
+benchmark the text normalization of the documents and of the entity names,
+the former regular expressions against the normalize module
+
+bench-normalize.py <chunk_file> [--rounds N] [--names N]
+'''
+
+import re
+import time
+
+import corpus
+import normalize
+
+def old_sanitize(str):
+  non_word_regex = re.compile( '(\W+|\_+)' )
+  str = non_word_regex.sub( ' ', str)
+  space_regex = re.compile ( '\s+' )
+  str = space_regex.sub( ' ', str)
+  return str.lower()
+
+def old_format_query(query):
+  parentheses_regex = re.compile( '\(.*\)' )
+  query = parentheses_regex.sub( '', query)
+  return old_sanitize(query)
+
+def bench(func, texts, rounds):
+  '''
+  apply func to all the texts several times, return the seconds of the best
+  round
+  '''
+  best = None
+  for round in range(rounds):
+    start = time.time()
+    for text in texts:
+      func(text)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(usage=__doc__)
+  parser.add_argument('chunk_file')
+  parser.add_argument('--rounds', type=int, default=3)
+  parser.add_argument('--names', type=int, default=200,
+      help='number of distinct entity names, each formatted once per document')
+  args = parser.parse_args()
+
+  docs = [stream_item.body.cleansed for stream_item
+      in corpus.read_stream_items(args.chunk_file, fields=['body.cleansed'])
+      if stream_item.body and stream_item.body.cleansed]
+  size = sum(len(doc) for doc in docs)
+
+  ## the results have to be the same before anything is measured
+  for doc in docs:
+    assert normalize.sanitize(doc) == old_sanitize(doc)
+
+  ## the names are made of the words of the documents, as many times as
+  ## they would be formatted when each of them is looked up in each document
+  words = ' '.join(docs[:10]).split()[:args.names] or ['entity']
+  names = ['%s (%d)' %(word, i) for i, word in enumerate(words)] * len(docs)
+
+  print '%d documents, %.1f MB' %(len(docs), size / 1048576.0)
+  for name, func, texts in [
+      ('sanitize re', old_sanitize, docs),
+      ('sanitize', normalize.sanitize, docs),
+      ('format re', old_format_query, names),
+      ('format', normalize.format_query, names)]:
+    elapsed = bench(func, texts, args.rounds)
+    print '%-12s %8d texts in %.3f s : %10.1f texts/s' %(name, len(texts),
+        elapsed, len(texts) / max(elapsed, 1e-9))
+
+if __name__ == '__main__':
+  try:
+    main()
+  except KeyboardInterrupt:
+    print '\nGoodbye!'
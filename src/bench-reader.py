@@ -0,0 +1,61 @@
+#!/usr/bin/python
+'''
+benchmark the decoding of StreamItems from a chunk file, with the pure python
+protocol, with the C accelerated one and with a field projection
+
+bench-reader.py <chunk_file> [--rounds N] [--fields stream_id,body.cleansed]
+'''
+
+import sys
+import time
+
+import corpus
+
+def bench(fpath, accelerated, rounds, fields=None):
+  '''
+  decode the whole file several times, return (items, seconds) of the best
+  round
+  '''
+  best = None
+  num = 0
+  for round in range(rounds):
+    start = time.time()
+    num = 0
+    for stream_item in corpus.read_stream_items(fpath, accelerated, fields):
+      num += 1
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return num, best
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(usage=__doc__)
+  parser.add_argument('chunk_file')
+  parser.add_argument('--rounds', type=int, default=3)
+  parser.add_argument('--fields', default=None,
+      help='comma separated list of fields to decode, e.g. stream_id,body.cleansed')
+  args = parser.parse_args()
+
+  modes = [('python', False)]
+  if corpus.ACCELERATED:
+    modes.append(('fastbinary', True))
+  else:
+    print 'fastbinary can not be loaded, only the python path is measured'
+
+  if args.fields:
+    modes.append(('projected', False))
+
+  for name, accelerated in modes:
+    fields = None
+    if name == 'projected':
+      fields = args.fields.split(',')
+    num, elapsed = bench(args.chunk_file, accelerated, args.rounds, fields)
+    print '%-12s %6d items in %.3f s : %10.1f items/s' %(name, num, elapsed,
+        num / max(elapsed, 1e-9))
+
+if __name__ == '__main__':
+  try:
+    main()
+  except KeyboardInterrupt:
+    print '\nGoodbye!'
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+'''
+Build the document frequencies of the wiki entities in one pass over the
+doc-list-<ent_id> lists collected by collect-ent-dist-v2.py; the documents
+which match no entity are counted from the exact match DB of the split
+
+build-df-table.py <train|test>
+'''
+
+import sys
+from collections import defaultdict
+
+import redis
+from config import RedisDB
+import dftable
+
+def log(m, newline='\n'):
+  sys.stderr.write(m + newline)
+  sys.stderr.flush()
+
+class DFTableBuilder():
+  '''
+  Count the documents of each wiki entity
+  '''
+
+  _wiki_ent_list_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
+      db=RedisDB.wiki_ent_list_db)
+
+  _exact_match_dbs = {
+      dftable.TRAIN: redis.Redis(host=RedisDB.host, port=RedisDB.port,
+          db=RedisDB.train_exact_match_db),
+      dftable.TEST: redis.Redis(host=RedisDB.host, port=RedisDB.port,
+          db=RedisDB.test_exact_match_db)}
+
+  _wiki_ent_dist_dbs = {
+      dftable.TRAIN: redis.Redis(host=RedisDB.host, port=RedisDB.port,
+          db=RedisDB.train_wiki_ent_dist_db),
+      dftable.TEST: redis.Redis(host=RedisDB.host, port=RedisDB.port,
+          db=RedisDB.wiki_ent_dist_db)}
+
+  def collect(self, split, batch_size=100):
+    '''
+    {stream_id: [ent_id, ...]} of all the documents of a split
+    '''
+    ent_ids = defaultdict(list)
+
+    # all the documents, whether they match entities or not
+    exact_match_db = self._exact_match_dbs[split]
+    ret_ids = exact_match_db.lrange(RedisDB.ret_item_list, 0, -1)
+    for start in xrange(0, len(ret_ids), batch_size * 10):
+      pipe = exact_match_db.pipeline(transaction=False)
+      for ret_id in ret_ids[start:start + batch_size * 10]:
+        pipe.hget(ret_id, 'stream_id')
+      for stream_id in pipe.execute():
+        if stream_id is not None:
+          ent_ids[stream_id]
+    log('%d documents' % len(ent_ids))
+
+    # the entries of each list are <stream_id>:<doc_len>:<match_num>
+    wiki_ent_dist_db = self._wiki_ent_dist_dbs[split]
+    ent_list = self._wiki_ent_list_db.lrange(RedisDB.wiki_ent_list, 0, -1)
+    for start in xrange(0, len(ent_list), batch_size):
+      batch = ent_list[start:start + batch_size]
+      pipe = wiki_ent_dist_db.pipeline(transaction=False)
+      for ent_id in batch:
+        pipe.lrange('doc-list-%s' % ent_id, 0, -1)
+      for ent_id, item_list in zip(batch, pipe.execute()):
+        for item in item_list:
+          ent_ids[item.split(':')[0]].append(ent_id)
+    log('%d entities, %d documents' %(len(ent_list), len(ent_ids)))
+
+    return ent_ids
+
+  def build(self, split):
+    ent_ids = self.collect(split)
+
+    table = dftable.DFTable(self._wiki_ent_list_db)
+    table.clear(split)
+    table.add_docs(split, ent_ids.iteritems())
+    log('%s: %d documents' %(split, table.doc_num([split])))
+
+    # the cached distributions of dist-server.py are stale now
+    self._wiki_ent_list_db.incr(RedisDB.dist_version)
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(usage=__doc__)
+  parser.add_argument('split', choices=dftable.SPLITS)
+  args = parser.parse_args()
+
+  builder = DFTableBuilder()
+  builder.build(args.split)
+
+if __name__ == '__main__':
+  try:
+    main()
+  except KeyboardInterrupt:
+    print '\nGoodbye!'
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+'''
+build the stream_id -> (date-hour, file, byte offset) index of the corpus,
+one index file per date-hour directory
+
+build-index.py <corpus_dir> <index_dir> [<date_hour> ...] [--workers N] [--force]
+'''
+
+import os
+import sys
+
+import corpus
+import scanner
+import stream_index
+
+def index_file(fpath):
+  '''
+  collect (stream_id, offset) of all the items of a chunk file, runs in the
+  worker processes
+  '''
+  return [(stream_id, offset) for offset, stream_id
+      in corpus.read_stream_item_offsets(fpath)]
+
+class IndexBuilder():
+  '''
+  Build the index of each date-hour directory
+  '''
+
+  def __init__(self, index_dir):
+    self._index_dir = index_dir
+    self._entries = []
+
+  def add_entry(self, fpath, entry):
+    stream_id, offset = entry
+    self._entries.append((stream_id, os.path.basename(fpath), offset))
+
+  def build(self, date_dir, num_workers=None):
+    date_hour = os.path.basename(os.path.normpath(date_dir))
+    path = stream_index.index_path(self._index_dir, date_hour)
+
+    self._entries = []
+    scanner.scan(date_dir, index_file, self.add_entry, num_workers)
+
+    valid = []
+    for entry in self._entries:
+      try:
+        stream_index.pack_key(entry[0])
+        valid.append(entry)
+      except ValueError:
+        print 'Skipping invalid stream_id %s in %s' %(entry[0], entry[1])
+
+    stream_index.write_index(path, valid)
+    print 'Indexed %d items of %s' %(len(valid), date_hour)
+    self._entries = []
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(usage=__doc__)
+  parser.add_argument('corpus_dir')
+  parser.add_argument('index_dir')
+  parser.add_argument('date_hour', nargs='*')
+  parser.add_argument('--workers', type=int, default=None,
+      help='number of worker processes, defaults to the number of cores')
+  parser.add_argument('--force', default=False, action='store_true',
+      help='rebuild the indexes which already exist')
+  args = parser.parse_args()
+
+  if not os.path.exists(args.index_dir):
+    os.makedirs(args.index_dir)
+
+  date_hours = args.date_hour
+  if not date_hours:
+    date_hours = sorted(fname for fname in os.listdir(args.corpus_dir)
+        if os.path.isdir(os.path.join(args.corpus_dir, fname)))
+
+  builder = IndexBuilder(args.index_dir)
+  for date_hour in date_hours:
+    path = stream_index.index_path(args.index_dir, date_hour)
+    if os.path.exists(path) and not args.force:
+      print 'Skipping %s' % date_hour
+      continue
+    builder.build(os.path.join(args.corpus_dir, date_hour), args.workers)
+
+if __name__ == '__main__':
+  try:
+    main()
+  except KeyboardInterrupt:
+    print '\nGoodbye!'
@@ -25,6 +25,10 @@ from cStringIO import StringIO
 
 import redis
 from config import RedisDB
+import normalize
+import tokens
+from loader import iter_ret_items
+import dftable
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
@@ -50,6 +54,12 @@ class EntDistCollector():
       db=RedisDB.train_wiki_ent_dist_db)
       #db=RedisDB.wiki_ent_dist_db)
 
+  # the split of the document frequencies, the same as the DBs
+  _split = dftable.TRAIN
+  #_split = dftable.TEST
+
+  _df_table = dftable.DFTable(_wiki_ent_list_db)
+
   def parse_query(self, query_file):
     '''
     parse the query
@@ -72,33 +82,13 @@ class EntDistCollector():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    return query.lower()
+    return normalize.format_query(query)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def load_wiki_ent(self):
     num = self._wiki_ent_list_db.llen(RedisDB.wiki_ent_list)
@@ -116,14 +106,18 @@ class EntDistCollector():
       ent = self.format_query(ent)
       self._wiki_ent_hash[ent_id] = ent
 
-  def process_stream_item(self, ret_id, query, stream_id, stream_data):
+  def process_stream_item(self, ret_id, query, stream_id, stream_data,
+      doc=None):
     '''
     process the streaming item: applying exact match for each of the related
     entities
     '''
-    doc = self.sanitize(stream_data)
+    ## doc is the sanitized stream_data, when it has been tokenized already
+    if doc is None:
+      doc = self.sanitize(stream_data)
     doc_len = len(doc.split(' '))
 
+    ent_ids = []
     for id in self._wiki_ent_hash:
       try:
         ent = self._wiki_ent_hash[id]
@@ -136,6 +130,7 @@ class EntDistCollector():
           list_name = 'doc-list-%s' % id
           val = '%s:%d:%s' %(stream_id, doc_len, match_num)
           self._wiki_ent_dist_db.lpush(list_name, val)
+          ent_ids.append(id)
           print '%s %s-%s : %s' %(ret_id, id, ent, val)
       except:
         # Catch any unicode errors while printing to console
@@ -146,7 +141,11 @@ class EntDistCollector():
         print '-'*60
         exit(-1)
 
-  def process_stream_item_query(self, ret_id, query, stream_id, stream_data):
+    # the document is counted once, whether it matches entities or not
+    self._df_table.add_doc(self._split, stream_id, ent_ids)
+
+  def process_stream_item_query(self, ret_id, query, stream_id, stream_data,
+      doc=None):
     '''
     process the streaming item: applying exact match for each of the query
     entities
@@ -161,7 +160,9 @@ class EntDistCollector():
     #if not qid in qid_list:
       #return
 
-    doc = self.sanitize(stream_data)
+    ## doc is the sanitized stream_data, when it has been tokenized already
+    if doc is None:
+      doc = self.sanitize(stream_data)
     doc_len = len(doc.split(' '))
 
     try:
@@ -195,24 +196,19 @@ class EntDistCollector():
       print 'no ret_item found'
       return
 
-    ret_item_list = self._exact_match_db.lrange(RedisDB.ret_item_list, 0, num)
-    ret_items = []
-    for ret_id in ret_item_list:
-      ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data']
-      the_ret_item = self._exact_match_db.hmget(ret_id, ret_item_keys)
-
-      ret_item = {}
-      ret_item['id'] = the_ret_item[0]
-      ret_item['query'] = the_ret_item[1]
-      ret_item['file'] = the_ret_item[2]
-      ret_item['stream_id'] = the_ret_item[3]
-      ret_item['stream_data'] = the_ret_item[4]
-
+    vocab = tokens.Vocabulary(self._exact_match_db)
+    ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data',
+        'tokens']
+    for ret_id, ret_item in iter_ret_items(self._exact_match_db,
+        RedisDB.ret_item_list, ret_item_keys):
       ## process data
       self.process_stream_item_query(ret_id, ret_item['query'], ret_item['stream_id'],
-          ret_item['stream_data'])
+          ret_item['stream_data'], vocab.doc_text(ret_item))
       #self.process_stream_item(ret_id, ret_item['query'], ret_item['stream_id'],
-          #ret_item['stream_data'])
+          #ret_item['stream_data'], vocab.doc_text(ret_item))
+
+    # the cached distributions of dist-server.py are stale now
+    self._wiki_ent_list_db.incr(RedisDB.dist_version)
 
 def main():
   import argparse
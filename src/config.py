@@ -53,5 +53,8 @@ class RedisDB(object):
     query_ent_list = 'query_ent_list'
     wiki_ent_set = 'wiki_ent_set'
 
+    # bumped when the entity distributions have been collected again
+    dist_version = 'dist_version'
+
     # mutex
     async_mutex = 'async_mutex'
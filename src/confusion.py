@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Confusion matrices of a scored run at every cutoff of a grid
+
+A document is kept at a cutoff if its score is above it. Instead of comparing
+every document with every cutoff, the scores of the relevant, the non
+relevant and the unjudged documents are each sorted once, and the number of
+them above a cutoff is found by bisection:
+
+  TP  relevant documents above the cutoff
+  FP  non relevant (and unjudged, if they are negatives) documents above it
+  TN  non relevant (and unjudged, if they are negatives) documents below it
+  FN  relevant documents of the annotation set, minus TP
+
+which is O(n log n + cutoffs log n) instead of O(n x cutoffs), for any grid of
+cutoffs. The counts are the same as the ones of the loops over the cutoffs.
+'''
+
+import json
+from bisect import bisect_right
+
+END_OF_2012 = 1325375999
+
+## the default grid, of the runs scored in [0, 100]
+CUTOFFS = range(0, 100, 1)
+
+def count_above(scores, cutoffs):
+  '''
+  the number of scores above each cutoff
+  '''
+  scores = sorted(scores)
+  num = len(scores)
+  return [num - bisect_right(scores, cutoff) for cutoff in cutoffs]
+
+def confusion_matrix(rel_scores, non_scores, positives, cutoffs=CUTOFFS,
+    unjudged_scores=None):
+  '''
+  {cutoff: dict(TP, FP, FN, TN)} from the scores of the relevant and of the
+  non relevant documents of a run, and the number of relevant documents of
+  the annotation set. The unjudged documents are counted as negatives if
+  their scores are given.
+  '''
+  cutoffs = list(cutoffs)
+  rel_above = count_above(rel_scores, cutoffs)
+  non_above = count_above(non_scores, cutoffs)
+  num_non = len(non_scores)
+  if unjudged_scores is not None:
+    unjudged_above = count_above(unjudged_scores, cutoffs)
+    non_above = [a + b for a, b in zip(non_above, unjudged_above)]
+    num_non += len(unjudged_scores)
+
+  CM = dict()
+  for cutoff, TP, FP in zip(cutoffs, rel_above, non_above):
+    CM[cutoff] = dict(TP=TP, FP=FP, FN=positives - TP, TN=num_non - FP)
+  return CM
+
+def score_confusion_matrix(scored_doc_list, annotation, cutoffs=CUTOFFS,
+    unannotated_is_TN=False, debug=False):
+  '''
+  the confusion matrices of {did: score} against the annotation {did: rel},
+  the dids being stream ids
+
+  returns {cutoff: dict(TP, FP, FN, TN)}
+  '''
+  ## count the total number of assertions per entity
+  num_assertions = {'total': 0,
+                    'in_TTR': 0,
+                    'in_ETR': 0,
+                    'in_annotation_set': 0}
+
+  rel_scores = []
+  non_scores = []
+  unjudged_scores = []
+  for did, score in scored_doc_list.iteritems():
+    num_assertions['total'] += 1
+    if int(did.split('-')[0]) <= END_OF_2012:
+      num_assertions['in_TTR'] += 1
+    else:
+      num_assertions['in_ETR'] += 1
+
+    if did in annotation:
+      num_assertions['in_annotation_set'] += 1
+      if annotation[did]:
+        rel_scores.append(score)
+      else:
+        non_scores.append(score)
+    else:
+      unjudged_scores.append(score)
+
+  ## FN+TP is the number of true things in the annotation set, whether they
+  ## are in the run or not
+  positives = 0
+  for did in annotation:
+    positives += annotation[did]
+
+  if not unannotated_is_TN:
+    unjudged_scores = None
+  CM = confusion_matrix(rel_scores, non_scores, positives, cutoffs,
+      unjudged_scores)
+
+  if debug:
+    print 'showing assertion counts:'
+    print json.dumps(num_assertions, indent=4, sort_keys=True)
+
+  return CM
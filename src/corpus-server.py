@@ -16,6 +16,7 @@ import tornado.httpserver
 
 import redis
 from config import RedisDB
+import dbpool
 from tornado.options import define, options
 
 from thrift import Thrift
@@ -23,8 +24,15 @@ from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
 from cStringIO import StringIO
 from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
+import corpus
+import stream_index
 
 define("port", default=8888, help="run on the given port", type=int)
+define("index_dir", default="./corpus/index",
+    help="directory of the stream_id index built by build-index.py", type=str)
+define("db_threads", default=dbpool.POOL_SIZE,
+    help="number of threads running the blocking work of the requests",
+    type=int)
 
 #corpus_dir = './uncompressed/training'
 
@@ -55,12 +63,37 @@ class Doc(dict):
     except KeyError:
       raise AttributeError(name)
 
+def read_indexed_item(application, date_dir, target_id, fname=None):
+  '''
+  read a document straight from its offset when its stream_id is indexed,
+  returns (fname, stream_item), or None to fall back to scanning the files
+  '''
+  location = application.stream_index.locate(target_id)
+  if location is None:
+    return None
+
+  date, indexed_fname, offset = location
+  if fname is not None and fname != indexed_fname:
+    return None
+
+  try:
+    fpath = os.path.join(date_dir, indexed_fname)
+    stream_item = corpus.read_stream_item(fpath, offset)
+  except IOError:
+    return None
+
+  ## the index is out of date
+  if stream_item.stream_id != target_id:
+    return None
+  return indexed_fname, stream_item
+
 class HomeHandler(tornado.web.RequestHandler):
   def get(self):
 
     self.render("index.html", title="KBA")
 
-class BrowseHandler(tornado.web.RequestHandler):
+class BrowseHandler(dbpool.PoolHandler):
+  @dbpool.blocking
   def get(self):
 
     dirs = []
@@ -74,7 +107,8 @@ class BrowseHandler(tornado.web.RequestHandler):
     self.render("corpus-index.html", title="KBA", dirs=dirs)
 
 
-class DateHandler(tornado.web.RequestHandler):
+class DateHandler(dbpool.PoolHandler):
+  @dbpool.blocking
   def get(self, date):
     date_dir = os.path.join(corpus_dir, date)
 
@@ -96,48 +130,33 @@ class DateHandler(tornado.web.RequestHandler):
 
     self.render("date-index.html", title=date, files=files, date=date)
 
-class FileHandler(tornado.web.RequestHandler):
+class FileHandler(dbpool.PoolHandler):
+  @dbpool.blocking
   def get(self, date, file):
 
     ## load the thrift data
     fpath = os.path.join(corpus_dir, date, file)
-    thrift_data = open(fpath).read()
-
-    if not len(thrift_data) > 0:
-      msg = 'failed to load: %s' % fpath
-      #raise tornado.web.HTTPError(404, log_message=msg)
-      self.render("error.html", msg=msg)
-      return
-
-    ## wrap it in a file obj, thrift transport, and thrift protocol
-    transport = StringIO(thrift_data)
-    transport.seek(0)
-    transport = TTransport.TBufferedTransport(transport)
-    protocol = TBinaryProtocol.TBinaryProtocol(transport)
 
     docs = []
-    ## iterate over all thrift items
-    while 1:
-      stream_item = StreamItem()
-      try:
-        stream_item.read(protocol)
+    try:
+      ## iterate over all thrift items
+      for stream_item in corpus.read_stream_items(fpath,
+          fields=['stream_id', 'stream_time']):
         doc = Doc()
         doc.id = stream_item.stream_id
         doc.epoch = stream_item.stream_time.epoch_ticks
         doc.time = datetime.datetime.utcfromtimestamp(doc.epoch).ctime()
         docs.append(doc)
-      except EOFError:
-        break
-
-    ## close that transport
-    transport.close()
-
-    # free memory
-    thrift_data = None
+    except IOError:
+      msg = 'failed to load: %s' % fpath
+      #raise tornado.web.HTTPError(404, log_message=msg)
+      self.render("error.html", msg=msg)
+      return
 
     self.render("file-index.html", title=file, date=date, file=file, docs=docs)
 
-class DocHandler(tornado.web.RequestHandler):
+class DocHandler(dbpool.PoolHandler):
+  @dbpool.blocking
   def get(self, date, file, epoch, doc_id):
     date_dir = os.path.join(corpus_dir, date)
     target_id = '%s-%s' %(epoch, doc_id)
@@ -157,38 +176,36 @@ class DocHandler(tornado.web.RequestHandler):
     doc['time'] = datetime.datetime.utcfromtimestamp(float(epoch)).ctime()
     doc['id'] = target_id
 
-    fpath = os.path.join(date_dir, file)
-    thrift_data = open(fpath).read()
-
-    if not len(thrift_data) > 0:
-      msg = 'failed to load: %s' % fpath
-      #raise tornado.web.HTTPError(404, log_message=msg)
-      self.render("error.html", msg=msg)
+    ## seek straight to the document when it is indexed
+    indexed = read_indexed_item(self.application, date_dir, target_id, file)
+    if indexed is not None:
+      fname, stream_item = indexed
+      doc['title'] = stream_item.title.cleansed
+      doc['body'] = stream_item.body.cleansed
+      doc['anchor'] = stream_item.anchor.cleansed
+      self.render("doc.html", title=doc_id, doc=doc)
       return
 
-    ## wrap it in a file obj, thrift transport, and thrift protocol
-    transport = StringIO(thrift_data)
-    transport.seek(0)
-    transport = TTransport.TBufferedTransport(transport)
-    protocol = TBinaryProtocol.TBinaryProtocol(transport)
+    fpath = os.path.join(date_dir, file)
 
-    ## iterate over all thrift items
-    while 1:
-      stream_item = StreamItem()
-      try:
-        stream_item.read(protocol)
+    try:
+      ## iterate over all thrift items
+      for stream_item in corpus.read_stream_items(fpath):
         if stream_item.stream_id == target_id:
-          found = True
           doc['title'] = stream_item.title.cleansed
           doc['body'] = stream_item.body.cleansed
           doc['anchor'] = stream_item.anchor.cleansed
           break
-      except EOFError:
-        break
+    except IOError:
+      msg = 'failed to load: %s' % fpath
+      #raise tornado.web.HTTPError(404, log_message=msg)
+      self.render("error.html", msg=msg)
+      return
 
     self.render("doc.html", title=doc_id, doc=doc)
 
-class SearchHandler(tornado.web.RequestHandler):
+class SearchHandler(dbpool.PoolHandler):
+  @dbpool.blocking
   def get(self, epoch, id):
     time = datetime.datetime.utcfromtimestamp(float(epoch))
     date = '%d-%.2d-%.2d-%.2d' %(time.year, time.month, time.day, time.hour)
@@ -219,33 +236,29 @@ class SearchHandler(tornado.web.RequestHandler):
     #self.write('searching')
     #self.flush()
 
+    ## seek straight to the document when it is indexed
+    indexed = read_indexed_item(self.application, date_dir, target_id)
+    if indexed is not None:
+      fname, stream_item = indexed
+      doc['title'] = stream_item.title.cleansed
+      doc['body'] = stream_item.body.cleansed
+      doc['anchor'] = stream_item.anchor.cleansed
+      doc['file'] = fname
+      self.render("doc.html", title=target_id, doc=doc)
+      return
+
     for fname in os.listdir(date_dir):
       ## ignore other files
       if fname.endswith('.gpg'): continue
       if fname.endswith('.xz'): continue
 
       fpath = os.path.join(date_dir, fname)
-      thrift_data = open(fpath).read()
-
-      if not len(thrift_data) > 0:
-        msg = 'failed to load: %s' % fpath
-        #raise tornado.web.HTTPError(404, log_message=msg)
-        self.render("error.html", msg=msg)
-        return
-
-      ## wrap it in a file obj, thrift transport, and thrift protocol
-      transport = StringIO(thrift_data)
-      transport.seek(0)
-      transport = TTransport.TBufferedTransport(transport)
-      protocol = TBinaryProtocol.TBinaryProtocol(transport)
 
       found = False
 
-      ## iterate over all thrift items
-      while 1:
-        stream_item = StreamItem()
-        try:
-          stream_item.read(protocol)
+      try:
+        ## iterate over all thrift items
+        for stream_item in corpus.read_stream_items(fpath):
           if stream_item.stream_id == target_id:
             found = True
             doc['title'] = stream_item.title.cleansed
@@ -253,8 +266,11 @@ class SearchHandler(tornado.web.RequestHandler):
             doc['anchor'] = stream_item.anchor.cleansed
             doc['file'] = fname
             break
-        except EOFError:
-          break
+      except IOError:
+        msg = 'failed to load: %s' % fpath
+        #raise tornado.web.HTTPError(404, log_message=msg)
+        self.render("error.html", msg=msg)
+        return
 
       if found: break
 
@@ -284,6 +300,13 @@ class Application(tornado.web.Application):
 
     tornado.web.Application.__init__(self, handlers, **settings)
 
+    # the threads of the handlers reading the corpus, the IOLoop is never
+    # blocked
+    self._db_pool = dbpool.DBPool(options.db_threads)
+
+    # the stream_id index, shared by all handlers
+    self.stream_index = stream_index.CorpusIndex(options.index_dir)
+
 def main():
   tornado.options.parse_command_line()
   http_server = tornado.httpserver.HTTPServer(Application())
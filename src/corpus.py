@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Shared reader of the StreamItems stored in the thrift chunk files
+
+The generated code in kba_thrift.ttypes only decodes with the C extension
+(thrift/protocol/fastbinary.so) when the protocol is a
+TBinaryProtocolAccelerated over a CReadableTransport, so every reader of
+the corpus should go through here instead of building its own protocol.
+
+Chunk files are streamed through a fixed size buffer rather than read into
+memory as a whole, so the memory used by a reader is bounded by the size of
+the item being decoded, not by the size of the chunk file.
+'''
+
+import os
+
+from thrift.Thrift import TType
+from thrift.transport import TTransport
+from thrift.protocol import TBinaryProtocol
+
+from kba_thrift import ttypes
+from kba_thrift.ttypes import StreamItem
+
+# whether the C accelerated decoder could be loaded
+ACCELERATED = ttypes.fastbinary is not None
+
+# the size of the read buffer between the chunk file and the protocol
+READ_BUFFER_SIZE = 64 * 1024
+
+# the largest piece read at once when skipping over an unwanted string
+SKIP_CHUNK_SIZE = 64 * 1024
+
+# the reader method of the protocol for each primitive type
+_PRIMITIVE_READERS = {
+  TType.BOOL: 'readBool',
+  TType.BYTE: 'readByte',
+  TType.I16: 'readI16',
+  TType.I32: 'readI32',
+  TType.I64: 'readI64',
+  TType.DOUBLE: 'readDouble',
+  TType.STRING: 'readString',
+}
+
+class FilePositionTransport(TTransport.TFileObjectTransport):
+  '''
+  unbuffered transport over a file which knows its position, and skips
+  over data by seeking instead of reading it
+  '''
+
+  def tell(self):
+    return self.fileobj.tell()
+
+  def skip_bytes(self, size):
+    self.fileobj.seek(size, os.SEEK_CUR)
+
+def get_protocol(transport, accelerated=None):
+  '''
+  wrap a transport into a thrift protocol, using the accelerated
+  protocol whenever the C extension is available
+  '''
+  if accelerated is None:
+    accelerated = ACCELERATED
+
+  ## TBufferedTransport is a CReadableTransport, which fastbinary requires
+  transport = TTransport.TBufferedTransport(transport, READ_BUFFER_SIZE)
+  if accelerated and ACCELERATED:
+    return TBinaryProtocol.TBinaryProtocolAccelerated(transport)
+  return TBinaryProtocol.TBinaryProtocol(transport)
+
+def parse_fields(fields):
+  '''
+  turn a list of (dotted) field names, e.g. ['stream_id', 'body.cleansed'],
+  into the nested projection used by read_projected(); a field mapped to None
+  is read as a whole
+  '''
+  projection = {}
+  for field in fields:
+    names = field.split('.')
+    node = projection
+    for name in names[:-1]:
+      if node.get(name, {}) is None:
+        # the whole parent has already been requested
+        break
+      node = node.setdefault(name, {})
+    else:
+      node[names[-1]] = None
+  return projection
+
+def skip_string(iprot):
+  '''
+  skip over a string field in bounded pieces, without materializing it
+  '''
+  size = iprot.readI32()
+  skip_bytes = getattr(iprot.trans, 'skip_bytes', None)
+  if skip_bytes is not None:
+    skip_bytes(size)
+    return
+
+  while size > 0:
+    chunk = iprot.trans.read(min(size, SKIP_CHUNK_SIZE))
+    if not chunk:
+      raise EOFError()
+    size -= len(chunk)
+
+def skip_field(iprot, ftype):
+  '''
+  skip over a field of any type
+  '''
+  if ftype == TType.STRING:
+    skip_string(iprot)
+  elif ftype == TType.STRUCT:
+    iprot.readStructBegin()
+    while True:
+      (fname, ftype, fid) = iprot.readFieldBegin()
+      if ftype == TType.STOP:
+        break
+      skip_field(iprot, ftype)
+      iprot.readFieldEnd()
+    iprot.readStructEnd()
+  else:
+    iprot.skip(ftype)
+
+def read_projected(obj, iprot, projection):
+  '''
+  read a thrift struct into obj, only decoding the fields of the projection
+  and skipping all the others; the skipped fields are left to None
+  '''
+  spec = obj.thrift_spec
+  iprot.readStructBegin()
+  while True:
+    (fname, ftype, fid) = iprot.readFieldBegin()
+    if ftype == TType.STOP:
+      break
+
+    field = None
+    if 0 < fid < len(spec):
+      field = spec[fid]
+
+    if field is None or field[1] != ftype or field[2] not in projection:
+      skip_field(iprot, ftype)
+    elif ftype == TType.STRUCT:
+      value = field[3][0]()
+      if projection[field[2]] is None:
+        value.read(iprot)
+      else:
+        read_projected(value, iprot, projection[field[2]])
+      setattr(obj, field[2], value)
+    elif ftype in _PRIMITIVE_READERS:
+      setattr(obj, field[2], getattr(iprot, _PRIMITIVE_READERS[ftype])())
+    else:
+      skip_field(iprot, ftype)
+    iprot.readFieldEnd()
+  iprot.readStructEnd()
+
+def read_stream_items(fpath, accelerated=None, fields=None):
+  '''
+  iterate over all the StreamItems of a chunk file
+
+  with a list of fields, e.g. ['stream_id', 'body.cleansed'], only those
+  fields are decoded and everything else is skipped in the binary protocol
+  '''
+  projection = None
+  if fields is not None:
+    projection = parse_fields(fields)
+
+  if not os.path.getsize(fpath) > 0:
+    raise IOError('failed to load: %s' % fpath)
+
+  ## stream the file through a thrift transport and protocol, only the
+  ## buffer and the item being decoded are held in memory
+  fileobj = open(fpath, 'rb')
+  transport = TTransport.TFileObjectTransport(fileobj)
+  protocol = get_protocol(transport, accelerated)
+
+  ## iterate over all thrift items
+  try:
+    while 1:
+      stream_item = StreamItem()
+      try:
+        if projection is None:
+          stream_item.read(protocol)
+        else:
+          read_projected(stream_item, protocol, projection)
+      except EOFError:
+        break
+      yield stream_item
+  finally:
+    ## close that transport, and the file with it
+    protocol.trans.close()
+
+def read_stream_item(fpath, offset, accelerated=None, fields=None):
+  '''
+  read the single StreamItem starting at the given byte offset of a chunk
+  file, e.g. as located by the stream index
+  '''
+  fileobj = open(fpath, 'rb')
+  try:
+    fileobj.seek(offset)
+    protocol = get_protocol(TTransport.TFileObjectTransport(fileobj),
+        accelerated)
+
+    stream_item = StreamItem()
+    try:
+      if fields is None:
+        stream_item.read(protocol)
+      else:
+        read_projected(stream_item, protocol, parse_fields(fields))
+    except EOFError:
+      raise IOError('no stream item at %s:%d' % (fpath, offset))
+    return stream_item
+  finally:
+    fileobj.close()
+
+def read_stream_item_offsets(fpath):
+  '''
+  iterate over (offset, stream_id) of all the StreamItems of a chunk file,
+  every other field is skipped by seeking over it
+  '''
+  size = os.path.getsize(fpath)
+
+  fileobj = open(fpath, 'rb')
+  transport = FilePositionTransport(fileobj)
+  protocol = TBinaryProtocol.TBinaryProtocol(transport)
+  projection = {'stream_id': None}
+
+  try:
+    while 1:
+      offset = transport.tell()
+      if offset >= size:
+        break
+
+      stream_item = StreamItem()
+      try:
+        read_projected(stream_item, protocol, projection)
+      except EOFError:
+        break
+      yield offset, stream_item.stream_id
+  finally:
+    fileobj.close()
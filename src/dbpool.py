@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Bounded pool of threads for the blocking Redis work of the Tornado servers
+
+The handlers read Redis with the blocking client; run on the IOLoop, one long
+LRANGE stalls the requests of every user. A handler method decorated with
+@blocking is run by a thread of the DBPool of the application instead, the
+IOLoop going on with the other requests meanwhile:
+
+  class EntIndexHandler(BaseHandler):
+    @blocking
+    def get(self):
+      ...
+
+The method may write, render or redirect as usual: the handler derives from
+PoolHandler, which only buffers the output inside the pool, flush() doing
+nothing there, and hands the finish() over to the IOLoop thread, the one
+writing to the connection. The
+response is finished once the method returns, and an exception of the method
+is raised in the request, which answers 500 as before.
+
+The redis clients and their connection pools are shared by the threads, each
+command takes a connection of its own.
+'''
+
+import sys
+import Queue
+import threading
+import functools
+
+from tornado import gen
+from tornado import ioloop
+from tornado import stack_context
+import tornado.web
+
+## number of threads of a DBPool, at most as many requests reading Redis
+POOL_SIZE = 8
+
+class DBPool():
+  '''
+  threads calling functions and passing their results back to the IOLoop
+  '''
+
+  def __init__(self, size=POOL_SIZE, io_loop=None):
+    self.io_loop = io_loop or ioloop.IOLoop.instance()
+    self._queue = Queue.Queue()
+    for num in range(max(1, size)):
+      thread = threading.Thread(target=self._work, name='db-pool-%d' % num)
+      # the server exits without waiting for them
+      thread.daemon = True
+      thread.start()
+
+  def run(self, func, *args, **kwargs):
+    '''
+    call func(*args, **kwargs) in a thread, then callback(result) on the
+    IOLoop; an exception of func is raised in the stack context of the
+    caller, e.g. the one of the request handler
+    '''
+    callback = kwargs.pop('callback')
+
+    def deliver(result, exc_info):
+      if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      callback(result)
+
+    self._queue.put((func, args, kwargs, stack_context.wrap(deliver)))
+
+  def _work(self):
+    while True:
+      func, args, kwargs, deliver = self._queue.get()
+      try:
+        result, exc_info = func(*args, **kwargs), None
+      except Exception:
+        result, exc_info = None, sys.exc_info()
+      self.io_loop.add_callback(functools.partial(deliver, result, exc_info))
+      ## the traceback would keep the frames of the request alive
+      del exc_info
+
+class PoolHandler(tornado.web.RequestHandler):
+  '''
+  a request handler whose @blocking methods run in application._db_pool
+  '''
+
+  ## the thread running the method, while it runs
+  _pool_thread = None
+
+  def run_in_pool(self, method, *args, **kwargs):
+    self._pool_thread = threading.current_thread()
+    try:
+      return method(self, *args, **kwargs)
+    finally:
+      self._pool_thread = None
+
+  def in_pool(self):
+    return self._pool_thread is threading.current_thread()
+
+  def flush(self, *args, **kwargs):
+    ## the IOLoop would take the buffer while the method is still writing to
+    ## it; the deferred finish() sends all of it
+    if self.in_pool():
+      callback = kwargs.get('callback', args[1] if len(args) > 1 else None)
+      if callback is not None:
+        self.application._db_pool.io_loop.add_callback(callback)
+      return
+    return tornado.web.RequestHandler.flush(self, *args, **kwargs)
+
+  def finish(self, *args, **kwargs):
+    ## the callbacks are run in order, the response is finished before the
+    ## method is done
+    if self.in_pool():
+      self.application._db_pool.io_loop.add_callback(functools.partial(
+          tornado.web.RequestHandler.finish, self, *args, **kwargs))
+      return
+    return tornado.web.RequestHandler.finish(self, *args, **kwargs)
+
+def blocking(method):
+  '''
+  run a method of a PoolHandler in the DBPool of the application
+  '''
+  @functools.wraps(method)
+  @tornado.web.asynchronous
+  @gen.engine
+  def wrapper(self, *args, **kwargs):
+    yield gen.Task(self.application._db_pool.run, self.run_in_pool, method,
+        *args, **kwargs)
+    if not self._finished:
+      self.finish()
+  return wrapper
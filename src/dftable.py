@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Document frequencies of the entities, kept in a Redis DB
+
+A table holds, for each split of the documents (train, test):
+
+  <name>-df-<split>    hash, the number of documents of each entity key
+  <name>-docs-<split>  set, the stream ids of the documents counted so far
+
+A document is added with the keys of all the entities it matches, once: the
+stream ids already in the set of the split are not counted again, so the
+table is updated as new documents arrive, and the collectors can be run
+again over the same documents. A batch is added by one server side script,
+its documents are marked and counted together or not at all. The number of
+documents of a split is the size of its set, the documents matching no
+entity included.
+
+The splits are disjoint sets of documents, the frequencies over several
+splits are the sums of those of each split.
+'''
+
+import math
+
+TRAIN = 'train'
+TEST = 'test'
+SPLITS = [TRAIN, TEST]
+
+## KEYS: the docs set and the df hash; ARGV: for each document, its stream
+## id, the number of its entity keys, then the keys. Returns the number of
+## new documents.
+ADD_SCRIPT = '''
+local num = 0
+local i = 1
+while i <= #ARGV do
+  local n = tonumber(ARGV[i + 1])
+  if redis.call('SADD', KEYS[1], ARGV[i]) == 1 then
+    num = num + 1
+    for j = i + 2, i + 1 + n do
+      redis.call('HINCRBY', KEYS[2], ARGV[j], 1)
+    end
+  end
+  i = i + 2 + n
+end
+return num
+'''
+
+class DFTable():
+  '''
+  the document frequencies of the entities of a DB
+  '''
+
+  def __init__(self, db, name='ent'):
+    self._db = db
+    self._name = name
+
+  def _df_key(self, split):
+    return '%s-df-%s' %(self._name, split)
+
+  def _docs_key(self, split):
+    return '%s-docs-%s' %(self._name, split)
+
+  def clear(self, split):
+    '''
+    forget the documents of a split, before it is built again
+    '''
+    self._db.delete(self._df_key(split), self._docs_key(split))
+
+  def add_docs(self, split, docs, batch_size=500):
+    '''
+    count the (did, keys) of docs, keys being those of the entities the
+    document matches; returns the number of documents which were new
+    '''
+    batch = []
+    num = 0
+    for doc in docs:
+      batch.append(doc)
+      if len(batch) >= batch_size:
+        num += self._add_batch(split, batch)
+        batch = []
+    if batch:
+      num += self._add_batch(split, batch)
+    return num
+
+  def add_doc(self, split, did, keys):
+    return self.add_docs(split, [(did, keys)])
+
+  def _add_batch(self, split, batch):
+    ## SADD tells which documents are new, only their entities are counted;
+    ## the script runs atomically, an interrupted collector leaves no
+    ## document marked without its counts
+    args = []
+    for did, keys in batch:
+      keys = set(keys)
+      args.append(did)
+      args.append(len(keys))
+      args.extend(keys)
+    return int(self._db.eval(ADD_SCRIPT, 2, self._docs_key(split),
+        self._df_key(split), *args))
+
+  def df(self, keys, splits=SPLITS):
+    '''
+    the number of documents of each entity key, over the given splits
+    '''
+    keys = list(keys)
+    if not keys:
+      return []
+    pipe = self._db.pipeline(transaction=False)
+    for split in splits:
+      pipe.hmget(self._df_key(split), keys)
+    counts = [0] * len(keys)
+    for values in pipe.execute():
+      for idx, value in enumerate(values):
+        if value is not None:
+          counts[idx] += int(value)
+    return counts
+
+  def doc_num(self, splits=SPLITS):
+    '''
+    the number of documents of the given splits
+    '''
+    pipe = self._db.pipeline(transaction=False)
+    for split in splits:
+      pipe.scard(self._docs_key(split))
+    return sum(pipe.execute())
+
+  def idf(self, keys, splits=SPLITS):
+    '''
+    -log(df / N) of each entity key, None for those without documents
+    '''
+    doc_num = self.doc_num(splits)
+    return [-math.log(df / float(doc_num)) if df else None
+        for df in self.df(keys, splits)]
@@ -21,10 +21,16 @@ import tornado.httpserver
 import redis
 import csv
 from config import RedisDB
+import dbpool
+import dftable
+from loader import iter_ret_items
 from tornado.options import define, options
 
 
 define("port", default=9999, help="run on the given port", type=int)
+define("db_threads", default=dbpool.POOL_SIZE,
+    help="number of threads running the blocking work of the requests",
+    type=int)
 
 '''
 Chunk the list into bins with the same size
@@ -60,7 +66,7 @@ class DictItem(dict):
     except KeyError:
       raise AttributeError(name)
 
-class BaseHandler(tornado.web.RequestHandler):
+class BaseHandler(dbpool.PoolHandler):
   @property
   def _exact_match_db(self):
     return self.application._exact_match_db
@@ -81,9 +87,30 @@ class BaseHandler(tornado.web.RequestHandler):
   def _rel_num(self):
     return self.application._rel_num
 
+  @property
+  def _df_table(self):
+    return self.application._df_table
+
+  @property
+  def _df_split(self):
+    return self.application._df_split
+
   @property
   def _doc_num_all(self):
-    return 39138
+    doc_num = self._df_table.doc_num([self._df_split])
+    if not doc_num:
+      raise tornado.web.HTTPError(503, 'the document frequencies of the %s '
+          'split are empty, run build-df-table.py %s' %(self._df_split,
+          self._df_split))
+    return doc_num
+
+  def write_error(self, status_code, **kwargs):
+    # tell why the distribution cannot be computed
+    exception = kwargs.get('exc_info', (None, None))[1]
+    if isinstance(exception, tornado.web.HTTPError) and exception.log_message:
+      self.write('%d: %s\n' %(status_code, exception.log_message))
+      return
+    tornado.web.RequestHandler.write_error(self, status_code, **kwargs)
 
 class HomeHandler(BaseHandler):
   def get(self):
@@ -93,50 +120,99 @@ class IDFMIHandler(BaseHandler):
   def get(self):
     self.render('idf-mi.html')
 
-class IDFMIDistHandler(BaseHandler):
+class DistHandler(BaseHandler):
+  '''
+  A distribution of points, one TSV line each. It is computed on the first
+  request and kept by the Application until the DBs change. The subclasses
+  provide points(), which returns the TSV text of the distribution.
+  '''
+  @dbpool.blocking
   def get(self):
-    #                    p(occ|rel)
-    # weight(ent) = log ------------
-    #                     p(occ)
+    self.write(self.application.dist(self.request.path, self.points))
 
+  def ent_doc_lists(self):
+    '''
+    Yield (ent_id, query, occ_num, item_list) of the entities of the annotated
+    queries which occur in documents, the items of their doc lists being read
+    a batch at a time
+    '''
     ent_num = self._wiki_ent_list_db.llen(RedisDB.wiki_ent_list)
     ent_list = self._wiki_ent_list_db.lrange(RedisDB.wiki_ent_list, 0, ent_num)
 
-    so_far = 0
-    point_list = []
-    for ent_id in ent_list:
-      so_far = so_far + 1
-      #if so_far > 100:
-        #break
+    # the number of documents of each entity
+    df_list = self._df_table.df(ent_list, [self._df_split])
+
+    keys = ['id', 'query', 'ent', 'url']
+    for start in xrange(0, len(ent_list), 500):
+      batch = zip(ent_list[start:start + 500], df_list[start:start + 500])
+
+      pipe = self._wiki_ent_list_db.pipeline(transaction=False)
+      for ent_id, occ_num in batch:
+        pipe.hmget(ent_id, keys)
+      db_items = pipe.execute()
+
+      ents = []
+      for (ent_id, occ_num), db_item in zip(batch, db_items):
+        query = db_item[1]
+        if not query in self._annotation:
+          continue
+        if not occ_num > 0:
+          continue
+        ents.append((ent_id, query, occ_num))
+
+      pipe = self._wiki_ent_dist_db.pipeline(transaction=False)
+      for ent_id, query, occ_num in ents:
+        pipe.lrange('doc-list-%s' % ent_id, 0, -1)
+      # a document collected twice is counted once, as in the table
+      for (ent_id, query, occ_num), item_list in zip(ents, pipe.execute()):
+        yield ent_id, query, occ_num, set(item_list)
+
+  def query_doc_lists(self):
+    '''
+    Yield (qid, query, item_list) of the queries which occur in documents
+    '''
+    query_list = range(0, 29)
 
-      keys = ['id', 'query', 'ent', 'url']
-      db_item = self._wiki_ent_list_db.hmget(ent_id, keys)
+    pipe = self._wiki_ent_dist_db.pipeline(transaction=False)
+    for qid in query_list:
+      pipe.lrange('query-doc-list-%s' % qid, 0, -1)
+    item_lists = pipe.execute()
 
-      query = db_item[1]
-      ent = db_item[2]
-      if not query in self._annotation:
-        continue
+    pipe = self._wiki_ent_list_db.pipeline(transaction=False)
+    for qid in query_list:
+      pipe.hget(RedisDB.query_ent_list, qid)
+    queries = pipe.execute()
 
-      list_name = 'doc-list-%s' % ent_id
-      list_len = self._wiki_ent_dist_db.llen(list_name)
-      if not list_len > 0:
+    for qid, query, item_list in zip(query_list, queries, item_lists):
+      if not len(item_list) > 0:
         continue
+      yield qid, query, item_list
 
-      item_list = self._wiki_ent_dist_db.lrange(list_name, 0, list_len)
-      occ_num = list_len
+  def occ_rel_num(self, query, item_list):
+    '''
+    the number of the documents of a doc list which are relevant to a query
+    '''
+    occ_rel_num = 0
+    for item in item_list:
+      items = item.split(':')
+      stream_id = items[0]
+
+      # check whether the document is relevant
+      if stream_id in self._annotation[query]:
+        occ_rel_num = occ_rel_num + 1
+    return occ_rel_num
+
+class IDFMIDistHandler(DistHandler):
+  def points(self):
+    #                    p(occ|rel)
+    # weight(ent) = log ------------
+    #                     p(occ)
 
+    all_doc_num = self._doc_num_all
+    lines = []
+    for ent_id, query, occ_num, item_list in self.ent_doc_lists():
       rel_num = len(self._annotation[query].keys())
-      occ_rel_num = 0
-      all_doc_num = self._doc_num_all
-
-      for item in item_list:
-        items = item.split(':')
-        stream_id = items[0]
-        num = items[2]
-
-        # check whether the document is relevant
-        if stream_id in self._annotation[query]:
-          occ_rel_num = occ_rel_num + 1
+      occ_rel_num = self.occ_rel_num(query, item_list)
 
       p_occ_rel = occ_rel_num / rel_num
       p_occ = occ_num / all_doc_num
@@ -147,55 +223,23 @@ class IDFMIDistHandler(BaseHandler):
       log_idf = math.log(p_occ)
       w_ent = math.log(p_occ_rel / p_occ)
 
-      #line = '%6.3f\t%6.3f\t%s\t%s\t%s\n' %(log_idf, w_ent, ent_id, ent, query)
+      #line = '%6.3f\t%6.3f\t%s\t%s\n' %(log_idf, w_ent, ent_id, query)
       line = '%6.3f\t%6.3f\n' %(log_idf, w_ent)
-      self.write(line)
-
-      point = DictItem()
-      point['occ_num'] = occ_num
-      point['log_idf'] = log_idf
-      point['w_ent'] = w_ent
-      point_list.append(point)
-
-    ## sort the point list occ_num
-    point_list.sort(key=lambda x: x['w_ent'])
-    ## group them into bins, and select the median value of the bin to output
-    for bin in list(chunks(point_list, 10)):
-      median = int(len(bin)/2)
-      med_point = bin[median]
-      #line = '%6.3f\t%6.3f\n' %(med_point['log_idf'], med_point['w_ent'])
-      #self.write(line)
+      lines.append(line)
+    return ''.join(lines)
 
-class IDFMIQueryDistHandler(BaseHandler):
-  def get(self):
+class IDFMIQueryDistHandler(DistHandler):
+  def points(self):
     #                    p(occ|rel)
     # weight(ent) = log ------------
     #                     p(occ)
 
-    query_list = range(0, 29)
-    point_list = []
-    for qid in query_list:
-      list_name = 'query-doc-list-%s' % qid
-      list_len = self._wiki_ent_dist_db.llen(list_name)
-      if not list_len > 0:
-        continue
-
-      item_list = self._wiki_ent_dist_db.lrange(list_name, 0, list_len)
-      occ_num = list_len
-
-      query = self._wiki_ent_list_db.hget(RedisDB.query_ent_list, qid)
+    all_doc_num = self._doc_num_all
+    lines = []
+    for qid, query, item_list in self.query_doc_lists():
+      occ_num = len(item_list)
       rel_num = len(self._annotation[query].keys())
-      occ_rel_num = 0
-      all_doc_num = self._doc_num_all
-
-      for item in item_list:
-        items = item.split(':')
-        stream_id = items[0]
-        num = items[2]
-
-        # check whether the document is relevant
-        if stream_id in self._annotation[query]:
-          occ_rel_num = occ_rel_num + 1
+      occ_rel_num = self.occ_rel_num(query, item_list)
 
       p_occ_rel = occ_rel_num / rel_num
       p_occ = occ_num / all_doc_num
@@ -208,53 +252,21 @@ class IDFMIQueryDistHandler(BaseHandler):
 
       #line = '%6.3f\t%6.3f\t%s\t%d\n' %(log_idf, w_ent, query, qid)
       line = '%6.3f\t%6.3f\n' %(log_idf, w_ent)
-      self.write(line)
+      lines.append(line)
+    return ''.join(lines)
 
 class IDFRelHandler(BaseHandler):
   def get(self):
     self.render('idf-rel.html')
 
-class IDFRelDistHandler(BaseHandler):
-  def get(self):
+class IDFRelDistHandler(DistHandler):
+  def points(self):
     # weight(ent) = p(rel|occ)
 
-    ent_num = self._wiki_ent_list_db.llen(RedisDB.wiki_ent_list)
-    ent_list = self._wiki_ent_list_db.lrange(RedisDB.wiki_ent_list, 0, ent_num)
-
-    so_far = 0
-    point_list = []
-    for ent_id in ent_list:
-      so_far = so_far + 1
-      #if so_far > 100:
-        #break
-
-      keys = ['id', 'query', 'ent', 'url']
-      db_item = self._wiki_ent_list_db.hmget(ent_id, keys)
-
-      query = db_item[1]
-      if not query in self._annotation:
-        continue
-
-      list_name = 'doc-list-%s' % ent_id
-      list_len = self._wiki_ent_dist_db.llen(list_name)
-      if not list_len > 0:
-        continue
-
-      item_list = self._wiki_ent_dist_db.lrange(list_name, 0, list_len)
-      occ_num = list_len
-
-      rel_num = len(self._annotation[query].keys())
-      occ_rel_num = 0
-      all_doc_num = self._doc_num_all
-
-      for item in item_list:
-        items = item.split(':')
-        stream_id = items[0]
-        num = items[2]
-
-        # check whether the document is relevant
-        if stream_id in self._annotation[query]:
-          occ_rel_num = occ_rel_num + 1
+    all_doc_num = self._doc_num_all
+    lines = []
+    for ent_id, query, occ_num, item_list in self.ent_doc_lists():
+      occ_rel_num = self.occ_rel_num(query, item_list)
 
       p_rel_occ = occ_rel_num / occ_num
       p_occ = occ_num / all_doc_num
@@ -266,51 +278,18 @@ class IDFRelDistHandler(BaseHandler):
       w_ent = math.log(p_rel_occ)
 
       line = '%6.3f\t%6.3f\n' %(log_idf, w_ent)
-      self.write(line)
-
-      point = DictItem()
-      point['occ_num'] = occ_num
-      point['log_idf'] = log_idf
-      point['w_ent'] = w_ent
-      point_list.append(point)
-
-    ## sort the point list occ_num
-    point_list.sort(key=lambda x: x['w_ent'])
-    ## group them into bins, and select the median value of the bin to output
-    for bin in list(chunks(point_list, 10)):
-      median = int(len(bin)/2)
-      med_point = bin[median]
-      #line = '%6.3f\t%6.3f\n' %(med_point['log_idf'], med_point['w_ent'])
-      #self.write(line)
+      lines.append(line)
+    return ''.join(lines)
 
-class IDFRelQueryDistHandler(BaseHandler):
-  def get(self):
+class IDFRelQueryDistHandler(DistHandler):
+  def points(self):
     # weight(ent) = p(rel|occ)
 
-    query_list = range(0, 29)
-    point_list = []
-    for qid in query_list:
-      list_name = 'query-doc-list-%d' % qid
-      list_len = self._wiki_ent_dist_db.llen(list_name)
-      if not list_len > 0:
-        continue
-
-      item_list = self._wiki_ent_dist_db.lrange(list_name, 0, list_len)
-      occ_num = list_len
-
-      query = self._wiki_ent_list_db.hget(RedisDB.query_ent_list, qid)
-      rel_num = len(self._annotation[query].keys())
-      occ_rel_num = 0
-      all_doc_num = self._doc_num_all
-
-      for item in item_list:
-        items = item.split(':')
-        stream_id = items[0]
-        num = items[2]
-
-        # check whether the document is relevant
-        if stream_id in self._annotation[query]:
-          occ_rel_num = occ_rel_num + 1
+    all_doc_num = self._doc_num_all
+    lines = []
+    for qid, query, item_list in self.query_doc_lists():
+      occ_num = len(item_list)
+      occ_rel_num = self.occ_rel_num(query, item_list)
 
       p_rel_occ = occ_rel_num / occ_num
       p_occ = occ_num / all_doc_num
@@ -322,34 +301,27 @@ class IDFRelQueryDistHandler(BaseHandler):
       w_ent = math.log(p_rel_occ)
 
       line = '%6.3f\t%6.3f\n' %(log_idf, w_ent)
-      self.write(line)
+      lines.append(line)
+    return ''.join(lines)
 
 class DocLenRelHandler(BaseHandler):
   def get(self):
     self.render('doc-len-rel.html')
 
-class DocLenRelDistHandler(BaseHandler):
-  def get(self):
-    doc_num = self._exact_match_db.llen(RedisDB.ret_item_list)
-    doc_id_list = self._exact_match_db.lrange(RedisDB.ret_item_list, 0, doc_num)
-
-    so_far = 0
+class DocLenRelDistHandler(DistHandler):
+  def points(self):
+    keys = ['id', 'query', 'stream_id', 'len', 'rel']
     doc_list = []
-    for doc_id in doc_id_list:
-      so_far = so_far + 1
-      #if so_far > 1000:
-        #break
-
-      keys = ['id', 'query', 'stream_id', 'len', 'rel']
-      db_item = self._exact_match_db.hmget(doc_id, keys)
-
+    for doc_id, db_item in iter_ret_items(self._exact_match_db,
+        RedisDB.ret_item_list, keys):
       doc = DictItem()
-      doc['len'] = int(db_item[3])
-      doc['rel'] = int(db_item[4])
+      doc['len'] = int(db_item['len'])
+      doc['rel'] = int(db_item['rel'])
       doc_list.append(doc)
 
     ## sort doc_list by document length
     doc_list.sort(key=lambda x: x['len'])
+    lines = []
     for bin in list(chunks(doc_list, 100)):
       num_rel = 0
       for doc in bin:
@@ -361,7 +333,8 @@ class DocLenRelDistHandler(BaseHandler):
       p_rel = num_rel / self._rel_num
 
       line = '%d\t%6.3f\n' %(doc_len_med, p_rel)
-      self.write(line)
+      lines.append(line)
+    return ''.join(lines)
 
 class Application(tornado.web.Application):
   def __init__(self):
@@ -384,6 +357,9 @@ class Application(tornado.web.Application):
 
     tornado.web.Application.__init__(self, handlers, **settings)
 
+    # the threads of the handlers reading Redis, the IOLoop is never blocked
+    self._db_pool = dbpool.DBPool(options.db_threads)
+
     # global database connections for all handles
     self._exact_match_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       #db=RedisDB.train_exact_match_db)
@@ -396,6 +372,11 @@ class Application(tornado.web.Application):
       #db=RedisDB.train_wiki_ent_dist_db)
       db=RedisDB.wiki_ent_dist_db)
 
+    # the document frequencies of the entities, built by collect-ent-dist-v2.py
+    # or build-df-table.py, of the documents of the test DBs above
+    self._df_table = dftable.DFTable(self._wiki_ent_list_db)
+    self._df_split = dftable.TEST
+
     self._annotation = self.load_annotation('eval/qrels/all.txt', True, False)
 
     self._rel_num = 0
@@ -403,6 +384,35 @@ class Application(tornado.web.Application):
       num = len(self._annotation[query])
       self._rel_num = self._rel_num + num
 
+    # path -> (stamp, TSV points) of the distributions served so far
+    self._dists = {}
+
+  def dist_stamp(self):
+    '''
+    the version of the entity DBs, bumped by the collectors when they are
+    done, and the number of retrieved documents; the distributions are
+    computed again when they change
+    '''
+    pipe = self._wiki_ent_list_db.pipeline(transaction=False)
+    pipe.get(RedisDB.dist_version)
+    pipe.llen(RedisDB.wiki_ent_list)
+    stamp = pipe.execute()
+    stamp.append(self._exact_match_db.llen(RedisDB.ret_item_list))
+    return tuple(stamp)
+
+  def dist(self, name, compute):
+    '''
+    the cached points of a distribution, compute() -> TSV being called on the
+    first request and whenever the DBs have changed since
+    '''
+    ## stamped before computing, a change while computing is seen next time
+    stamp = self.dist_stamp()
+    entry = self._dists.get(name)
+    if entry is None or entry[0] != stamp:
+      entry = (stamp, compute())
+      self._dists[name] = entry
+    return entry[1]
+
   def load_annotation (self, path, include_relevant, include_neutral):
     '''
     Loads the annotation file into a dict
@@ -40,6 +40,7 @@ from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
 
 import redis
 from config import RedisDB
+import corpus
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
@@ -135,27 +136,11 @@ class DumpMissedDocs():
       ## verbose output
       #print 'Process %s' % fname
 
-      ### reverse the steps from above:
-      ## load the encrypted data
       fpath = os.path.join(thrift_dir, fname)
-      thrift_data = open(fpath).read()
-
-      assert len(thrift_data) > 0, "failed to load: %s" % fpath
-
-      ## wrap it in a file obj, thrift transport, and thrift protocol
-      transport = StringIO(thrift_data)
-      transport.seek(0)
-      transport = TTransport.TBufferedTransport(transport)
-      protocol = TBinaryProtocol.TBinaryProtocol(transport)
 
       ## iterate over all thrift items
-      while 1:
-        stream_item = StreamItem()
-        try:
-          stream_item.read(protocol)
-        except EOFError:
-          break
-
+      for stream_item in corpus.read_stream_items(fpath,
+          fields=['stream_id', 'body.cleansed']):
         ## process data
         stream_id = stream_item.stream_id
         if stream_id in self._missed_docs:
@@ -172,15 +157,6 @@ class DumpMissedDocs():
             self._missed_docs_db.rpush(RedisDB.ret_item_list, id)
             print 'Missed %s %s\n\n\n' %(urlname, stream_id)
 
-        ## suppress the verbose output
-        #print '%s' % stream_item.doc_id
-
-      ## close that transport
-      transport.close()
-
-      # free memory
-      thrift_data = None
-
 def main():
   import argparse
   parser = argparse.ArgumentParser(usage=__doc__)
@@ -14,6 +14,7 @@ from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
 from cStringIO import StringIO
 from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
+import corpus
 
 class Doc(dict):
   def __getattr__(self, name):
@@ -63,27 +64,11 @@ class Dump2Trec():
   Process one thrift file
   """
   def ProcessThriftFile(self, fpath):
-    thrift_data = open(fpath).read()
-
-    if not len(thrift_data) > 0:
-      msg = 'failed to load: %s' % fpath
-      print 'Error: %s' % (msg)
-      return
-
     #print 'Processing %s' %( fpath )
 
-    ## wrap it in a file obj, thrift transport, and thrift protocol
-    transport = StringIO(thrift_data)
-    transport.seek(0)
-    transport = TTransport.TBufferedTransport(transport)
-    protocol = TBinaryProtocol.TBinaryProtocol(transport)
-
-    docs = []
-    ## iterate over all thrift items
-    while 1:
-      stream_item = StreamItem()
-      try:
-        stream_item.read(protocol)
+    try:
+      ## iterate over all thrift items
+      for stream_item in corpus.read_stream_items(fpath):
         doc = Doc()
         doc.id = stream_item.stream_id
         doc.epoch = stream_item.stream_time.epoch_ticks
@@ -93,14 +78,9 @@ class Dump2Trec():
         doc.anchor = stream_item.anchor.cleansed
 
         self.SaveDoc(doc)
-      except EOFError:
-        break
-
-    ## close that transport
-    transport.close()
-
-    # free memory
-    thrift_data = None
+    except IOError as e:
+      print 'Error: %s' % (e)
+      return
 
   """
   Save one streaming document
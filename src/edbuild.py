@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+One pass build of the E-D maps of several queries
+
+The related entities of all the queries are compiled once into a
+PhraseMatcher, keyed by their formatted phrase, so each document is scanned a
+single time whatever the number of entities and queries. The counts are
+those of re.findall(' %s ' % phrase) over the sanitized text, which the
+former builds ran for every entity: a match needs a separator on both sides
+and consumes them, so two counted matches are at least one token apart.
+
+The documents are matched by a pool of forked workers, batch after batch;
+their counts flow back to the calling process, which fills the maps of the
+queries each document belongs to.
+'''
+
+import sys
+import multiprocessing
+
+import normalize
+from matcher import PhraseMatcher
+
+# the matcher of the running build, inherited by the forked workers
+_matcher = None
+_sizes = None
+
+def match_counts(matcher, sizes, text):
+  '''
+  {phrase number: count} of the phrases occurring in a sanitized text
+  '''
+  last = len(text.split()) - 1
+  lead = text.startswith(' ')
+  trail = text.endswith(' ')
+
+  counts = {}
+  allowed = {}
+  for key, pos in matcher.iter_matches(text):
+    size = sizes[key]
+    if pos < allowed.get(key, 0):
+      continue
+    if pos == 0 and not lead:
+      continue
+    if pos + size - 1 == last and not trail:
+      continue
+    counts[key] = counts.get(key, 0) + 1
+    allowed[key] = pos + size + 1
+  return counts
+
+def _match_docs(docs):
+  '''
+  match a chunk of (did, text) inside a worker
+  '''
+  try:
+    return [(did, match_counts(_matcher, _sizes, text)) for did, text in docs], \
+        None
+  except KeyboardInterrupt:
+    # let the parent process handle the interruption
+    return [], 'interrupted'
+  except Exception as e:
+    return [], '%s: %s' % (e.__class__.__name__, e)
+
+class MapBuilder():
+  '''
+  the E-D maps of a set of queries, {query_id: {entity: eid}}
+  '''
+
+  def __init__(self, ent2id_hashes):
+    self._matcher = PhraseMatcher()
+    self._sizes = []
+    ## phrase number -> [(query_id, eid), ...]
+    self._targets = []
+    phrase2key = {}
+    for query_id, ent2id_hash in ent2id_hashes.iteritems():
+      for ent, eid in ent2id_hash.iteritems():
+        phrase = normalize.format_query(ent, strip=True)
+        if '' in phrase.split(' '):
+          ## the former ' %s ' pattern never matched it
+          continue
+        key = phrase2key.get(phrase)
+        if key is None:
+          key = len(self._sizes)
+          phrase2key[phrase] = key
+          self._matcher.add(phrase, key)
+          self._sizes.append(len(phrase.split(' ')))
+          self._targets.append([])
+        self._targets[key].append((query_id, eid))
+    self._matcher.build()
+
+    self.e2d_hashes = dict((query_id, {}) for query_id in ent2id_hashes)
+    self.d2e_hashes = dict((query_id, {}) for query_id in ent2id_hashes)
+
+  def add(self, did, query_ids, counts):
+    '''
+    add the counts of a document to the maps of the given queries
+    '''
+    for query_id in query_ids:
+      self.d2e_hashes[query_id][did] = {}
+    for key, count in counts.iteritems():
+      for query_id, eid in self._targets[key]:
+        if query_id in query_ids:
+          self.e2d_hashes[query_id].setdefault(eid, {})[did] = count
+          self.d2e_hashes[query_id][did][eid] = count
+
+  def build(self, docs, num_workers=None, chunk_size=100):
+    '''
+    match the (did, text, query_ids) of docs, the texts being sanitized
+
+    num_workers defaults to the number of cores; with one worker the
+    documents are matched serially in the calling process
+    '''
+    global _matcher, _sizes
+
+    if num_workers is None:
+      num_workers = multiprocessing.cpu_count()
+    num_workers = max(1, num_workers)
+
+    if num_workers == 1:
+      for did, text, query_ids in docs:
+        self.add(did, query_ids,
+            match_counts(self._matcher, self._sizes, text))
+      return
+
+    print 'Matching with %d workers' % num_workers
+
+    _matcher = self._matcher
+    _sizes = self._sizes
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      # a batch keeps every worker busy, and no more documents than that
+      # are held in memory
+      batch = []
+      for doc in docs:
+        batch.append(doc)
+        if len(batch) >= chunk_size * num_workers * 4:
+          self._match_batch(pool, batch, chunk_size)
+          batch = []
+      self._match_batch(pool, batch, chunk_size)
+
+      pool.close()
+    except KeyboardInterrupt:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+      _matcher = None
+      _sizes = None
+
+  def _match_batch(self, pool, batch, chunk_size):
+    chunks = []
+    for start in range(0, len(batch), chunk_size):
+      chunks.append([(did, text) for did, text, query_ids
+          in batch[start:start + chunk_size]])
+
+    ## the chunks come back in order, the documents are added in the order
+    ## they were read
+    query_ids_list = [query_ids for did, text, query_ids in batch]
+    num = 0
+    for results, error in pool.imap(_match_docs, chunks):
+      if error:
+        raise RuntimeError('failed to match documents: %s' % error)
+      for did, counts in results:
+        self.add(did, query_ids_list[num], counts)
+        num += 1
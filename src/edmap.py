@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Entity x document matrices of the E-D maps built by gen-ed-map.py
+
+The e2d-map-<query_id> hash maps an entity id to the {did: count} of the
+documents it occurs in; d2e-map-<query_id> is the same relation the other way
+round, so one matrix holds both. It is kept in compressed sparse rows, one
+row per entity and one column per document, with the maps between the ids
+and the row and column numbers:
+
+  indptr   row r holds the entries indptr[r]:indptr[r + 1]
+  indices  the column of each entry
+  data     the count of each entry
+
+so that scoring the documents from entity weights (e2d), scoring the entities
+from a set of documents (d2e) and normalizing the scores are all numpy
+operations over whole vectors.
+
+The maps are stored packed: the stream ids of a query are numbered in the
+doc-list-<query_id> list, sorted, and each e2d field is the 'EDM1' header
+followed by the little-endian uint32 array of the document numbers of the
+entity, increasing, then of their counts. The d2e fields are packed the same
+way with the entity ids. The readers take the arrays straight from the
+stored strings, and still read the JSON maps of the former builds.
+
+The writers of the maps increment the edmap-version key of the DB when they
+are done, so that EDMapCache, which keeps the matrices of the most recently
+used queries, knows when to read them again.
+'''
+
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+VERSION_KEY = 'edmap-version'
+
+MAGIC = 'EDM1'
+DOC_LIST = 'doc-list-%s'
+
+## number of queries kept by an EDMapCache
+CACHE_SIZE = 8
+
+def bump_version(db):
+  '''
+  tell the caches that the E-D maps of a DB have changed
+  '''
+  return db.incr(VERSION_KEY)
+
+def pack_map(ids, counts):
+  '''
+  the stored form of the postings of an entity (document numbers) or of a
+  document (entity ids), the ids being increasing
+  '''
+  return MAGIC + np.asarray(list(ids) + list(counts), dtype='<u4').tostring()
+
+def is_packed(data):
+  return data is not None and data.startswith(MAGIC)
+
+def unpack_map(data):
+  '''
+  the (ids, counts) arrays of a packed field, viewing the string itself
+  '''
+  values = np.frombuffer(data, dtype='<u4', offset=len(MAGIC))
+  num = len(values) // 2
+  return values[:num], values[num:]
+
+def decode_map(data, names=None):
+  '''
+  the {id: count} of a stored field, packed or JSON; the ids of a packed
+  field are mapped through names (e.g. the doc list) if given, and made
+  strings otherwise
+  '''
+  if not is_packed(data):
+    return json.loads(data)
+  ids, counts = unpack_map(data)
+  if names is None:
+    keys = [str(id) for id in ids.tolist()]
+  else:
+    keys = [names[id] for id in ids.tolist()]
+  return dict(zip(keys, counts.tolist()))
+
+def load_doc_list(db, query_id):
+  '''
+  the stream ids of a query, by document number
+  '''
+  return db.lrange(DOC_LIST % query_id, 0, -1)
+
+def save_maps(db, query_id, e2d_hash, d2e_hash):
+  '''
+  write the packed maps of a query, from {eid: {did: count}} and
+  {did: {eid: count}}, the eids being integers
+  '''
+  dids = sorted(set(did for e2d in e2d_hash.itervalues() for did in e2d))
+  did2id = dict((did, id) for id, did in enumerate(dids))
+
+  ## the former fields are numbered by the former doc list, they all go; in
+  ## one transaction, the readers never see the maps half written
+  pipe = db.pipeline()
+  key = DOC_LIST % query_id
+  pipe.delete(key, 'e2d-map-%s' % query_id, 'd2e-map-%s' % query_id)
+  if dids:
+    pipe.rpush(key, *dids)
+
+  key = 'e2d-map-%s' % query_id
+  for eid, e2d in e2d_hash.iteritems():
+    items = sorted((did2id[did], count) for did, count in e2d.iteritems())
+    pipe.hset(key, eid, pack_map([id for id, count in items],
+        [count for id, count in items]))
+
+  key = 'd2e-map-%s' % query_id
+  for did, d2e in d2e_hash.iteritems():
+    items = sorted(d2e.iteritems())
+    pipe.hset(key, did, pack_map([eid for eid, count in items],
+        [count for eid, count in items]))
+  pipe.execute()
+
+class MapReader():
+  '''
+  the {did: count} of single entities of the maps of a DB, the doc list of
+  each query being read once
+  '''
+
+  def __init__(self, db):
+    self._db = db
+    self._doc_lists = {}
+
+  def _dids(self, query_id):
+    if query_id not in self._doc_lists:
+      self._doc_lists[query_id] = load_doc_list(self._db, query_id)
+    return self._doc_lists[query_id]
+
+  def decode_e2d(self, query_id, data):
+    if not is_packed(data):
+      return json.loads(data)
+    return decode_map(data, self._dids(query_id))
+
+  def e2d(self, query_id, eid):
+    '''
+    the documents of an entity, None if it is not in the map
+    '''
+    data = self._db.hget('e2d-map-%s' % query_id, eid)
+    if data is None:
+      return None
+    return self.decode_e2d(query_id, data)
+
+  def e2d_list(self, query_id, eids):
+    '''
+    the documents of each entity, None for those which are not in the map
+    '''
+    if not eids:
+      return []
+    return [None if data is None else self.decode_e2d(query_id, data)
+        for data in self._db.hmget('e2d-map-%s' % query_id, eids)]
+
+class EDMatrix():
+  '''
+  the E-D map of one query
+  '''
+
+  def __init__(self, eids, dids, indptr, indices, data):
+    self.eids = eids
+    self.dids = dids
+    self.eid2row = dict((eid, row) for row, eid in enumerate(eids))
+    self.did2col = dict((did, col) for col, did in enumerate(dids))
+    self.indptr = indptr
+    self.indices = indices
+    self.data = data
+    ## the row of each entry
+    self._rows = np.repeat(np.arange(len(eids)), np.diff(indptr))
+
+  @property
+  def shape(self):
+    return len(self.eids), len(self.dids)
+
+  @classmethod
+  def from_e2d(cls, e2d_hash):
+    '''
+    build the matrix from {eid: {did: count}}, the values may still be JSON
+    '''
+    eids = sorted(e2d_hash.keys(), key=lambda x: int(x))
+    e2d_list = []
+    all_dids = set()
+    for eid in eids:
+      e2d = e2d_hash[eid]
+      if isinstance(e2d, basestring):
+        e2d = json.loads(e2d)
+      e2d_list.append(e2d)
+      all_dids.update(e2d)
+
+    dids = sorted(all_dids)
+    did2col = dict((did, col) for col, did in enumerate(dids))
+
+    indptr = np.zeros(len(eids) + 1, dtype=np.int64)
+    num = sum(len(e2d) for e2d in e2d_list)
+    indices = np.empty(num, dtype=np.int64)
+    data = np.empty(num, dtype=np.float64)
+    pos = 0
+    for row, e2d in enumerate(e2d_list):
+      cols = sorted(did2col[did] for did in e2d)
+      end = pos + len(cols)
+      indices[pos:end] = cols
+      data[pos:end] = [e2d[dids[col]] for col in cols]
+      pos = end
+      indptr[row + 1] = pos
+
+    return cls(eids, dids, indptr, indices, data)
+
+  @classmethod
+  def from_packed(cls, e2d_hash, dids):
+    '''
+    build the matrix from {eid: packed postings} and the doc list
+    '''
+    eids = sorted(e2d_hash.keys(), key=lambda x: int(x))
+    postings = [unpack_map(e2d_hash[eid]) for eid in eids]
+
+    indptr = np.zeros(len(eids) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(ids) for ids, counts in postings])
+    if postings:
+      indices = np.concatenate([ids for ids, counts in postings])
+      data = np.concatenate([counts for ids, counts in postings])
+    else:
+      indices = data = np.empty(0)
+
+    return cls(eids, list(dids), indptr, indices.astype(np.int64),
+        data.astype(np.float64))
+
+  @classmethod
+  def load(cls, db, query_id):
+    '''
+    read the whole e2d-map of a query from an E-D map DB
+    '''
+    e2d_hash = db.hgetall('e2d-map-%s' % query_id)
+    packed = [is_packed(data) for data in e2d_hash.itervalues()]
+    if not any(packed):
+      return cls.from_e2d(e2d_hash)
+
+    dids = load_doc_list(db, query_id)
+    if all(packed):
+      return cls.from_packed(e2d_hash, dids)
+
+    ## fields left over by a former build are still JSON
+    return cls.from_e2d(dict((eid, decode_map(data, dids))
+        for eid, data in e2d_hash.iteritems()))
+
+  def doc_nums(self):
+    '''
+    the number of documents of every entity
+    '''
+    return np.diff(self.indptr)
+
+  def ent_docs(self, eid):
+    '''
+    {did: count} of the documents of an entity, empty if it is unknown
+    '''
+    row = self.eid2row.get(eid)
+    if row is None:
+      return {}
+    start, end = self.indptr[row], self.indptr[row + 1]
+    return dict(zip([self.dids[col] for col in self.indices[start:end]],
+        self.data[start:end].tolist()))
+
+  def entity_vector(self, weights):
+    '''
+    the vector over the rows of {eid: weight}, or of a list of eids each
+    weighted 1, the unknown eids are left out
+    '''
+    vector = np.zeros(len(self.eids))
+    if isinstance(weights, dict):
+      items = weights.iteritems()
+    else:
+      items = ((eid, 1) for eid in weights)
+    for eid, weight in items:
+      row = self.eid2row.get(eid)
+      if row is not None:
+        vector[row] = weight
+    return vector
+
+  def doc_vector(self, weights):
+    '''
+    the vector over the columns of {did: weight}, or of a list of dids each
+    weighted 1, the unknown dids are left out
+    '''
+    vector = np.zeros(len(self.dids))
+    if isinstance(weights, dict):
+      items = weights.iteritems()
+    else:
+      items = ((did, 1) for did in weights)
+    for did, weight in items:
+      col = self.did2col.get(did)
+      if col is not None:
+        vector[col] = weight
+    return vector
+
+  def doc_scores(self, ent_vector):
+    '''
+    the score of every document, the sum of its counts weighted by the
+    entity vector (e2d)
+    '''
+    return np.bincount(self.indices, weights=self.data * ent_vector[self._rows],
+        minlength=len(self.dids))
+
+  def ent_scores(self, doc_vector):
+    '''
+    the score of every entity, the sum of its counts weighted by the
+    document vector (d2e)
+    '''
+    return np.bincount(self._rows, weights=self.data * doc_vector[self.indices],
+        minlength=len(self.eids))
+
+  def doc_presence(self, ent_vector):
+    '''
+    whether each document occurs with one of the entities of non zero weight
+    '''
+    mask = ent_vector[self._rows] != 0
+    return np.bincount(self.indices[mask], minlength=len(self.dids)) > 0
+
+  def ent_presence(self, doc_vector):
+    '''
+    whether each entity occurs in one of the documents of non zero weight
+    '''
+    mask = doc_vector[self.indices] != 0
+    return np.bincount(self._rows[mask], minlength=len(self.eids)) > 0
+
+  def doc_dict(self, scores, present):
+    '''
+    {did: score} of the documents which are present
+    '''
+    cols = np.flatnonzero(present)
+    return dict(zip([self.dids[col] for col in cols], scores[cols].tolist()))
+
+  def ent_dict(self, scores, present):
+    '''
+    {eid: score} of the entities which are present
+    '''
+    rows = np.flatnonzero(present)
+    return dict(zip([self.eids[row] for row in rows], scores[rows].tolist()))
+
+def normalize_scores(scores, scale=1000):
+  '''
+  scale the positive scores to [0, scale] by the maximal one, rounded half up
+  as round() does
+  '''
+  if 0 == len(scores):
+    return scores
+  max_score = scores.max() / scale
+  scaled = scores / max_score
+  ## the fraction is exact, unlike scaled + 0.5
+  rounded = np.floor(scaled)
+  rounded[scaled - rounded >= 0.5] += 1
+  return rounded
+
+class EDMapCache():
+  '''
+  the matrices of the most recently used queries of an E-D map DB
+  '''
+
+  def __init__(self, db, size=CACHE_SIZE):
+    self._db = db
+    self._size = max(1, size)
+    ## query_id -> (stamp, matrix), the least recently used first
+    self._matrices = OrderedDict()
+    ## the servers read the cache from several threads
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._matrices)
+
+  def _stamp(self, query_id):
+    '''
+    the version of the DB and the number of entities of the query, the map
+    is read again when they change
+    '''
+    pipe = self._db.pipeline(transaction=False)
+    pipe.get(VERSION_KEY)
+    pipe.hlen('e2d-map-%s' % query_id)
+    return tuple(pipe.execute())
+
+  def get(self, query_id):
+    '''
+    the matrix of a query, read from the DB if it is not cached or if the DB
+    has changed since
+    '''
+    ## stamped before reading, a change while reading is seen next time
+    stamp = self._stamp(query_id)
+    with self._lock:
+      entry = self._matrices.get(query_id)
+    if entry is None or entry[0] != stamp:
+      ## read out of the lock, the other queries are served meanwhile
+      entry = (stamp, EDMatrix.load(self._db, query_id))
+
+    with self._lock:
+      self._matrices.pop(query_id, None)
+      self._matrices[query_id] = entry
+      while len(self._matrices) > self._size:
+        self._matrices.popitem(last=False)
+    return entry[1]
+
+  def clear(self):
+    with self._lock:
+      self._matrices.clear()
@@ -2,7 +2,7 @@
 '''
 apply exact matching of query entities to the streaming documents
 
-exact-match.py <query> <thrift_dir>
+exact-match.py <query> <thrift_dir> [<thrift_dir> ...] [--workers N] [--batch-size N]
 '''
 
 import re
@@ -39,6 +39,11 @@ from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
 
 import redis
 from config import RedisDB
+import normalize
+from matcher import PhraseMatcher
+import scanner
+import corpus
+from sink import ResultSink
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
@@ -50,6 +55,8 @@ class ExactMatch():
   '''
   _query_hash = {}
   _org_query_hash = {}
+  _matcher = PhraseMatcher()
+  _sink = None
 
   #_exact_match_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
   #    db=RedisDB.exact_match_db)
@@ -68,6 +75,10 @@ class ExactMatch():
       self._org_query_hash[index] = item
       item = self.format_query(item)
       self._query_hash[index] = item
+      self._matcher.add(item, index)
+
+    ## compile all the query entities into one automaton
+    self._matcher.build()
 
     ## dump the query list
     for index, item in enumerate(query_list):
@@ -77,125 +88,95 @@ class ExactMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    return query.lower()
+    return normalize.format_query(query)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
+    return normalize.sanitize(str)
 
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
-
-  def process_stream_item(self, fname, stream_id, stream_data):
+  def match_stream_item(self, stream_id, stream_data):
     '''
     process the streaming item: applying exact match for each of the query
-    entity
+    entity, returns the list of matches
     '''
     new_stream_data = self.sanitize(stream_data)
 
-    for index in self._query_hash:
-      query = self._query_hash[index]
-      try:
-        ## use the query entity as the regex to apply exact match
-        if re.search(query, new_stream_data, re.I | re.M):
-          id = self._exact_match_db.llen(RedisDB.ret_item_list)
-          id = id + 1
-          self._exact_match_db.rpush(RedisDB.ret_item_list, id)
-
-          ## create a hash record
-          ret_item = {'id' : id}
-          ret_item['query'] = self._org_query_hash[index]
-          ret_item['file'] = fname
-          ret_item['stream_id'] = stream_id
-          ret_item['stream_data'] = stream_data
-          ret_item['score'] = 1000
-          self._exact_match_db.hmset(id, ret_item)
-
-          ## verbose output
-          print 'Match: %d - %s - %s' %(id, query, stream_id)
-      except:
-        # Catch any unicode errors while printing to console
-        # and just ignore them to avoid breaking application.
-        print "Exception in process_stream_item()"
-        print '-'*60
-        traceback.print_exc(file=sys.stdout)
-        print '-'*60
-        pass
-
-  def parse_thift_data(self, thrift_dir):
+    ## one scan over the document reports all the matched query entities
+    matches = []
+    for index in sorted(self._matcher.match(new_stream_data)):
+      matches.append((index, stream_id, stream_data))
+    return matches
+
+  def save_match(self, fpath, match):
     '''
-    Parse the thift data in a given directory, apply exact matching over
-    the streaming documents
+    save one match to the DB, called in the writer process only
     '''
-    for fname in os.listdir(thrift_dir):
-      ## ignore other files, e.g. stats.json
-      if fname.endswith('.gpg'): continue
-      if fname.endswith('.xz'): continue
+    index, stream_id, stream_data = match
+    query = self._query_hash[index]
+    try:
+      ## create a hash record
+      ret_item = {}
+      ret_item['query'] = self._org_query_hash[index]
+      ret_item['file'] = os.path.basename(fpath)
+      ret_item['stream_id'] = stream_id
+      ret_item['stream_data'] = stream_data
+      ret_item['score'] = 1000
+      self._sink.add(ret_item)
 
       ## verbose output
-      print 'Process %s' % fname
-
-      ### reverse the steps from above:
-      ## load the encrypted data
-      fpath = os.path.join(thrift_dir, fname)
-      thrift_data = open(fpath).read()
-
-      assert len(thrift_data) > 0, "failed to load: %s" % fpath
-
-      ## wrap it in a file obj, thrift transport, and thrift protocol
-      transport = StringIO(thrift_data)
-      transport.seek(0)
-      transport = TTransport.TBufferedTransport(transport)
-      protocol = TBinaryProtocol.TBinaryProtocol(transport)
-
-      ## iterate over all thrift items
-      while 1:
-        stream_item = StreamItem()
-        try:
-          stream_item.read(protocol)
-        except EOFError:
-          break
-
-        ## process data
-        self.process_stream_item(fname, stream_item.stream_id, stream_item.body.cleansed)
-        ## suppress the verbose output
-        #print '%s' % stream_item.doc_id
+      print 'Match: %s - %s' %(query, stream_id)
+    except:
+      # Catch any unicode errors while printing to console
+      # and just ignore them to avoid breaking application.
+      print "Exception in save_match()"
+      print '-'*60
+      traceback.print_exc(file=sys.stdout)
+      print '-'*60
+      pass
+
+  def match_file(self, fpath):
+    '''
+    apply exact matching over the streaming documents of one thrift file,
+    runs in the worker processes
+    '''
+    matches = []
+    ## iterate over all thrift items
+    for stream_item in corpus.read_stream_items(fpath,
+        fields=['stream_id', 'body.cleansed']):
+      ## process data
+      matches.extend(self.match_stream_item(stream_item.stream_id,
+        stream_item.body.cleansed))
 
-      ## close that transport
-      transport.close()
+    return matches
 
-      # free memory
-      thrift_data = None
+  def parse_thift_data(self, thrift_dirs, num_workers=None, batch_size=500):
+    '''
+    Parse the thift data in the given directories, apply exact matching over
+    the streaming documents with a pool of worker processes
+    '''
+    ## the matches are buffered and saved in batches by the writer
+    self._sink = ResultSink(self._exact_match_db, RedisDB.ret_item_list,
+        batch_size, first_id=1)
+    scanner.scan(thrift_dirs, self.match_file, self.save_match, num_workers)
+    self._sink.flush()
+    print '%d matches saved' % self._sink.num_saved
 
 def main():
   import argparse
   parser = argparse.ArgumentParser(usage=__doc__)
   parser.add_argument('query')
-  parser.add_argument('thrift_dir')
+  parser.add_argument('thrift_dir', nargs='+')
+  parser.add_argument('--workers', type=int, default=None,
+      help='number of worker processes, defaults to the number of cores')
+  parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+      help='number of matches written to the DB at once')
   args = parser.parse_args()
 
   match = ExactMatch()
   match.parse_query(args.query)
-  match.parse_thift_data(args.thrift_dir)
+  match.parse_thift_data(args.thrift_dir, args.workers, args.batch_size)
 
 if __name__ == '__main__':
   try:
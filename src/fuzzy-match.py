@@ -2,7 +2,7 @@
 '''
 apply fuzzy matching of query entities to the streaming documents
 
-fuzzy-match.py <query> <thrift_dir>
+fuzzy-match.py <query> <thrift_dir> [<thrift_dir> ...] [--workers N] [--batch-size N]
 '''
 
 import re
@@ -39,6 +39,11 @@ from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
 
 import redis
 from config import RedisDB
+import normalize
+from matcher import PhraseMatcher
+import scanner
+import corpus
+from sink import ResultSink
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
@@ -50,7 +55,10 @@ class FuzzyMatch():
   '''
   _query_hash = {}
   _org_query_hash = {}
+  _query2id_hash = {}
   _alias_query_hash = {}
+  _matcher = PhraseMatcher()
+  _sink = None
 
   _fuzzy_match_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.fuzzy_match_db)
@@ -65,8 +73,10 @@ class FuzzyMatch():
     ## format the query list
     for index, item in enumerate(query_list):
       self._org_query_hash[index] = item
+      self._query2id_hash[item] = index
       item = self.format_query(item)
       self._query_hash[index] = item
+      self._matcher.add(item, index)
 
     ## dump the query list
     for index, item in enumerate(query_list):
@@ -87,163 +97,113 @@ class FuzzyMatch():
         if not query in self._alias_query_hash:
           self._alias_query_hash[query] = {}
         self._alias_query_hash[query][alias] = 1
+
+        ## the alias is matched on behalf of its query entity
+        if query in self._query2id_hash:
+          self._matcher.add(alias, self._query2id_hash[query])
         print 'Query: %s - Alias: [%s]' %(query, alias)
 
   def format_query(self, query):
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query )
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query )
-
-    ## compress multiple spaces to single one
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query )
-
-    space_regex = re.compile ( '^\s+' )
-    query = space_regex.sub( '', query )
-
-    space_regex = re.compile ( '\s+$' )
-    query = space_regex.sub( '', query )
-
-    return query.lower()
+    return normalize.format_query(query, strip=True)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str )
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str )
+    return normalize.sanitize(str)
 
-    return str.lower()
-
-  def fuzzy_match(self, index, doc):
+  def fuzzy_match(self, doc):
     '''
-    Conduct fuzzy match between the query and document
-    The value returned is boolean
+    Conduct fuzzy match between all the queries (and their aliases) and the
+    document in a single scan
+    The value returned is the set of matched query indexes
     '''
-    org_query = self._org_query_hash[index]
-    query = self._query_hash[index]
-
-    matched = False
-    query_str = ' %s ' %(query)
-    if re.search(query_str, doc, re.I | re.M):
-      matched = True
-      return matched
-
-    if not org_query in self._alias_query_hash:
-      return matched
-
-    for alias in self._alias_query_hash[org_query]:
-      alias_str = ' %s ' %(alias)
-      if re.search(alias_str, doc, re.I | re.M):
-        matched = True
-        break
-
-    return matched
+    return self._matcher.match(doc)
 
-  def process_stream_item(self, fname, stream_id, stream_data):
+  def match_stream_item(self, stream_id, stream_data):
     '''
-    process the streaming item: applying exact match for each of the query
-    entity
+    process the streaming item: applying fuzzy match for each of the query
+    entity, returns the list of matches
     '''
     new_stream_data = self.sanitize(stream_data)
 
-    for index in self._query_hash:
-      query = self._query_hash[index]
-      try:
-        ## use the query entity as the regex to apply exact match
-        #if re.search(query, new_stream_data, re.I | re.M):
-        if True == self.fuzzy_match(index, new_stream_data):
-          id = self._fuzzy_match_db.llen(RedisDB.ret_item_list)
-          self._fuzzy_match_db.rpush(RedisDB.ret_item_list, id)
-
-          ## create a hash record
-          ret_item = {'id' : id}
-          ret_item['query'] = self._org_query_hash[index]
-          ret_item['file'] = fname
-          ret_item['stream_id'] = stream_id
-          ret_item['stream_data'] = stream_data
-          ret_item['score'] = 1000
-          self._fuzzy_match_db.hmset(id, ret_item)
-
-          ## verbose output
-          print 'Match: %d - %s - %s' %(id, query, stream_id)
-      except:
-        # Catch any unicode errors while printing to console
-        # and just ignore them to avoid breaking application.
-        print "Exception in process_stream_item()"
-        print '-'*60
-        traceback.print_exc(file=sys.stdout)
-        print '-'*60
-        pass
-
-  def parse_thift_data(self, thrift_dir):
-    '''
-    Parse the thift data in a given directory, apply exact matching over
-    the streaming documents
-    '''
-    for fname in os.listdir(thrift_dir):
-      ## ignore other files, e.g. stats.json
-      if fname.endswith('.gpg'): continue
-      if fname.endswith('.xz'): continue
+    matches = []
+    for index in sorted(self.fuzzy_match(new_stream_data)):
+      matches.append((index, stream_id, stream_data))
+    return matches
 
-      ## verbose output
-      print 'Process %s' % fname
-
-      ### reverse the steps from above:
-      ## load the encrypted data
-      fpath = os.path.join(thrift_dir, fname)
-      thrift_data = open(fpath).read()
-
-      assert len(thrift_data) > 0, "failed to load: %s" % fpath
-
-      ## wrap it in a file obj, thrift transport, and thrift protocol
-      transport = StringIO(thrift_data)
-      transport.seek(0)
-      transport = TTransport.TBufferedTransport(transport)
-      protocol = TBinaryProtocol.TBinaryProtocol(transport)
-
-      ## iterate over all thrift items
-      while 1:
-        stream_item = StreamItem()
-        try:
-          stream_item.read(protocol)
-        except EOFError:
-          break
+  def save_match(self, fpath, match):
+    '''
+    save one match to the DB, called in the writer process only
+    '''
+    index, stream_id, stream_data = match
+    query = self._query_hash[index]
+    try:
+      ## create a hash record
+      ret_item = {}
+      ret_item['query'] = self._org_query_hash[index]
+      ret_item['file'] = os.path.basename(fpath)
+      ret_item['stream_id'] = stream_id
+      ret_item['stream_data'] = stream_data
+      ret_item['score'] = 1000
+      self._sink.add(ret_item)
 
-        ## process data
-        self.process_stream_item(fname, stream_item.stream_id, stream_item.body.cleansed)
-        ## suppress the verbose output
-        #print '%s' % stream_item.doc_id
+      ## verbose output
+      print 'Match: %s - %s' %(query, stream_id)
+    except:
+      # Catch any unicode errors while printing to console
+      # and just ignore them to avoid breaking application.
+      print "Exception in save_match()"
+      print '-'*60
+      traceback.print_exc(file=sys.stdout)
+      print '-'*60
+      pass
+
+  def match_file(self, fpath):
+    '''
+    apply fuzzy matching over the streaming documents of one thrift file,
+    runs in the worker processes
+    '''
+    matches = []
+    ## iterate over all thrift items
+    for stream_item in corpus.read_stream_items(fpath,
+        fields=['stream_id', 'body.cleansed']):
+      ## process data
+      matches.extend(self.match_stream_item(stream_item.stream_id,
+        stream_item.body.cleansed))
 
-      ## close that transport
-      transport.close()
+    return matches
 
-      # free memory
-      thrift_data = None
+  def parse_thift_data(self, thrift_dirs, num_workers=None, batch_size=500):
+    '''
+    Parse the thift data in the given directories, apply fuzzy matching over
+    the streaming documents with a pool of worker processes
+    '''
+    ## the matches are buffered and saved in batches by the writer
+    self._sink = ResultSink(self._fuzzy_match_db, RedisDB.ret_item_list,
+        batch_size, first_id=0)
+    scanner.scan(thrift_dirs, self.match_file, self.save_match, num_workers)
+    self._sink.flush()
+    print '%d matches saved' % self._sink.num_saved
 
 def main():
   import argparse
   parser = argparse.ArgumentParser(usage=__doc__)
   parser.add_argument('query')
-  parser.add_argument('thrift_dir')
+  parser.add_argument('thrift_dir', nargs='+')
+  parser.add_argument('--workers', type=int, default=None,
+      help='number of worker processes, defaults to the number of cores')
+  parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+      help='number of matches written to the DB at once')
   args = parser.parse_args()
 
   match = FuzzyMatch()
   match.parse_query(args.query)
   match.parse_alias_list('query/dbpedia.alias.list')
-  match.parse_thift_data(args.thrift_dir)
+  match.parse_thift_data(args.thrift_dir, args.workers, args.batch_size)
 
 if __name__ == '__main__':
   try:
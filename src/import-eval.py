@@ -2,7 +2,7 @@
 '''
 import evaluation result to DB
 
-exact-match.py <eval> <corpus_dir>
+import-eval.py <eval> <corpus_dir> [--index-dir <index_dir>]
 '''
 
 import re
@@ -37,6 +37,8 @@ from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
 
 import redis
 from config import RedisDB
+import corpus
+import stream_index
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
@@ -49,6 +51,40 @@ class ImportEval():
   _eval_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.eval_db)
   _item_list = []
+  _stream_index = None
+
+  def load_index(self, index_dir):
+    '''
+    use the stream_id index built by build-index.py to locate the items
+    '''
+    self._stream_index = stream_index.CorpusIndex(index_dir)
+
+  def find_indexed_item(self, date_dir, item):
+    '''
+    read the item straight from its offset, returns False when it is not
+    indexed
+    '''
+    if self._stream_index is None:
+      return False
+
+    location = self._stream_index.locate(item['stream_id'])
+    if location is None:
+      return False
+
+    date, fname, offset = location
+    fpath = os.path.join(date_dir, fname)
+    try:
+      stream_item = corpus.read_stream_item(fpath, offset,
+          fields=['stream_id', 'body.cleansed'])
+    except IOError as e:
+      print e
+      return False
+
+    if stream_item.stream_id != item['stream_id']:
+      return False
+
+    self.process_stream_item(fname, item, stream_item.body.cleansed)
+    return True
 
   def parse_eval(self, eval_file):
     '''
@@ -132,46 +168,30 @@ class ImportEval():
         print 'directory %s can no be opened' %date_dir
         continue
 
+      if self.find_indexed_item(date_dir, item):
+        print 'Item %d processed' %item['id']
+        continue
+
       found = False
       for fname in os.listdir(date_dir):
         ## ignore other files, e.g. stats.json
         if fname.endswith('.gpg'): continue
         if fname.endswith('.xz'): continue
 
-        ### reverse the steps from above:
-        ## load the encrypted data
         fpath = os.path.join(date_dir, fname)
-        thrift_data = open(fpath).read()
 
-        if not len(thrift_data) > 0:
-          print "failed to load: %s" % fpath
+        try:
+          ## iterate over all thrift items
+          for stream_item in corpus.read_stream_items(fpath,
+              fields=['stream_id', 'body.cleansed']):
+            if stream_item.stream_id == target_id:
+              self.process_stream_item(fname, item, stream_item.body.cleansed)
+              found = True
+              break
+        except IOError as e:
+          print e
           continue
 
-        ## wrap it in a file obj, thrift transport, and thrift protocol
-        transport = StringIO(thrift_data)
-        transport.seek(0)
-        transport = TTransport.TBufferedTransport(transport)
-        protocol = TBinaryProtocol.TBinaryProtocol(transport)
-
-        ## iterate over all thrift items
-        while 1:
-          stream_item = StreamItem()
-          try:
-            stream_item.read(protocol)
-          except EOFError:
-            break
-
-          if stream_item.stream_id == target_id:
-            self.process_stream_item(fname, item, stream_item.body.cleansed)
-            found = True
-            break
-
-        ## close that transport
-        transport.close()
-
-        # free memory
-        thrift_data = None
-
         if found:
           print 'Item %d processed' %item['id']
           break
@@ -185,10 +205,14 @@ def main():
   parser = argparse.ArgumentParser(usage=__doc__)
   parser.add_argument('eval')
   parser.add_argument('corpus_dir')
+  parser.add_argument('--index-dir', dest='index_dir', default=None,
+      help='directory of the stream_id index built by build-index.py')
   args = parser.parse_args()
 
   object = ImportEval()
   object.parse_eval(args.eval)
+  if args.index_dir:
+    object.load_index(args.index_dir)
   object.parse_thift_data(args.corpus_dir)
 
 if __name__ == '__main__':
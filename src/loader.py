@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Bulk reader of the result items of a Redis DB
+
+The ids listed in RedisDB.ret_item_list are fetched a batch at a time with
+LRANGE, and the hashes of a batch are read through one pipeline of HMGET, so
+the items are yielded as they arrive instead of after one round trip per id,
+and only one batch of them is held in memory at a time.
+'''
+
+def iter_ret_items(db, list_key, keys, batch_size=500):
+  '''
+  yield (ret_id, ret_item) for each id of list_key, ret_item being the dict
+  of the given hash keys, a missing key reads as None
+  '''
+  batch_size = max(1, batch_size)
+
+  ## the items appended while reading are left out
+  num = db.llen(list_key)
+  for start in xrange(0, num, batch_size):
+    end = min(start + batch_size, num) - 1
+    ret_ids = db.lrange(list_key, start, end)
+
+    pipe = db.pipeline(transaction=False)
+    for ret_id in ret_ids:
+      pipe.hmget(ret_id, keys)
+    values = pipe.execute()
+
+    for ret_id, db_item in zip(ret_ids, values):
+      yield ret_id, dict(zip(keys, db_item))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Multi-pattern phrase matcher shared by the matching stages
+
+All the query entities (and their aliases) are compiled once into an
+Aho-Corasick automaton whose alphabet is the token, so one linear scan over a
+sanitized document reports every phrase occurring in it, no matter how many
+phrases there are.
+'''
+
+from collections import deque
+
+class PhraseMatcher():
+  '''
+  Aho-Corasick automaton over the tokens of sanitized text
+
+  Each phrase is registered with a key (e.g. the query index); several
+  phrases may share the same key, which is how the aliases of a query are
+  folded into the query itself.
+  '''
+
+  def __init__(self):
+    # state 0 is the root
+    self._goto = [{}]
+    self._fail = [0]
+    # the phrases ending at each state, and those with the ones of the states
+    # its failure links lead to
+    self._own = [[]]
+    self._out = [[]]
+    self._built = True
+
+  def __len__(self):
+    return len(self._goto)
+
+  def add(self, phrase, key):
+    '''
+    register a (formatted) phrase under the given key
+    '''
+    tokens = phrase.split()
+    if not tokens:
+      return
+
+    state = 0
+    for token in tokens:
+      next = self._goto[state].get(token)
+      if next is None:
+        next = len(self._goto)
+        self._goto[state][token] = next
+        self._goto.append({})
+        self._fail.append(0)
+        self._own.append([])
+        self._out.append([])
+      state = next
+
+    output = (key, len(tokens))
+    if output not in self._own[state]:
+      self._own[state].append(output)
+    self._built = False
+
+  def build(self):
+    '''
+    compute the failure links, again after each add()
+    '''
+    self._out = [list(own) for own in self._own]
+    queue = deque()
+    for state in self._goto[0].itervalues():
+      self._fail[state] = 0
+      queue.append(state)
+
+    while queue:
+      state = queue.popleft()
+      for token, next in self._goto[state].iteritems():
+        queue.append(next)
+
+        fail = self._fail[state]
+        while fail and token not in self._goto[fail]:
+          fail = self._fail[fail]
+        fail = self._goto[fail].get(token, 0)
+        if fail == next:
+          fail = 0
+        self._fail[next] = fail
+        self._out[next].extend(self._out[fail])
+
+    self._built = True
+
+  def iter_matches(self, doc):
+    '''
+    yield (key, position) for every phrase occurrence in the sanitized
+    document, position being the index of the first matched token
+    '''
+    if not self._built:
+      self.build()
+
+    goto = self._goto
+    fail = self._fail
+    out = self._out
+
+    state = 0
+    for pos, token in enumerate(doc.split()):
+      while state and token not in goto[state]:
+        state = fail[state]
+      state = goto[state].get(token, 0)
+
+      for key, length in out[state]:
+        yield key, pos - length + 1
+
+  def match(self, doc):
+    '''
+    return the set of keys which have at least one phrase in the document
+    '''
+    return set(key for key, pos in self.iter_matches(doc))
+
+  def count(self, doc):
+    '''
+    return the number of occurrences of each matched key in the document
+    '''
+    counts = {}
+    for key, pos in self.iter_matches(doc):
+      counts[key] = counts.get(key, 0) + 1
+    return counts
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Text normalization shared by the matching, filtering and mapping stages
+
+sanitize() turns every run of characters other than ASCII letters and digits
+into a single space and lower-cases the rest, which is what the former
+(\W+|\_+) then \s+ substitutions followed by lower() did. A byte string is
+done with one translate() and one split(), a unicode string with one
+precompiled regular expression.
+
+format_query() additionally drops the parenthesized part of an entity name,
+and its results are cached since the same few names are formatted for every
+document.
+'''
+
+import re
+
+## ASCII letters and digits are kept, lower-cased, anything else is a space
+_TRANS_TABLE = ''.join(chr(c).lower() if chr(c).isalnum() and c < 128
+    else ' ' for c in range(256))
+
+_NON_WORD_REGEX = re.compile(r'[\W_]+')
+_PARENTHESES_REGEX = re.compile(r'\(.*\)')
+
+## the number of formatted names kept before the cache is emptied
+MAX_CACHED = 100000
+_query_cache = {}
+
+def sanitize(text):
+  '''
+  sanitize the streaming item
+  '''
+  if isinstance(text, unicode):
+    return _NON_WORD_REGEX.sub(' ', text).lower()
+
+  text = text.translate(_TRANS_TABLE)
+  words = text.split()
+  if not words:
+    return ' ' if text else ''
+
+  ## a leading or a trailing run of separators is kept as a single space
+  ret = ' '.join(words)
+  if text[0] == ' ':
+    ret = ' ' + ret
+  if text[-1] == ' ':
+    ret = ret + ' '
+  return ret
+
+def format_query(query, strip=False):
+  '''
+  format the original query, with strip the leading and trailing spaces are
+  removed
+  '''
+  ## the type is part of the key, a byte string is never compared to unicode
+  key = (type(query), query, strip)
+  ret = _query_cache.get(key)
+  if ret is not None:
+    return ret
+
+  ret = sanitize(_PARENTHESES_REGEX.sub('', query))
+  if strip:
+    ret = ret.strip()
+
+  if len(_query_cache) >= MAX_CACHED:
+    _query_cache.clear()
+  _query_cache[key] = ret
+  return ret
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Positional inverted index over the sanitized documents of a result DB
+
+For every word, the index keeps the documents it occurs in and its token
+positions in each of them, so the number of times a phrase occurs in a
+document comes from intersecting the postings of its words instead of running
+re.findall(' %s ' % phrase) over the text of every document:
+
+  docs       array of document numbers, increasing
+  ends       array, ends[i] is the end of the positions of docs[i]
+  positions  array of token positions
+
+The counts are those of the former regex over the sanitized text: a match
+needs a separator on both sides and consumes them, so two matches are at
+least one token apart, and a phrase with an empty word never matches.
+
+The index is saved with marshal under the 'KBAPIX01' header, the postings
+being kept as strings until they are looked up, along with the length and
+the last id of the list of the documents it was built from: the index is
+built again once exact-match has changed the list.
+'''
+
+import os
+import sys
+import marshal
+from array import array
+from bisect import bisect_left
+
+import normalize
+import tokens
+
+MAGIC = 'KBAPIX01'
+
+## the fields of the result hashes kept for each document
+DOC_KEYS = ['id', 'query', 'file', 'stream_id']
+
+class PhraseIndex():
+  '''
+  the index of a set of documents, numbered from 0 in the order they are
+  added
+  '''
+
+  def __init__(self):
+    self._postings = {}
+    self._docs = []
+    self._bounds = array('I')
+    # the stamp() of the DB the documents were read from
+    self.stamp = None
+
+  def __len__(self):
+    return len(self._docs)
+
+  def doc(self, num):
+    '''
+    the stored fields of a document, with its ret_id and 'query_found', which
+    tells whether its formatted query occurs in its text
+    '''
+    return self._docs[num]
+
+  def add(self, ret_id, ret_item, text):
+    '''
+    index the sanitized text of a result item, returns its document number
+    '''
+    num = len(self._docs)
+    doc = dict((key, ret_item.get(key)) for key in DOC_KEYS)
+    doc['ret_id'] = ret_id
+    query = ret_item.get('query')
+    doc['query_found'] = query is not None \
+        and normalize.format_query(query) in text
+    self._docs.append(doc)
+
+    words = text.split()
+    flags = 0
+    if text.startswith(' '):
+      flags |= 1
+    if text.endswith(' '):
+      flags |= 2
+    self._bounds.append(len(words) << 2 | flags)
+
+    doc_positions = {}
+    for pos, word in enumerate(words):
+      if word in doc_positions:
+        doc_positions[word].append(pos)
+      else:
+        doc_positions[word] = [pos]
+
+    for word, positions in doc_positions.iteritems():
+      postings = self._postings.get(word)
+      if postings is None:
+        postings = (array('I'), array('I'), array('I'))
+        self._postings[word] = postings
+      postings[0].append(num)
+      postings[2].extend(positions)
+      postings[1].append(len(postings[2]))
+    return num
+
+  def _get(self, word):
+    postings = self._postings.get(word)
+    if postings is None or isinstance(postings[0], array):
+      return postings
+
+    ## loaded from a file, the arrays are made on first use
+    arrays = []
+    for data in postings:
+      values = array('I')
+      values.fromstring(data)
+      arrays.append(values)
+    postings = tuple(arrays)
+    self._postings[word] = postings
+    return postings
+
+  def _positions(self, postings, num):
+    '''
+    the positions of a word in document num, or None
+    '''
+    docs, ends, positions = postings
+    i = bisect_left(docs, num)
+    if i == len(docs) or docs[i] != num:
+      return None
+    start = ends[i - 1] if i > 0 else 0
+    return positions[start:ends[i]]
+
+  def _count(self, num, starts, size):
+    '''
+    the number of non overlapping matches of a phrase of size words
+    starting at the given positions of document num
+    '''
+    bounds = self._bounds[num]
+    last = (bounds >> 2) - 1
+    count = 0
+    allowed = 0
+    for pos in starts:
+      if pos < allowed:
+        continue
+      if pos == 0 and not bounds & 1:
+        continue
+      if pos + size - 1 == last and not bounds & 2:
+        continue
+      count += 1
+      allowed = pos + size + 1
+    return count
+
+  def counts(self, phrase, docs=None):
+    '''
+    return {document number: count} of the documents where the phrase
+    occurs, only among the given document numbers if any
+    '''
+    words = phrase.split(' ')
+    if '' in words:
+      return {}
+
+    word_postings = []
+    for word in words:
+      postings = self._get(word)
+      if postings is None:
+        return {}
+      word_postings.append(postings)
+
+    ## walk the documents of the rarest word
+    rarest = min(word_postings, key=lambda postings: len(postings[0]))
+    candidates = rarest[0]
+    if docs is not None:
+      if len(docs) < len(candidates):
+        candidates = sorted(docs)
+      else:
+        candidates = [num for num in candidates if num in docs]
+
+    ret = {}
+    for num in candidates:
+      starts = self._positions(word_postings[0], num)
+      if starts is None:
+        continue
+      for offset in range(1, len(words)):
+        positions = self._positions(word_postings[offset], num)
+        if positions is None:
+          starts = None
+          break
+        positions = set(positions)
+        starts = [pos for pos in starts if pos + offset in positions]
+        if not starts:
+          break
+      if not starts:
+        continue
+
+      count = self._count(num, starts, len(words))
+      if count > 0:
+        ret[num] = count
+    return ret
+
+  def count(self, phrase, num):
+    '''
+    the number of occurrences of a phrase in one document
+    '''
+    return self.counts(phrase, set([num])).get(num, 0)
+
+  def save(self, path):
+    postings = {}
+    for word in self._postings:
+      postings[word] = tuple(values.tostring() for values in self._get(word))
+
+    ## write to a temporary file first, a crash never leaves a truncated index
+    tmp_path = '%s.tmp' % path
+    f = open(tmp_path, 'wb')
+    f.write(MAGIC)
+    marshal.dump((self._docs, self._bounds.tostring(), postings, self.stamp),
+        f, 2)
+    f.close()
+    os.rename(tmp_path, path)
+
+  @classmethod
+  def load(cls, path):
+    f = open(path, 'rb')
+    if f.read(len(MAGIC)) != MAGIC:
+      f.close()
+      raise IOError('invalid index file: %s' % path)
+    data = marshal.load(f)
+    f.close()
+
+    index = cls()
+    index._docs = data[0]
+    index._bounds.fromstring(data[1])
+    index._postings = data[2]
+    ## saved without a stamp, it is built again
+    if len(data) > 3:
+      index.stamp = data[3]
+    return index
+
+def stamp(db, list_key):
+  '''
+  the length and the last id of the list of the documents, as saved with the
+  index
+  '''
+  pipe = db.pipeline()
+  pipe.llen(list_key)
+  pipe.lindex(list_key, -1)
+  return tuple(str(value) for value in pipe.execute())
+
+def build(db, list_key, batch_size=500):
+  '''
+  index all the result items of a DB, from their tokens if they have been
+  tokenized
+  '''
+  index = PhraseIndex()
+  ## stamped before reading, the documents added meanwhile are seen next time
+  index.stamp = stamp(db, list_key)
+  vocab = tokens.Vocabulary(db)
+  for ret_id, ret_item, text in vocab.iter_doc_texts(list_key, DOC_KEYS,
+      batch_size):
+    if text is None:
+      continue
+    index.add(ret_id, ret_item, text)
+  return index
+
+def load_or_build(path, db, list_key):
+  '''
+  load the index saved in path, or build it from the DB and save it there,
+  also when the documents of the DB have changed since
+  '''
+  if os.path.isfile(path):
+    index = PhraseIndex.load(path)
+    if index.stamp == stamp(db, list_key):
+      return index
+    sys.stderr.write('documents changed, rebuilding the index %s\n' % path)
+
+  index = build(db, list_key)
+  index.save(path)
+  return index
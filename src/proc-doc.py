@@ -23,6 +23,9 @@ from cStringIO import StringIO
 
 import redis
 from config import RedisDB
+import normalize
+from sink import ResultSink
+from loader import iter_ret_items
 
 QUERY_ENT_MATCH_SCORE = 100
 WIKI_ENT_MATCH_SCORE = 1
@@ -53,15 +56,7 @@ class ProcDoc():
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str )
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def remove_noise(self, doc):
     '''
@@ -126,31 +121,21 @@ class ProcDoc():
       print 'no ret_item found'
       return
 
-    ret_item_list = self._source_db.lrange(RedisDB.ret_item_list, 0, num)
-    ret_items = []
-    for ret_id in ret_item_list:
-      ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data', 'score']
-      the_ret_item = self._source_db.hmget(ret_id, ret_item_keys)
-
-      ret_item = {}
-      ret_item['id'] = the_ret_item[0]
-      ret_item['query'] = the_ret_item[1]
-      ret_item['file'] = the_ret_item[2]
-      ret_item['stream_id'] = the_ret_item[3]
-      ret_item['stream_data'] = the_ret_item[4]
-      ret_item['score'] = the_ret_item[5]
-
+    sink = ResultSink(self._filtered_db, RedisDB.ret_item_list, first_id=0)
+    ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data', 'score']
+    for ret_id, ret_item in iter_ret_items(self._source_db,
+        RedisDB.ret_item_list, ret_item_keys):
       ## process data
       filtered_doc = self.process_stream_item(ret_item['query'], ret_item['file'],
           ret_item['stream_id'], ret_item['stream_data'])
       print 'Process %s' %(ret_id)
 
-      ## save the document to database then
-      id = self._filtered_db.llen(RedisDB.ret_item_list)
-      self._filtered_db.rpush(RedisDB.ret_item_list, id)
-
+      ## save the document to database then, it keeps the id of its source
+      ## in the 'id' field
       ret_item['stream_data'] = filtered_doc
-      self._filtered_db.hmset(id, ret_item)
+      sink.add(ret_item, new_id=True)
+
+    sink.flush()
 
   def test_parse_data(self):
     '''
@@ -23,6 +23,7 @@ from thrift.transport import TTransport
 from thrift.protocol import TBinaryProtocol
 from cStringIO import StringIO
 from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
+import corpus
 
 define("port", default=9999, help="run on the given port", type=int)
 
@@ -98,39 +99,22 @@ class FileHandler(tornado.web.RequestHandler):
 
     ## load the thrift data
     fpath = os.path.join(corpus_dir, date, file)
-    thrift_data = open(fpath).read()
-
-    if not len(thrift_data) > 0:
-      msg = 'failed to load: %s' % fpath
-      #raise tornado.web.HTTPError(404, log_message=msg)
-      self.render("error.html", msg=msg)
-      return
-
-    ## wrap it in a file obj, thrift transport, and thrift protocol
-    transport = StringIO(thrift_data)
-    transport.seek(0)
-    transport = TTransport.TBufferedTransport(transport)
-    protocol = TBinaryProtocol.TBinaryProtocol(transport)
 
     docs = []
-    ## iterate over all thrift items
-    while 1:
-      stream_item = StreamItem()
-      try:
-        stream_item.read(protocol)
+    try:
+      ## iterate over all thrift items
+      for stream_item in corpus.read_stream_items(fpath,
+          fields=['stream_id', 'stream_time']):
         doc = Doc()
         doc.id = stream_item.stream_id
         doc.epoch = stream_item.stream_time.epoch_ticks
         doc.time = datetime.datetime.utcfromtimestamp(doc.epoch).ctime()
         docs.append(doc)
-      except EOFError:
-        break
-
-    ## close that transport
-    transport.close()
-
-    # free memory
-    thrift_data = None
+    except IOError:
+      msg = 'failed to load: %s' % fpath
+      #raise tornado.web.HTTPError(404, log_message=msg)
+      self.render("error.html", msg=msg)
+      return
 
     self.render("file-index.html", title=file, date=date, file=file, docs=docs)
 
@@ -155,27 +139,11 @@ class DocHandler(tornado.web.RequestHandler):
     doc['id'] = target_id
 
     fpath = os.path.join(date_dir, file)
-    thrift_data = open(fpath).read()
-
-    if not len(thrift_data) > 0:
-      msg = 'failed to load: %s' % fpath
-      #raise tornado.web.HTTPError(404, log_message=msg)
-      self.render("error.html", msg=msg)
-      return
-
-    ## wrap it in a file obj, thrift transport, and thrift protocol
-    transport = StringIO(thrift_data)
-    transport.seek(0)
-    transport = TTransport.TBufferedTransport(transport)
-    protocol = TBinaryProtocol.TBinaryProtocol(transport)
 
-    ## iterate over all thrift items
-    while 1:
-      stream_item = StreamItem()
-      try:
-        stream_item.read(protocol)
+    try:
+      ## iterate over all thrift items
+      for stream_item in corpus.read_stream_items(fpath):
         if stream_item.stream_id == target_id:
-          found = True
           #doc['title'] = stream_item.title.cleansed
           #doc['body'] = stream_item.body.cleansed
           #doc['anchor'] = stream_item.anchor.cleansed
@@ -183,8 +151,11 @@ class DocHandler(tornado.web.RequestHandler):
           doc['body'] = stream_item.body.raw
           doc['anchor'] = stream_item.anchor.raw
           break
-      except EOFError:
-        break
+    except IOError:
+      msg = 'failed to load: %s' % fpath
+      #raise tornado.web.HTTPError(404, log_message=msg)
+      self.render("error.html", msg=msg)
+      return
 
     self.render("doc.html", title=doc_id, doc=doc)
 
@@ -220,27 +191,12 @@ class SearchHandler(tornado.web.RequestHandler):
       if fname.endswith('.xz'): continue
 
       fpath = os.path.join(date_dir, fname)
-      thrift_data = open(fpath).read()
-
-      if not len(thrift_data) > 0:
-        msg = 'failed to load: %s' % fpath
-        #raise tornado.web.HTTPError(404, log_message=msg)
-        self.render("error.html", msg=msg)
-        return
-
-      ## wrap it in a file obj, thrift transport, and thrift protocol
-      transport = StringIO(thrift_data)
-      transport.seek(0)
-      transport = TTransport.TBufferedTransport(transport)
-      protocol = TBinaryProtocol.TBinaryProtocol(transport)
 
       found = False
 
-      ## iterate over all thrift items
-      while 1:
-        stream_item = StreamItem()
-        try:
-          stream_item.read(protocol)
+      try:
+        ## iterate over all thrift items
+        for stream_item in corpus.read_stream_items(fpath):
           if stream_item.stream_id == target_id:
             found = True
             doc['title'] = stream_item.title.cleansed
@@ -248,8 +204,11 @@ class SearchHandler(tornado.web.RequestHandler):
             doc['anchor'] = stream_item.anchor.cleansed
             doc['file'] = fname
             break
-        except EOFError:
-          break
+      except IOError:
+        msg = 'failed to load: %s' % fpath
+        #raise tornado.web.HTTPError(404, log_message=msg)
+        self.render("error.html", msg=msg)
+        return
 
       if found: break
 
@@ -25,6 +25,9 @@ from cStringIO import StringIO
 import redis
 import csv
 from config import RedisDB
+import normalize
+import tokens
+from loader import iter_ret_items
 
 QUERY_ENT_MATCH_SCORE = 100
 WIKI_ENT_MATCH_SCORE = 1
@@ -83,19 +86,7 @@ class WikiMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    return query.lower()
+    return normalize.format_query(query)
 
   def load_annotation (self, path_to_annotation_file, include_relevant, include_neutral):
     '''
@@ -145,15 +136,7 @@ class WikiMatch():
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def load_wiki_ent(self):
     num = self._wiki_ent_list_db.llen(RedisDB.wiki_ent_list)
@@ -213,7 +196,8 @@ class WikiMatch():
     else:
       print 'I can not find the query [%s] in self._wiki_ent_hash' %org_query
 
-  def process_stream_item(self, org_query, ret_id, stream_id, stream_data, rel):
+  def process_stream_item(self, org_query, ret_id, stream_id, stream_data, rel,
+      doc=None):
     '''
     process the streaming item: applying exact match for each of the query
     entity
@@ -229,7 +213,10 @@ class WikiMatch():
     #if not 0 == qid:
       #return
 
-    new_stream_data = self.sanitize(stream_data)
+    ## doc is the sanitized stream_data, when it has been tokenized already
+    new_stream_data = doc
+    if new_stream_data is None:
+      new_stream_data = self.sanitize(stream_data)
     query = self._query_hash[qid]
 
     try:
@@ -255,21 +242,13 @@ class WikiMatch():
       print 'no ret_item found'
       return
 
-    ret_item_list = self._exact_match_db.lrange(RedisDB.ret_item_list, 0, num)
-    ret_items = []
-    for ret_id in ret_item_list:
+    vocab = tokens.Vocabulary(self._exact_match_db)
+    ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data',
+        'tokens']
+    for ret_id, ret_item in iter_ret_items(self._exact_match_db,
+        RedisDB.ret_item_list, ret_item_keys):
       print '%s / %d' %(ret_id, num)
 
-      ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data']
-      the_ret_item = self._exact_match_db.hmget(ret_id, ret_item_keys)
-
-      ret_item = {}
-      ret_item['id'] = the_ret_item[0]
-      ret_item['query'] = the_ret_item[1]
-      ret_item['file'] = the_ret_item[2]
-      ret_item['stream_id'] = the_ret_item[3]
-      ret_item['stream_data'] = the_ret_item[4]
-
       #Show the annotation of the stream_id-query pair as what is is
       in_annotation_set = (ret_item['stream_id'], ret_item['query']) in self._annotation
       ## In the annotation set and relevant
@@ -281,7 +260,8 @@ class WikiMatch():
       ## process data
       rel = self._annotation[(ret_item['stream_id'], ret_item['query'])]
       self.process_stream_item(ret_item['query'], ret_item['id'],
-          ret_item['stream_id'], ret_item['stream_data'], rel)
+          ret_item['stream_id'], ret_item['stream_data'], rel,
+          vocab.doc_text(ret_item))
 
 def main():
   import argparse
@@ -16,6 +16,7 @@ import tornado.httpserver
 
 import redis
 from config import RedisDB
+import dbpool
 from tornado.options import define, options
 
 from thrift import Thrift
@@ -25,6 +26,9 @@ from cStringIO import StringIO
 from kba_thrift.ttypes import StreamItem, StreamTime, ContentItem
 
 define("port", default=7777, help="run on the given port", type=int)
+define("db_threads", default=dbpool.POOL_SIZE,
+    help="number of threads running the blocking work of the requests",
+    type=int)
 
 corpus_dir = './corpus/cleansed'
 
@@ -50,7 +54,7 @@ class DictItem(dict):
     except KeyError:
       raise AttributeError(name)
 
-class BaseHandler(tornado.web.RequestHandler):
+class BaseHandler(dbpool.PoolHandler):
   @property
   def _exact_match_db(self):
     return self.application._exact_match_db
@@ -91,6 +95,7 @@ class HomeHandler(BaseHandler):
     self.redirect(url)
 
 class TrainIndexHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._exact_match_db.llen(RedisDB.ret_item_list)
     if 0 == num:
@@ -115,6 +120,7 @@ class TrainIndexHandler(BaseHandler):
     self.render("train-ret-index.html", title='KBA Training Results', ret_items=ret_items)
 
 class TestIndexHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._test_exact_match_db.llen(RedisDB.ret_item_list)
     if 0 == num:
@@ -139,6 +145,7 @@ class TestIndexHandler(BaseHandler):
     self.render("test-ret-index.html", title='KBA Testing Results', ret_items=ret_items)
 
 class FilteredIndexHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._filtered_db.llen(RedisDB.ret_item_list)
     if 0 == num:
@@ -163,6 +170,7 @@ class FilteredIndexHandler(BaseHandler):
     self.render("filter-ret-index.html", title='KBA Filtering Results', ret_items=ret_items)
 
 class TrainRetHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ret_id):
     ret_item_keys = ['id', 'query', 'file', 'stream_id', 'score', 'stream_data']
     the_ret_item = self._exact_match_db.hmget(ret_id, ret_item_keys)
@@ -187,6 +195,7 @@ class TrainRetHandler(BaseHandler):
     self.render("ret-item.html", title='ret_item', ret_item=ret_item)
 
 class TestRetHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ret_id):
     ret_item_keys = ['id', 'query', 'file', 'stream_id', 'score', 'stream_data']
     the_ret_item = self._test_exact_match_db.hmget(ret_id, ret_item_keys)
@@ -211,6 +220,7 @@ class TestRetHandler(BaseHandler):
     self.render("ret-item.html", title='ret_item', ret_item=ret_item)
 
 class FilteredRetHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ret_id):
     ret_item_keys = ['id', 'query', 'file', 'stream_id', 'score', 'stream_data']
     the_ret_item = self._filtered_db.hmget(ret_id, ret_item_keys)
@@ -235,6 +245,7 @@ class FilteredRetHandler(BaseHandler):
     self.render("ret-item.html", title='ret_item', ret_item=ret_item)
 
 class WikiIndexHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._wiki_match_db.llen(RedisDB.ret_item_list)
     if 0 == num:
@@ -263,6 +274,7 @@ class WikiIndexHandler(BaseHandler):
     self.render("wiki-ret-index.html", title='KBA Testing Results', ret_items=ret_items)
 
 class WikiRetHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ret_id):
     ret_item_keys = ['id', 'query', 'file', 'stream_id', 'score', 'rel', 'stream_data']
     the_ret_item = self._wiki_match_db.hmget(ret_id, ret_item_keys)
@@ -288,6 +300,7 @@ class WikiRetHandler(BaseHandler):
     self.render("wiki-ret-item.html", title='ret_item', ret_item=ret_item)
 
 class NewWikiIndexHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._new_wiki_match_db.llen(RedisDB.ret_item_list)
     if 0 == num:
@@ -313,6 +326,7 @@ class NewWikiIndexHandler(BaseHandler):
     self.render("new-wiki-ret-index.html", title='KBA Testing Results', ret_items=ret_items)
 
 class NewWikiRetHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ret_id):
     url = '/wiki/ret/%s' % ret_id
     self.redirect(url, permanent=True)
@@ -343,6 +357,7 @@ class NewWikiRetHandler(BaseHandler):
     '''
 
 class EvalHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._eval_db.llen(RedisDB.ret_item_list)
     if 0 == num:
@@ -373,6 +388,7 @@ class EvalHandler(BaseHandler):
     self.render("eval-index.html", title='KBA Qrels', ret_items=ret_items)
 
 class EvalItemHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ret_id):
     ret_item_keys = ['id', 'query', 'file', 'stream_id', 'score',
         'stream_data', 'judge1', 'judge2']
@@ -396,6 +412,7 @@ class EvalItemHandler(BaseHandler):
     self.render("eval-item.html", title='ret_item', ret_item=ret_item)
 
 class WikiEntListHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._wiki_ent_list_db.llen(RedisDB.wiki_ent_list)
     if 0 == num:
@@ -425,6 +442,7 @@ class WikiEntListHandler(BaseHandler):
     self.render("wiki-ent-list.html", title='KBA Wiki Ent List', ent_items=ent_items)
 
 class RelEntViewHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ent_id):
     keys = self._rel_ent_dist_db.hkeys(ent_id)
     if 0 == len(keys):
@@ -472,6 +490,7 @@ class RelEntViewHandler(BaseHandler):
         ret_items=ret_items)
 
 class RelEntDistHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ent_id):
     keys = self._rel_ent_dist_db.hkeys(ent_id)
     if 0 == len(keys):
@@ -492,6 +511,7 @@ class RelEntDistHandler(BaseHandler):
       self.write(line)
 
 class MissedIndexHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._missed_docs_db.llen(RedisDB.ret_item_list)
     if 0 == num:
@@ -515,6 +535,7 @@ class MissedIndexHandler(BaseHandler):
     self.render("missed-index.html", title='KBA Missed Results', ret_items=ret_items)
 
 class MissedRetHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ret_id):
     ret_item_keys = ['id', 'query', 'file', 'stream_id', 'rating', 'stream_data']
     the_ret_item = self._missed_docs_db.hmget(ret_id, ret_item_keys)
@@ -568,6 +589,9 @@ class Application(tornado.web.Application):
 
     tornado.web.Application.__init__(self, handlers, **settings)
 
+    # the threads of the handlers reading Redis, the IOLoop is never blocked
+    self._db_pool = dbpool.DBPool(options.db_threads)
+
     # global database connections for all handles
     self._exact_match_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
         #db=RedisDB.train_exact_match_db)
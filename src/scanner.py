@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Parallel scan driver over the chunk files of the stream corpus
+
+The chunk files of one or more date-hour directories are spread across a
+pool of worker processes. Each worker runs the per-file handler, which does
+the CPU-bound work (thrift decoding, matching) and returns its results; all
+the results flow back to a single writer in the parent process, so only one
+process ever talks to the result DB.
+'''
+
+import os
+import sys
+import multiprocessing
+
+# the per-file handler of the running scan, inherited by the forked workers
+_handler = None
+
+def chunk_files(thrift_dirs):
+  '''
+  list the decrypted and uncompressed chunk files in the given directories
+  '''
+  if isinstance(thrift_dirs, basestring):
+    thrift_dirs = [thrift_dirs]
+
+  files = []
+  for thrift_dir in thrift_dirs:
+    for fname in sorted(os.listdir(thrift_dir)):
+      ## ignore other files, e.g. stats.json
+      if fname.endswith('.gpg'): continue
+      if fname.endswith('.xz'): continue
+      if fname.endswith('.json'): continue
+
+      fpath = os.path.join(thrift_dir, fname)
+      if not os.path.isfile(fpath): continue
+      files.append(fpath)
+
+  return files
+
+def _run_handler(fpath):
+  '''
+  run the handler on one file inside a worker
+  '''
+  try:
+    return fpath, _handler(fpath), None
+  except KeyboardInterrupt:
+    # let the parent process handle the interruption
+    return fpath, [], 'interrupted'
+  except Exception as e:
+    return fpath, [], '%s: %s' % (e.__class__.__name__, e)
+
+def scan(thrift_dirs, handler, writer, num_workers=None):
+  '''
+  apply handler(fpath) -> [result, ...] to every chunk file of thrift_dirs
+  and pass each (fpath, result) to writer in the calling process
+
+  num_workers defaults to the number of cores; with one worker the files are
+  processed serially in the calling process
+  '''
+  global _handler
+
+  files = chunk_files(thrift_dirs)
+  if num_workers is None:
+    num_workers = multiprocessing.cpu_count()
+  num_workers = max(1, min(num_workers, len(files)))
+
+  if num_workers == 1:
+    for fpath in files:
+      print 'Process %s' % fpath
+      for result in handler(fpath):
+        writer(fpath, result)
+    return
+
+  print 'Scanning %d files with %d workers' % (len(files), num_workers)
+
+  _handler = handler
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    # the handler is not pickled, the forked workers inherit it
+    for fpath, results, error in pool.imap_unordered(_run_handler, files):
+      if error:
+        sys.stderr.write('Failed to process %s: %s\n' % (fpath, error))
+        continue
+
+      print 'Process %s' % fpath
+      for result in results:
+        writer(fpath, result)
+
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    _handler = None
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Buffered writer of result items into a Redis DB
+
+Every result item is a hash keyed by its id, with the id appended to a list
+(RedisDB.ret_item_list). Instead of llen + rpush + hmset round trips per
+item, the items are buffered and written through one pipeline per batch, and
+the ids of a batch are reserved with a single INCRBY on a counter, so several
+writers can fill the same DB without handing out the same id twice.
+'''
+
+class ResultSink():
+  '''
+  Buffer the result items and flush them in batches
+  '''
+
+  def __init__(self, db, list_key, batch_size=500, first_id=0):
+    '''
+    first_id is the id of the first item of an empty list, the matchers
+    number their results either from 0 or from 1
+    '''
+    self._db = db
+    self._list_key = list_key
+    self._counter_key = '%s-counter' % list_key
+    self._batch_size = max(1, batch_size)
+    self._first_id = first_id
+    self._items = []
+    self._counter_ready = False
+    self.num_saved = 0
+
+  def _init_counter(self):
+    '''
+    start the id counter after the items already in the list
+    '''
+    if not self._counter_ready:
+      self._db.setnx(self._counter_key, self._db.llen(self._list_key))
+      self._counter_ready = True
+
+  def add(self, ret_item, new_id=None):
+    '''
+    buffer one item, it is saved under the next id unless it has one
+    already; with new_id, it is given the next id whatever its 'id' field is
+    '''
+    if new_id is None:
+      new_id = 'id' not in ret_item
+    self._items.append((new_id, ret_item))
+    if len(self._items) >= self._batch_size:
+      self.flush()
+
+  def flush(self):
+    '''
+    write the buffered items, returns the list of their ids
+    '''
+    items = self._items
+    if not items:
+      return []
+    self._items = []
+
+    ## reserve the ids of the whole batch at once
+    num = len([new_id for new_id, ret_item in items if new_id])
+    if num > 0:
+      self._init_counter()
+      next_id = self._db.incr(self._counter_key, num) - num + self._first_id
+
+    ids = []
+    pipe = self._db.pipeline(transaction=False)
+    for new_id, ret_item in items:
+      if new_id:
+        id = next_id
+        next_id += 1
+        ret_item.setdefault('id', id)
+      else:
+        id = ret_item['id']
+      pipe.rpush(self._list_key, id)
+      pipe.hmset(id, ret_item)
+      ids.append(id)
+    pipe.execute()
+
+    self.num_saved += len(items)
+    return ids
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+stream_id -> (date-hour, chunk file, byte offset) index of the corpus
+
+There is one index file per date-hour directory, <index_dir>/<date_hour>.idx,
+made of the names of the chunk files followed by fixed size records sorted by
+stream_id:
+
+  'KBAIDX01'
+  !H  number of chunk files, then for each of them !H length + name
+  !I  number of records, then for each of them
+      !I epoch, 16s md5 digest, !H chunk file number, !I byte offset
+
+A stream_id (<epoch>-<md5 hex>) is packed into 20 bytes, so the index of a
+date-hour is small enough to be binary searched in memory, and a lookup is a
+seek into a single chunk file instead of decoding the whole directory.
+'''
+
+import os
+import struct
+import datetime
+
+MAGIC = 'KBAIDX01'
+
+_COUNT = struct.Struct('!H')
+_SIZE = struct.Struct('!I')
+_RECORD = struct.Struct('!I16sHI')
+_KEY_SIZE = 20
+
+def date_hour(epoch):
+  '''
+  the date-hour directory holding the documents of the given epoch
+  '''
+  time = datetime.datetime.utcfromtimestamp(float(epoch))
+  return '%d-%.2d-%.2d-%.2d' %(time.year, time.month, time.day, time.hour)
+
+def pack_key(stream_id):
+  '''
+  pack a stream_id into its 20 bytes sort key, raises ValueError if the
+  stream_id is not <epoch>-<md5 hex>
+  '''
+  epoch, digest = stream_id.split('-', 1)
+  if len(digest) != 32:
+    raise ValueError('invalid stream_id: %s' % stream_id)
+  try:
+    return struct.pack('!I', int(epoch)) + digest.decode('hex')
+  except TypeError:
+    raise ValueError('invalid stream_id: %s' % stream_id)
+
+def index_path(index_dir, date_hour):
+  return os.path.join(index_dir, '%s.idx' % date_hour)
+
+def write_index(path, entries):
+  '''
+  write the index of one date-hour from a list of (stream_id, fname, offset)
+  '''
+  fnames = sorted(set(fname for stream_id, fname, offset in entries))
+  fname2id = dict((fname, id) for id, fname in enumerate(fnames))
+
+  records = []
+  for stream_id, fname, offset in entries:
+    key = pack_key(stream_id)
+    records.append(key + struct.pack('!HI', fname2id[fname], offset))
+  ## the keys are big-endian, so sorting the packed records sorts them by
+  ## epoch then digest
+  records.sort()
+
+  ## write to a temporary file first, a crash never leaves a truncated index
+  tmp_path = '%s.tmp' % path
+  f = open(tmp_path, 'wb')
+  f.write(MAGIC)
+  f.write(_COUNT.pack(len(fnames)))
+  for fname in fnames:
+    f.write(_COUNT.pack(len(fname)))
+    f.write(fname)
+  f.write(_SIZE.pack(len(records)))
+  f.write(''.join(records))
+  f.close()
+  os.rename(tmp_path, path)
+
+class StreamIndex():
+  '''
+  the index of one date-hour directory
+  '''
+
+  def __init__(self, path):
+    data = open(path, 'rb').read()
+    if not data.startswith(MAGIC):
+      raise IOError('invalid index file: %s' % path)
+
+    pos = len(MAGIC)
+    num, = _COUNT.unpack_from(data, pos)
+    pos += _COUNT.size
+    self._fnames = []
+    for i in range(num):
+      size, = _COUNT.unpack_from(data, pos)
+      pos += _COUNT.size
+      self._fnames.append(data[pos:pos + size])
+      pos += size
+
+    self._num, = _SIZE.unpack_from(data, pos)
+    pos += _SIZE.size
+    self._records = buffer(data, pos, self._num * _RECORD.size)
+
+  def __len__(self):
+    return self._num
+
+  def lookup(self, stream_id):
+    '''
+    return (fname, offset) of the stream_id, or None if it is not indexed
+    '''
+    try:
+      key = pack_key(stream_id)
+    except ValueError:
+      return None
+
+    ## binary search over the fixed size records
+    records = self._records
+    lo = 0
+    hi = self._num
+    while lo < hi:
+      mid = (lo + hi) // 2
+      start = mid * _RECORD.size
+      if records[start:start + _KEY_SIZE] < key:
+        lo = mid + 1
+      else:
+        hi = mid
+
+    if lo == self._num:
+      return None
+    start = lo * _RECORD.size
+    if records[start:start + _KEY_SIZE] != key:
+      return None
+    epoch, digest, fid, offset = _RECORD.unpack_from(records, start)
+    return self._fnames[fid], offset
+
+class CorpusIndex():
+  '''
+  lookups over all the date-hour indexes in a directory, the indexes being
+  loaded on demand and kept in memory
+  '''
+
+  def __init__(self, index_dir, max_cached=64):
+    self._index_dir = index_dir
+    self._max_cached = max_cached
+    self._indexes = {}
+
+  def get(self, date_hour):
+    '''
+    the index of one date-hour, or None if it has not been built
+    '''
+    ## a single lookup, the cache may be cleared by another thread
+    index = self._indexes.get(date_hour)
+    if index is not None:
+      return index
+
+    path = index_path(self._index_dir, date_hour)
+    if not os.path.isfile(path):
+      return None
+
+    if len(self._indexes) >= self._max_cached:
+      self._indexes.clear()
+    index = StreamIndex(path)
+    self._indexes[date_hour] = index
+    return index
+
+  def locate(self, stream_id):
+    '''
+    return (date_hour, fname, offset) of the stream_id, or None
+    '''
+    try:
+      epoch = stream_id.split('-', 1)[0]
+      dh = date_hour(epoch)
+    except ValueError:
+      return None
+
+    index = self.get(dh)
+    if index is None:
+      return None
+
+    location = index.lookup(stream_id)
+    if location is None:
+      return None
+    return dh, location[0], location[1]
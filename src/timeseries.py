@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Daily document counts of a query and of its related entities
+
+The stream ids start with the epoch of the document, so the UTC day of every
+document is epoch // 86400 once and for all. For one query, the series keep,
+over the train and test E-D maps together:
+
+  topic  the number of documents of the query on each day (d2e maps)
+  ents   entity x day matrix, the number of documents of each entity of the
+         test map on each day (e2d maps)
+
+The days run from the first day of the analysis range, or of an earlier
+document, to its last day, or the one of a later document; the days out of
+the range are flagged so that the analyses can tell them apart. The series
+are saved with numpy.savez, one file per query, along with the edmap-version
+of the train and test DBs they were built from; they are built again once
+gen-ed-map.py has changed the maps.
+
+The entity series of a query are correlated with the topic series together,
+over a window of lags, as one product of the entity x day matrix.
+'''
+
+import os
+import datetime
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import edmap
+
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+def epoch_days(stream_ids):
+  '''
+  the UTC day, since the epoch, of each stream id
+  '''
+  epochs = np.array([int(did.split('-', 1)[0]) for did in stream_ids],
+      dtype=np.int64)
+  return epochs // 86400
+
+class DailySeries():
+  '''
+  the series of one query
+  '''
+
+  def __init__(self, first_day, start, num_days, topic, eids, ents,
+      stamp=None):
+    self.first_day = first_day
+    self.start = start
+    self.num_days = num_days
+    self.topic = topic
+    self.eids = eids
+    self.eid2row = dict((eid, row) for row, eid in enumerate(eids))
+    self.ents = ents
+    self.stamp = stamp
+
+  def in_range(self):
+    '''
+    whether each day is in the analysis range
+    '''
+    mask = np.zeros(len(self.topic), dtype=bool)
+    mask[self.start:self.start + self.num_days] = True
+    return mask
+
+  def date(self, day):
+    return EPOCH_DATE + datetime.timedelta(int(self.first_day + day))
+
+  def save(self, path):
+    ## write to a temporary file first, a crash never leaves a truncated file
+    tmp_path = '%s.tmp' % path
+    f = open(tmp_path, 'wb')
+    np.savez(f, days=np.array([self.first_day, self.start, self.num_days]),
+        topic=self.topic, eids=np.array(self.eids, dtype=str), ents=self.ents,
+        stamp=np.array(self.stamp, dtype=str))
+    f.close()
+    os.rename(tmp_path, path)
+
+  @classmethod
+  def load(cls, path):
+    data = np.load(path)
+    first_day, start, num_days = data['days'].tolist()
+    ## the files saved without a stamp never match one
+    stamp = tuple(data['stamp'].tolist()) if 'stamp' in data else None
+    return cls(first_day, start, num_days, data['topic'],
+        data['eids'].tolist(), data['ents'], stamp)
+
+def normalize(counts):
+  '''
+  the counts of each row over its sum, the rows without counts stay zero
+  '''
+  counts = np.asarray(counts, dtype=np.float64)
+  sums = counts.sum(axis=-1)
+  return counts / np.expand_dims(np.maximum(sums, 1), -1)
+
+def lagged_correlation(ents, topic, max_lag=0):
+  '''
+  the correlation of each row of ents with topic, the rows shifted by every
+  lag of [-max_lag, max_lag] days
+
+  returns a (rows, 2 * max_lag + 1) matrix, column max_lag + lag holding
+  sum(ents[:, t + lag] * topic[t]); a positive lag is an entity which follows
+  the topic entity
+  '''
+  ents = np.asarray(ents, dtype=np.float64)
+  topic = np.asarray(topic, dtype=np.float64)
+  num_rows, size = ents.shape
+  width = 2 * max_lag + 1
+
+  ## a read-only (rows, lags, days) view over the rows padded with zeros,
+  ## no window is copied
+  padded = np.zeros((num_rows, size + 2 * max_lag))
+  padded[:, max_lag:max_lag + size] = ents
+  row_stride, day_stride = padded.strides
+  windows = as_strided(padded, shape=(num_rows, width, size),
+      strides=(row_stride, day_stride, day_stride), writeable=False)
+  return np.einsum('rld,d->rl', windows, topic)
+
+def map_stamp(train_db, test_db):
+  '''
+  the edmap-version of the train and test DBs, as saved with the series
+  '''
+  return tuple(str(db.get(edmap.VERSION_KEY)) for db in [train_db, test_db])
+
+def build(query_id, train_db, test_db, start_date, end_date):
+  '''
+  the series of a query from its train and test E-D map DBs, over the
+  [start_date, end_date) range and the days of its documents
+  '''
+  ## stamped before reading, a change while reading is seen next time
+  stamp = map_stamp(train_db, test_db)
+
+  topic_days = np.concatenate([
+      epoch_days(db.hkeys('d2e-map-%s' % query_id))
+      for db in [train_db, test_db]])
+
+  ## the entities are those of the test map, their documents are counted in
+  ## both maps
+  matrices = [edmap.EDMatrix.load(db, query_id) for db in [train_db, test_db]]
+  eids = matrices[-1].eids
+  eid2row = dict((eid, row) for row, eid in enumerate(eids))
+
+  start_day = (start_date - EPOCH_DATE).days
+  end_day = (end_date - EPOCH_DATE).days
+  first_day = start_day
+  last_day = end_day - 1
+  for days in [topic_days] + [epoch_days(m.dids) for m in matrices]:
+    if len(days):
+      first_day = min(first_day, int(days.min()))
+      last_day = max(last_day, int(days.max()))
+  size = last_day - first_day + 1
+
+  topic = np.bincount(topic_days - first_day, minlength=size)
+
+  ents = np.zeros(len(eids) * size, dtype=np.int64)
+  for m in matrices:
+    rows = np.array([eid2row.get(eid, -1) for eid in m.eids], dtype=np.int64)
+    entry_rows = rows[m._rows] if len(m.eids) else np.zeros(0, np.int64)
+    mask = entry_rows >= 0
+    entry_rows = entry_rows[mask]
+    cols = m.indices[mask]
+
+    col_days = epoch_days(m.dids) - first_day
+    ents += np.bincount(entry_rows * size + col_days[cols],
+        minlength=len(eids) * size)
+
+  return DailySeries(first_day, start_day - first_day, end_day - start_day,
+      topic, eids, ents.reshape(len(eids), size), stamp)
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+'''
+store the normalized token stream of every document of a DB, in the 'tokens'
+field of its result hash, so that the later stages do not sanitize the raw
+stream_data again
+
+tokenize-docs.py <db> [--host HOST] [--port PORT] [--batch-size N] [--force]
+'''
+
+import sys
+
+import redis
+from config import RedisDB
+from loader import iter_ret_items
+import tokens
+
+def log(m, newline='\n'):
+  sys.stderr.write(m + newline)
+  sys.stderr.flush()
+
+class Tokenizer():
+  '''
+  Tokenize the documents of one DB
+  '''
+
+  def __init__(self, db, batch_size=500):
+    self._db = db
+    self._batch_size = max(1, batch_size)
+    self._vocab = tokens.Vocabulary(db)
+    self._pending = []
+
+  def flush(self):
+    ## the words go first, the saved tokens never refer to an unknown id
+    self._vocab.save()
+
+    pipe = self._db.pipeline(transaction=False)
+    for ret_id, data in self._pending:
+      pipe.hset(ret_id, 'tokens', data)
+    pipe.execute()
+    self._pending = []
+
+  def tokenize(self, force=False):
+    num = self._db.llen(RedisDB.ret_item_list)
+    if 0 == num:
+      print 'no ret_item found'
+      return
+
+    so_far = 0
+    skipped = 0
+    for ret_id, ret_item in iter_ret_items(self._db, RedisDB.ret_item_list,
+        ['stream_data', 'tokens'], self._batch_size):
+      so_far += 1
+      if (ret_item['tokens'] is not None and not force) \
+          or ret_item['stream_data'] is None:
+        skipped += 1
+        continue
+
+      ids = self._vocab.encode(ret_item['stream_data'])
+      self._pending.append((ret_id, tokens.pack(ids)))
+      if len(self._pending) >= self._batch_size:
+        self.flush()
+        log('%d / %d' %(so_far, num))
+
+    self.flush()
+    print 'Tokenized %d documents, %d skipped, %d words in the vocabulary' %(
+        so_far - skipped, skipped, len(self._vocab))
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(usage=__doc__)
+  parser.add_argument('db', type=int)
+  parser.add_argument('--host', default=RedisDB.host)
+  parser.add_argument('--port', type=int, default=RedisDB.port)
+  parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+      help='number of documents read and written at once')
+  parser.add_argument('--force', default=False, action='store_true',
+      help='tokenize again the documents which have been tokenized')
+  args = parser.parse_args()
+
+  db = redis.Redis(host=args.host, port=args.port, db=args.db)
+  Tokenizer(db, args.batch_size).tokenize(args.force)
+
+if __name__ == '__main__':
+  try:
+    main()
+  except KeyboardInterrupt:
+    print '\nGoodbye!'
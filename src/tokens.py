@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Normalized token streams of the documents, stored next to their raw text
+
+The ingestion stage (tokenize-docs.py) runs every stream_data of a DB through
+normalize.sanitize() once and saves the words as an array of 32 bits token
+ids, little-endian, in the 'tokens' field of the result hash. The words are
+numbered by a vocabulary shared by all the documents of the DB:
+
+  token-vocab       hash, word -> token id
+  token-vocab-list  list, the words in token id order
+
+Token id 0 is the empty word, it marks a separator at the start or at the end
+of the document, so that the decoded text is exactly the sanitized one.
+'''
+
+import sys
+import itertools
+from array import array
+
+import normalize
+from loader import iter_ret_items
+
+VOCAB_HASH = 'token-vocab'
+VOCAB_LIST = 'token-vocab-list'
+
+def pack(ids):
+  '''
+  the stored form of an array of token ids
+  '''
+  if sys.byteorder == 'big':
+    ids = array('I', ids)
+    ids.byteswap()
+  return ids.tostring()
+
+def unpack(data):
+  '''
+  the array of token ids of a stored 'tokens' field
+  '''
+  ids = array('I')
+  ids.fromstring(data)
+  if sys.byteorder == 'big':
+    ids.byteswap()
+  return ids
+
+class Vocabulary():
+  '''
+  the token ids of the words of a DB
+
+  new words are only numbered by the ingestion stage, which is the single
+  writer of the vocabulary
+  '''
+
+  def __init__(self, db):
+    self._db = db
+    self._words = db.lrange(VOCAB_LIST, 0, -1)
+    self._num_saved = len(self._words)
+    if not self._words:
+      self._words = ['']
+    self._word2id = dict((word, id) for id, word in enumerate(self._words))
+
+  def __len__(self):
+    return len(self._words)
+
+  def encode(self, text):
+    '''
+    sanitize the text and return the array of its token ids, the unknown
+    words are given new ids
+    '''
+    text = normalize.sanitize(text)
+    if isinstance(text, unicode):
+      text = text.encode('utf-8')
+
+    ids = array('I')
+    if text.startswith(' '):
+      ids.append(0)
+    for word in text.split():
+      id = self._word2id.get(word)
+      if id is None:
+        id = len(self._words)
+        self._words.append(word)
+        self._word2id[word] = id
+      ids.append(id)
+    if text.endswith(' '):
+      ids.append(0)
+    return ids
+
+  def decode(self, ids):
+    '''
+    the sanitized text of an array of token ids
+    '''
+    words = self._words
+    return ' '.join([words[id] for id in ids])
+
+  def doc_text(self, ret_item):
+    '''
+    the sanitized text of a result item, from its tokens if it has been
+    tokenized and from its stream_data otherwise
+    '''
+    data = ret_item.get('tokens')
+    if data:
+      return self.decode(unpack(data))
+    return normalize.sanitize(ret_item['stream_data'])
+
+  def iter_doc_texts(self, list_key, keys, batch_size=500):
+    '''
+    yield (ret_id, ret_item, text) for each id of list_key, text being the
+    sanitized text of the item, None if it has no stream_data; only the
+    tokens are read, and the stream_data of the items not tokenized yet
+    '''
+    items = iter_ret_items(self._db, list_key, keys + ['tokens'], batch_size)
+    while True:
+      batch = list(itertools.islice(items, batch_size))
+      if not batch:
+        return
+
+      pipe = self._db.pipeline(transaction=False)
+      for ret_id, ret_item in batch:
+        if not ret_item['tokens']:
+          pipe.hget(ret_id, 'stream_data')
+      stream_data = iter(pipe.execute())
+
+      for ret_id, ret_item in batch:
+        data = ret_item.pop('tokens')
+        if data:
+          text = self.decode(unpack(data))
+        else:
+          text = next(stream_data)
+          if text is not None:
+            text = normalize.sanitize(text)
+        yield ret_id, ret_item, text
+
+  def save(self):
+    '''
+    write the words numbered since the last save
+    '''
+    new_words = self._words[self._num_saved:]
+    pipe = self._db.pipeline(transaction=False)
+    for id, word in enumerate(new_words, self._num_saved):
+      ## the empty word of id 0 is only in the list
+      if word:
+        pipe.hset(VOCAB_HASH, word, id)
+      pipe.rpush(VOCAB_LIST, word)
+    pipe.execute()
+    self._num_saved = len(self._words)
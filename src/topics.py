@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Parallel tuning driver over the query topics
+
+The tuners (greedy-ent.py, query-opt-ent.py, ...) handle each topic on its
+own: they read its qrels and E-D map, tune it, and keep its scored documents
+and cutoff in their _ret_list and _cutoff_list dicts until the run file is
+written. The topics are spread across a pool of forked worker processes,
+each one holding its own copy of the tuner; the entries of each topic flow
+back to the tuner of the parent process, which writes the run file once.
+'''
+
+import sys
+import multiprocessing
+
+# the tuner and the per-topic function of the running sweep, inherited by
+# the forked workers
+_tuner = None
+_tune = None
+
+def _run_tune(query_id):
+  '''
+  tune one topic inside a worker
+  '''
+  try:
+    score = _tune(query_id)
+    ## the parent keeps the results, the worker does not need them anymore
+    ret_list = _tuner._ret_list.pop(query_id, None)
+    cutoff = _tuner._cutoff_list.pop(query_id, None)
+    return query_id, score, ret_list, cutoff, None
+  except KeyboardInterrupt:
+    # let the parent process handle the interruption
+    return query_id, None, None, None, 'interrupted'
+  except Exception as e:
+    return query_id, None, None, None, '%s: %s' % (e.__class__.__name__, e)
+
+def tune_topics(tuner, tune, query_ids, num_workers=None):
+  '''
+  apply tune(query_id) -> score to every topic and merge the _ret_list and
+  _cutoff_list entries of each topic into tuner
+
+  returns [(query_id, score), ...] in the order of query_ids; if topics
+  failed, RuntimeError is raised once the others are done, as the serial
+  sweep would have stopped on the first of them
+
+  num_workers defaults to the number of cores; with one worker the topics
+  are tuned serially in the calling process
+  '''
+  global _tuner, _tune
+
+  query_ids = list(query_ids)
+  if num_workers is None:
+    num_workers = multiprocessing.cpu_count()
+  num_workers = max(1, min(num_workers, len(query_ids)))
+
+  if num_workers == 1:
+    return [(query_id, tune(query_id)) for query_id in query_ids]
+
+  print 'Tuning %d queries with %d workers' % (len(query_ids), num_workers)
+
+  scores = {}
+  failed = []
+  _tuner = tuner
+  _tune = tune
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    # the tuner is not pickled, the forked workers inherit it
+    for query_id, score, ret_list, cutoff, error in pool.imap_unordered(
+        _run_tune, query_ids):
+      if error:
+        sys.stderr.write('Failed to tune query %s: %s\n' % (query_id, error))
+        failed.append((query_id, error))
+        continue
+
+      if ret_list is not None:
+        tuner._ret_list[query_id] = ret_list
+      if cutoff is not None:
+        tuner._cutoff_list[query_id] = cutoff
+      scores[query_id] = score
+
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    _tuner = None
+    _tune = None
+
+  ## a partial sweep would be averaged over the other topics only
+  if failed:
+    raise RuntimeError('failed to tune %d queries: %s' %(len(failed),
+        ', '.join('%s (%s)' %(query_id, error) for query_id, error in failed)))
+
+  return [(query_id, scores[query_id]) for query_id in query_ids]
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Streaming decryption and decompression of the .xz.gpg chunk files
+
+gpg writes the decrypted data straight into the stdin of xz, and the
+decompressed thrift data is written to disk piece by piece while its md5 is
+computed, so no file is ever held in memory as a whole. Several files are
+unpacked concurrently by a pool of threads, each of them waiting on its own
+pair of child processes.
+'''
+
+import os
+import sys
+import hashlib
+import tempfile
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+gpg_base_dir = './gpg/'
+
+# the size of the pieces read from the decompressor
+CHUNK_SIZE = 1024 * 1024
+
+def log(m, newline='\n'):
+    sys.stderr.write(m + newline)
+    sys.stderr.flush()
+
+def import_key(gpg_key_path, date_hour):
+    '''
+    setup the gpg home of a date-hour and import the key into it
+    '''
+    gpg_dir = gpg_base_dir + date_hour + '.gpg-dir'
+    if not os.path.exists(gpg_dir):
+        os.makedirs(gpg_dir)
+    gpg_child = subprocess.Popen(['gpg', '--no-permission-warning', '--homedir',
+      gpg_dir, '--import', gpg_key_path], stderr=subprocess.PIPE)
+    s_out, errors = gpg_child.communicate()
+    if errors:
+        log("gpg prints to stderr, even when nothing is wrong, read carefully:\n\n%s"
+            % errors)
+    return gpg_dir
+
+def decrypt_file(gpg_dir, fpath, save_file_name, expected_md5=None):
+    '''
+    decrypt and uncompress fpath into save_file_name, return the md5 of the
+    thrift data
+
+    the data is written to a temporary file which is only renamed to
+    save_file_name once both children succeeded and the md5 matches, so a
+    failure never leaves a truncated chunk behind
+    '''
+    ## the stderr of the children go to temporary files, a full stderr pipe
+    ## would block them; close_fds keeps the pipes of the other threads'
+    ## children out of these ones
+    gpg_errors = tempfile.TemporaryFile()
+    xz_errors = tempfile.TemporaryFile()
+
+    ## gpg reads the encrypted file itself and writes into the pipe to xz
+    gpg_child = subprocess.Popen(
+        ['gpg',   '--no-permission-warning', '--homedir', gpg_dir,
+          '--trust-model', 'always', '--output', '-', '--decrypt', fpath],
+        stdout=subprocess.PIPE,
+        stderr=gpg_errors,
+        close_fds=True)
+
+    ## speak to xz over pipes as a child process, because python
+    ## bindings to liblzma are... insufficient.
+    xz_child = subprocess.Popen(
+        ['xz', '--decompress'],
+        stdin=gpg_child.stdout,
+        stdout=subprocess.PIPE,
+        stderr=xz_errors,
+        close_fds=True)
+
+    ## only xz holds the read end of the pipe now, so that gpg gets SIGPIPE
+    ## if xz exits early
+    gpg_child.stdout.close()
+
+    tmp_file_name = save_file_name + '.tmp'
+    content_md5 = hashlib.md5()
+    f = open(tmp_file_name, 'wb')
+    try:
+        while True:
+            data = xz_child.stdout.read(CHUNK_SIZE)
+            if not data:
+                break
+            content_md5.update(data)
+            f.write(data)
+    finally:
+        f.close()
+        xz_child.stdout.close()
+        xz_status = xz_child.wait()
+        gpg_status = gpg_child.wait()
+
+    gpg_errors.seek(0)
+    errors = gpg_errors.read()
+    if errors:
+        log(errors)
+
+    try:
+        assert 0 == gpg_status, 'gpg failed on %s' % fpath
+
+        ## catch anything from xz's stderr
+        xz_errors.seek(0)
+        errors = xz_errors.read()
+        assert not errors and 0 == xz_status, errors
+
+        ## compare md5 hashes:
+        content_md5 = content_md5.hexdigest()
+        if expected_md5 is not None:
+            assert content_md5 == expected_md5, \
+                '%r != %r' % (content_md5, expected_md5)
+    except:
+        os.remove(tmp_file_name)
+        raise
+
+    os.rename(tmp_file_name, save_file_name)
+    return content_md5
+
+def file_md5(fpath):
+    '''
+    md5 of a file on disk, read piece by piece
+    '''
+    content_md5 = hashlib.md5()
+    f = open(fpath, 'rb')
+    try:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            content_md5.update(data)
+    finally:
+        f.close()
+    return content_md5.hexdigest()
+
+class Manifest():
+    '''
+    Record of the chunk files of a date-hour which have been completely
+    unpacked, one 'fname<TAB>size<TAB>md5' line per file
+
+    Lines are appended and flushed to disk as soon as a file is done, so the
+    manifest survives a crash; a partially written last line is ignored.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+
+        if not os.path.exists(path):
+            return
+        for line in open(path):
+            if not line.endswith('\n'):
+                continue
+            values = line.rstrip('\n').split('\t')
+            if 3 != len(values) or not values[1].isdigit():
+                continue
+            self._entries[values[0]] = (int(values[1]), values[2])
+
+    def __contains__(self, fname):
+        return fname in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, fname, size, content_md5):
+        self._entries[fname] = (size, content_md5)
+        f = open(self._path, 'a')
+        f.write('%s\t%d\t%s\n' % (fname, size, content_md5))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def remove(self, fname):
+        '''
+        drop an entry, the manifest is rewritten
+        '''
+        if fname not in self._entries:
+            return
+        del self._entries[fname]
+
+        tmp_path = self._path + '.tmp'
+        f = open(tmp_path, 'w')
+        for name in sorted(self._entries):
+            size, content_md5 = self._entries[name]
+            f.write('%s\t%d\t%s\n' % (name, size, content_md5))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(tmp_path, self._path)
+
+    def is_complete(self, fpath, verify=False):
+        '''
+        whether fpath is recorded and still on disk with the recorded size;
+        with verify, its md5 is computed again as well
+        '''
+        fname = os.path.basename(fpath)
+        if fname not in self._entries:
+            return False
+
+        size, content_md5 = self._entries[fname]
+        if not os.path.isfile(fpath) or os.path.getsize(fpath) != size:
+            return False
+        if verify and file_md5(fpath) != content_md5:
+            return False
+        return True
+
+def _run_job(job):
+    '''
+    unpack one file inside the pool, returns (job, md5, error)
+    '''
+    try:
+        return job, decrypt_file(*job), None
+    except Exception as e:
+        return job, None, '%s: %s' % (e.__class__.__name__, e)
+
+def unpack_files(jobs, num_workers=4, callback=None):
+    '''
+    run the jobs, each of them being the arguments of decrypt_file(), with
+    num_workers files in flight at a time
+
+    callback(job, md5) is called in the calling thread for every unpacked
+    file, returns the list of the failed jobs
+    '''
+    failed = []
+    pool = ThreadPool(max(1, num_workers))
+    try:
+        for job, content_md5, error in pool.imap_unordered(_run_job, jobs):
+            if error:
+                log('Failed to unpack %s: %s' % (job[1], error))
+                failed.append(job)
+                continue
+
+            print 'Unpacked %s' % job[2]
+            if callback is not None:
+                callback(job, content_md5)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return failed
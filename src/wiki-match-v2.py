@@ -10,7 +10,11 @@ entities in the document
 In this version, we only consider the documents which has already been
 extracted and has exact match with the query entity
 
-exact-match-v2.py <query>
+exact-match-v2.py <query> [--index <index_file>]
+
+with --index, the related entities are counted from a positional index of the
+documents, which is built and saved in index_file if it does not exist yet or
+the documents have changed since
 '''
 
 import re
@@ -28,6 +32,10 @@ from cStringIO import StringIO
 
 import redis
 from config import RedisDB
+import normalize
+import tokens
+from loader import iter_ret_items
+import phrase_index
 
 QUERY_ENT_MATCH_SCORE = 100
 WIKI_ENT_MATCH_SCORE = 1
@@ -82,33 +90,13 @@ class WikiMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    return query.lower()
+    return normalize.format_query(query)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def load_wiki_ent(self):
     num = self._wiki_ent_list_db.llen(RedisDB.wiki_ent_list)
@@ -155,7 +143,8 @@ class WikiMatch():
 
     return score
 
-  def process_stream_item(self, org_query, fname, stream_id, stream_data):
+  def process_stream_item(self, org_query, fname, stream_id, stream_data,
+      doc=None):
     '''
     process the streaming item: applying exact match for each of the query
     entity
@@ -167,7 +156,10 @@ class WikiMatch():
       print 'Invalid query: [%s].\nNO qid found.' %query
       return
 
-    new_stream_data = self.sanitize(stream_data)
+    ## doc is the sanitized stream_data, when it has been tokenized already
+    new_stream_data = doc
+    if new_stream_data is None:
+      new_stream_data = self.sanitize(stream_data)
     query = self._query_hash[qid]
 
     try:
@@ -209,33 +201,66 @@ class WikiMatch():
       print 'no ret_item found'
       return
 
-    ret_item_list = self._exact_match_db.lrange(RedisDB.ret_item_list, 0, num)
-    ret_items = []
-    for ret_id in ret_item_list:
-      ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data']
-      the_ret_item = self._exact_match_db.hmget(ret_id, ret_item_keys)
-
-      ret_item = {}
-      ret_item['id'] = the_ret_item[0]
-      ret_item['query'] = the_ret_item[1]
-      ret_item['file'] = the_ret_item[2]
-      ret_item['stream_id'] = the_ret_item[3]
-      ret_item['stream_data'] = the_ret_item[4]
-
+    vocab = tokens.Vocabulary(self._exact_match_db)
+    ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data',
+        'tokens']
+    for ret_id, ret_item in iter_ret_items(self._exact_match_db,
+        RedisDB.ret_item_list, ret_item_keys):
       ## process data
       self.process_stream_item(ret_item['query'], ret_item['file'],
-          ret_item['stream_id'], ret_item['stream_data'])
+          ret_item['stream_id'], ret_item['stream_data'],
+          vocab.doc_text(ret_item))
+
+  def parse_index(self, index):
+    '''
+    Score all the documents of the index, the related entities of a query are
+    counted from the postings instead of being searched in every document
+    '''
+    query_docs = defaultdict(set)
+    for num in range(len(index)):
+      query_docs[index.doc(num)['query']].add(num)
+
+    scores = defaultdict(int)
+    for org_query, docs in query_docs.iteritems():
+      if org_query not in self._wiki_ent_hash:
+        print 'I can not find the query [%s] in self._wiki_ent_hash' %org_query
+        continue
+      for ent in self._wiki_ent_hash[org_query]:
+        for num, count in index.counts(ent, docs).iteritems():
+          scores[num] += WIKI_ENT_MATCH_SCORE * count
+
+    for num in range(len(index)):
+      doc = index.doc(num)
+      org_query = doc['query']
+      if org_query not in self._query2id_hash:
+        print 'Invalid query: [%s].\nNO qid found.' %org_query
+        continue
+
+      score = scores[num]
+      if doc['query_found']:
+        score = score + QUERY_ENT_MATCH_SCORE
+
+      ## verbose output
+      print 'Match: %s - %s - %s - %d' %(doc['id'], org_query,
+          doc['stream_id'], score)
 
 def main():
   import argparse
   parser = argparse.ArgumentParser(usage=__doc__)
   parser.add_argument('query')
+  parser.add_argument('--index', default=None,
+      help='positional index of the documents, built if missing or stale')
   args = parser.parse_args()
 
   match = WikiMatch()
   match.parse_query(args.query)
   match.load_wiki_ent()
-  match.parse_data()
+  if args.index:
+    index = phrase_index.load_or_build(args.index, match._exact_match_db,
+        RedisDB.ret_item_list)
+    match.parse_index(index)
+  else:
+    match.parse_data()
 
 if __name__ == '__main__':
   try:
@@ -10,7 +10,12 @@ relevance score of each document
 In this version, we only consider the documents which has already been
 extracted and has exact match with the query entity
 
-wiki-weight-match.py <query> <weight_list>
+wiki-weight-match.py <query> <weight_list> [--index <index_file>]
+
+with --index, the related entities are counted from a positional index of the
+documents, which is built and saved in index_file if it does not exist yet or
+the documents have changed since, so that scoring another weight list does
+not scan the documents again
 '''
 
 import re
@@ -27,6 +32,10 @@ from cStringIO import StringIO
 
 import redis
 from config import RedisDB
+import normalize
+import tokens
+from loader import iter_ret_items
+import phrase_index
 
 QUERY_ENT_MATCH_SCORE = 100
 WIKI_ENT_MATCH_SCORE = 10
@@ -89,33 +98,13 @@ class WikiWeightMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    return query.lower()
+    return normalize.format_query(query)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def load_weight_list(self, weight_list):
     try:
@@ -187,7 +176,8 @@ class WikiWeightMatch():
 
     return score
 
-  def process_stream_item(self, org_query, fname, stream_id, stream_data):
+  def process_stream_item(self, org_query, fname, stream_id, stream_data,
+      doc=None):
     '''
     process the streaming item: applying exact match for each of the query
     entity
@@ -199,7 +189,10 @@ class WikiWeightMatch():
       print 'Invalid query: [%s].\nNO qid found.' %query
       return
 
-    new_stream_data = self.sanitize(stream_data)
+    ## doc is the sanitized stream_data, when it has been tokenized already
+    new_stream_data = doc
+    if new_stream_data is None:
+      new_stream_data = self.sanitize(stream_data)
     query = self._query_hash[qid]
 
     try:
@@ -241,35 +234,69 @@ class WikiWeightMatch():
       print 'no ret_item found'
       return
 
-    ret_item_list = self._exact_match_db.lrange(RedisDB.ret_item_list, 0, num)
-    ret_items = []
-    for ret_id in ret_item_list:
-      ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data']
-      the_ret_item = self._exact_match_db.hmget(ret_id, ret_item_keys)
-
-      ret_item = {}
-      ret_item['id'] = the_ret_item[0]
-      ret_item['query'] = the_ret_item[1]
-      ret_item['file'] = the_ret_item[2]
-      ret_item['stream_id'] = the_ret_item[3]
-      ret_item['stream_data'] = the_ret_item[4]
-
+    vocab = tokens.Vocabulary(self._exact_match_db)
+    ret_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data',
+        'tokens']
+    for ret_id, ret_item in iter_ret_items(self._exact_match_db,
+        RedisDB.ret_item_list, ret_item_keys):
       ## process data
       self.process_stream_item(ret_item['query'], ret_item['file'],
-          ret_item['stream_id'], ret_item['stream_data'])
+          ret_item['stream_id'], ret_item['stream_data'],
+          vocab.doc_text(ret_item))
+
+  def parse_index(self, index):
+    '''
+    Score all the documents of the index, the related entities of a query are
+    counted from the postings instead of being searched in every document
+    '''
+    query_docs = {}
+    for num in range(len(index)):
+      query_docs.setdefault(index.doc(num)['query'], set()).add(num)
+
+    scores = {}
+    for org_query, docs in query_docs.iteritems():
+      if org_query not in self._wiki_ent_hash:
+        print 'I can not find the query [%s] in self._wiki_ent_hash' %org_query
+        continue
+      for ent_id in self._wiki_ent_hash[org_query]:
+        if not ent_id in self._weight_hash:
+          continue
+        ent = self._wiki_ent_hash[org_query][ent_id]
+        weight = self._weight_hash[ent_id].weight
+        for num, count in index.counts(ent, docs).iteritems():
+          scores[num] = scores.get(num, 0) + \
+              WIKI_ENT_MATCH_SCORE * count * weight
+
+    for num in range(len(index)):
+      doc = index.doc(num)
+      org_query = doc['query']
+      if org_query not in self._query2id_hash:
+        print 'Invalid query: [%s].\nNO qid found.' %org_query
+        continue
+
+      ## verbose output
+      print 'Match: %s - %s - %s - %6.3f' %(doc['id'], org_query,
+          doc['stream_id'], scores.get(num, 0))
 
 def main():
   import argparse
   parser = argparse.ArgumentParser(usage=__doc__)
   parser.add_argument('query')
   parser.add_argument('weight_list')
+  parser.add_argument('--index', default=None,
+      help='positional index of the documents, built if missing or stale')
   args = parser.parse_args()
 
   match = WikiWeightMatch()
   match.parse_query(args.query)
   match.load_weight_list(args.weight_list)
   match.load_wiki_ent()
-  match.parse_data()
+  if args.index:
+    index = phrase_index.load_or_build(args.index, match._exact_match_db,
+        RedisDB.ret_item_list)
+    match.parse_index(index)
+  else:
+    match.parse_data()
 
 if __name__ == '__main__':
   try:
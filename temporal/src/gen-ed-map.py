@@ -5,7 +5,7 @@ Generate the E-D and D-E map between documents and related entities, which
 serves as cache (index) to accelerate the processing of processing on tuning
 the performance
 
-gen-ed-map.py <query_id>
+gen-ed-map.py [<query_id> ...] [--all] [--num-workers N]
 '''
 
 import re
@@ -19,8 +19,19 @@ import datetime
 from collections import defaultdict
 from cStringIO import StringIO
 
+try:
+  import edmap
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+import edmap
+import edbuild
+import normalize
+import tokens
 
 QUERY_ENT_MATCH_SCORE = 100
 WIKI_ENT_MATCH_SCORE = 1
@@ -34,12 +45,6 @@ class WikiMatch():
   Apply exact matching
   '''
 
-  _doc_item_list = []
-
-  _ent2id_hash = {}   # related entity to ID hash
-  _e2d_hash = {}
-  _d2e_hash = {}
-
   _exact_match_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.oair_doc_train_db)
       #db=RedisDB.oair_doc_test_db)
@@ -57,71 +62,19 @@ class WikiMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    ## remove leading space
-    space_regex = re.compile ( '^\s' )
-    query = space_regex.sub( '', query)
-
-    ## remove trailing space
-    space_regex = re.compile ( '\s$' )
-    query = space_regex.sub( '', query)
-
-    return query.lower()
+    return normalize.format_query(query, strip=True)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
-
-  def build_map(self, did, doc):
-    '''
-    Calculate the score of a document w.r.t. the given query
-    '''
-    self._d2e_hash[did] = {}
-
-    for ent in self._ent2id_hash:
-      eid = self._ent2id_hash[ent]
-      ent_str = ' %s ' % self.format_query(ent)
-
-      if re.search(ent_str, doc, re.I | re.M):
-        ## change to count match once to count the total number of matches
-        match_list = re.findall(ent_str, doc, re.I | re.M)
-        score = len(match_list)
-
-        # update the map
-        if eid not in self._e2d_hash:
-          self._e2d_hash[eid] = {}
-        self._e2d_hash[eid][did] = score
-        self._d2e_hash[did][eid] = score
+    return normalize.sanitize(str)
 
-  def process_data(self, query_id):
+  def collect_entities(self, query_id):
     '''
-    process the streaming item one by one
+    number the related entities of all the revisions of a query
     '''
-
-    # first, get the current query
-    org_query = self._rel_ent_dist_db.hget(RedisDB.query_ent_hash, query_id)
-    query = self.format_query(org_query)
+    ent2id_hash = {}
 
     hash_key = 'query-rel-ent-%s' % query_id
     dt_list = self._rel_ent_dist_db.hkeys(hash_key)
@@ -134,98 +87,87 @@ class WikiMatch():
       rel_ent_list = rel_ent_str.split('=')
 
       for ent in rel_ent_list:
-        if ent in self._ent2id_hash:
+        if ent in ent2id_hash:
           continue
         else:
-          id = len(self._ent2id_hash.keys())
-          self._ent2id_hash[ent] = id
+          id = len(ent2id_hash.keys())
+          ent2id_hash[ent] = id
+
+    return ent2id_hash
+
+  def process_data(self, query_id_list, num_workers=None):
+    '''
+    build the maps of the queries in one pass over the documents
+    '''
+    ent2id_hashes = {}
+    for query_id in query_id_list:
+      ent2id_hashes[query_id] = self.collect_entities(query_id)
+      print 'Query %s: %d entities in total' %(query_id,
+          len(ent2id_hashes[query_id]))
 
     # now we collected all the related entities, each of which has a unique ID
     # for each document, we will then build the map between it and each of the
-    # related entities
+    # related entities of every query
+    builder = edbuild.MapBuilder(ent2id_hashes)
+    query_id_set = frozenset(query_id_list)
+    builder.build(((doc_item['stream_id'], doc_item['stream_data'],
+        query_id_set) for doc_item in self.iter_documents()), num_workers)
 
-    print '%d entities in total' % len(self._ent2id_hash.keys())
-    so_far = 0
-    num = len(self._doc_item_list)
-    for doc_item in self._doc_item_list:
-      stream_id = doc_item['stream_id']
-      stream_data = doc_item['stream_data']
-      self.build_map(stream_id, stream_data)
+    print 'Saving to DB'
 
-      so_far += 1
-      #print '%d / %d' %(so_far, num)
-      #if so_far > 100:
-        #break
+    for query_id in query_id_list:
+      # save the entity list
+      key = 'ent-list-%s' % query_id
+      for ent, eid in ent2id_hashes[query_id].iteritems():
+        self._edmap_db.hset(key, eid, ent)
 
-    print 'Saving to DB'
+      # save the E2D and D2E maps, packed
+      edmap.save_maps(self._edmap_db, query_id, builder.e2d_hashes[query_id],
+          builder.d2e_hashes[query_id])
 
-    # save the entity list
-    key = 'ent-list-%s' % query_id
-    for ent in self._ent2id_hash:
-      eid = self._ent2id_hash[ent]
-      self._edmap_db.hset(key, eid, ent)
-
-    # save the E2D map
-    key = 'e2d-map-%s' % query_id
-    for eid in self._e2d_hash:
-      str = json.dumps(self._e2d_hash[eid])
-      self._edmap_db.hset(key, eid, str)
-
-    # save the D2E map
-    key = 'd2e-map-%s' % query_id
-    for did in self._d2e_hash:
-      str = json.dumps(self._d2e_hash[did])
-      self._edmap_db.hset(key, did, str)
-
-  def load_documents(self, query_id):
+    # the cached maps of the servers are stale now
+    edmap.bump_version(self._edmap_db)
+
+  def iter_documents(self):
     '''
-    Load all the documents which has exact match with the query entity
+    Yield all the documents which has exact match with the query entity, they
+    are read from the DB in batches while the maps are being built
     '''
     num = self._exact_match_db.llen(RedisDB.ret_item_list)
     if 0 == num:
       print 'no doc_item found'
       return
 
-    # first, get the current query
-    query = self._rel_ent_dist_db.hget(RedisDB.query_ent_hash, query_id)
-
-    print 'Loading %d documents for query: %s' %(num, query)
-
-    so_far = 0
-
-    doc_item_list = self._exact_match_db.lrange(RedisDB.ret_item_list, 0, num)
-    for ret_id in doc_item_list:
+    print 'Loading %d documents' % num
 
-      # for debug purpose only
-      so_far += 1
-      #if so_far > 10000:
-        #break
+    vocab = tokens.Vocabulary(self._exact_match_db)
+    doc_item_keys = ['id', 'query', 'file', 'stream_id']
+    for ret_id, doc_item, text in vocab.iter_doc_texts(RedisDB.ret_item_list,
+        doc_item_keys):
+      doc_item['stream_data'] = text
 
-      doc_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data']
-      db_item = self._exact_match_db.hmget(ret_id, doc_item_keys)
-
-      doc_item = {}
-      doc_item['id'] = db_item[0]
-      doc_item['query'] = db_item[1]
-      doc_item['file'] = db_item[2]
-      doc_item['stream_id'] = db_item[3]
-      doc_item['stream_data'] = self.sanitize(db_item[4])
-
-      # for one process, we only handle the documents for the current query only
-      #if doc_item['query'] != query:
-        #continue
-
-      self._doc_item_list.append(doc_item)
+      # every query is matched against all the documents
+      yield doc_item
 
 def main():
   import argparse
   parser = argparse.ArgumentParser(usage=__doc__)
-  parser.add_argument('query_id')
+  parser.add_argument('query_id', nargs='*')
+  parser.add_argument('--all', default=False, action='store_true',
+      help='build the maps of all the queries')
+  parser.add_argument('--num-workers', type=int, default=None,
+      dest='num_workers',
+      help='number of processes matching the documents, default: number of cores')
   args = parser.parse_args()
 
+  query_id_list = args.query_id
+  if args.all:
+    query_id_list = [str(query_id) for query_id in range(0, 29, 1)]
+  if not query_id_list:
+    parser.error('no query_id given')
+
   match = WikiMatch()
-  match.load_documents(args.query_id)
-  match.process_data(args.query_id)
+  match.process_data(query_id_list, args.num_workers)
 
 if __name__ == '__main__':
   try:
@@ -9,6 +9,7 @@ propagation-network.py <query_id>
 from __future__ import division
 
 import os
+import sys
 import csv
 import gzip
 import json
@@ -17,8 +18,18 @@ import datetime
 import operator
 from collections import defaultdict
 
+try:
+  import edmap
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+import edmap
+from confusion import score_confusion_matrix
+import topics
 
 def getMedian(numericValues):
     '''
@@ -102,95 +113,6 @@ def performance_metrics (CM, debug=False):
             CM[cutoff]['FP'], CM[cutoff]['FN'])
     return Scores
 
-def score_confusion_matrix (scored_doc_list, annotation, debug=False):
-    '''
-    This function generates the confusion matrix (number of true/false positives
-    and true/false negatives.
-
-    path_to_run_file: str, a filesystem link to the run submission
-    annotation: dict, containing the annotation data
-    unannotated_is_TN: boolean, true to count unannotated as negatives
-    include_training: boolean, true to include training documents
-
-    returns a confusion matrix dictionary for each urlname
-    '''
-    # default: false
-    unannotated_is_TN = False
-
-    END_OF_2012 = 1325375999
-
-    ## Create a dictionary containing the confusion matrix (CM)
-    cutoffs = range(0, 100, 1)
-    CM = dict()
-
-    ## count the total number of assertions per entity
-    num_assertions = {'total': 0,
-                      'in_TTR': 0,
-                      'in_ETR': 0,
-                      'in_annotation_set': 0}
-    for cutoff in cutoffs:
-        CM[cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
-
-    ## Iterate through every row of the run
-    for did in scored_doc_list:
-        score = scored_doc_list[did]
-        timestamp = int(did.split('-')[0])
-
-        ## keep track of total number of assertions per entity
-        num_assertions['total'] += 1
-        if timestamp <= END_OF_2012:
-            num_assertions['in_TTR'] += 1
-        else:
-            num_assertions['in_ETR'] += 1
-
-        in_annotation_set = did in annotation
-
-        if in_annotation_set:
-            num_assertions['in_annotation_set'] += 1
-
-        ## In the annotation set and relevant
-        if in_annotation_set and annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## If above the cutoff: true-positive
-                    CM[cutoff]['TP'] += 1
-
-        ## In the annotation set and non-relevant
-        elif in_annotation_set and not annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-        ## Not in the annotation set so its a negative (if flag is true)
-        elif unannotated_is_TN:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-
-    ## Correct FN for things in the annotation set that are NOT in the run
-    ## First, calculate number of true things in the annotation set
-    annotation_positives = 0
-    for did in annotation:
-        annotation_positives += annotation[did]
-
-    for cutoff in CM:
-        ## Then subtract the number of TP at each cutoffs
-        ## (since FN+TP==True things in annotation set)
-        CM[cutoff]['FN'] = annotation_positives - CM[cutoff]['TP']
-
-    if debug:
-        print 'showing assertion counts:'
-        print json.dumps(num_assertions, indent=4, sort_keys=True)
-
-    return CM
-
 class PropagationNetwork():
   def __init__(self):
     self._train_edmap_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
@@ -208,6 +130,22 @@ class PropagationNetwork():
     self._ret_list = {}
     self._cutoff_list = {}
 
+    # the E-D maps of each query, as entity x document matrices
+    self._train_maps = {}
+    self._test_maps = {}
+
+  def load_maps(self, query_id):
+    '''
+    Load the E-D maps of the training and testing data of a query as sparse
+    matrices, once
+    '''
+    if query_id not in self._train_maps:
+      self._train_maps[query_id] = edmap.EDMatrix.load(self._train_edmap_db,
+          query_id)
+      self._test_maps[query_id] = edmap.EDMatrix.load(self._test_edmap_db,
+          query_id)
+    return self._train_maps[query_id], self._test_maps[query_id]
+
   def estimate_score(self, query_id):
     '''
     Generate the optimized related entity subset using greedy algorithm
@@ -223,78 +161,30 @@ class PropagationNetwork():
     train_qrels = json.loads(str)
 
     # get all the available entity candidates
-    key = 'e2d-map-%s' % query_id
-    all_eid = self._train_edmap_db.hkeys(key)
-    all_eid.sort(key=lambda x: int(x))
-
-    key = 'ent-list-%s' % query_id
-    db_item = self._train_edmap_db.hmget(key, all_eid)
-
-    ent_hash = {}
-    for idx, ent in enumerate(db_item):
-      eid = all_eid[idx]
-      ent_hash[eid] = ent
+    train_map, test_map = self.load_maps(query_id)
+    all_eid = list(train_map.eids)
 
     # get the optimal cutoff for the training data
     (cutoff, f1_score) = self.max_perf(query_id, all_eid, train_qrels)
 
-    # get a list of relevant documents with their scores
-    scored_train_doc_list = self.get_doc_list(query_id, ent_hash.keys())
-    rel_doc_list = {}
-    for did in scored_train_doc_list:
-      if did not in train_qrels:
-        continue
-      if not train_qrels[did]:
-        continue
-
-      # now what we have are relevant documents
-      score = scored_train_doc_list[did]
-      rel_doc_list[did] = score
-
-    # use the relevant document list to get d2e map
-    key = 'd2e-map-%s' % query_id
-    d2e_list = self._train_edmap_db.hmget(key, rel_doc_list.keys())
-
-    # generate the scored entity list
-    scored_ent_list = {}
-    for d2e_str in d2e_list:
-      d2e = json.loads(d2e_str)
-      for eid in d2e:
-        score = d2e[eid]
-        if eid not in scored_ent_list:
-          scored_ent_list[eid] = 0
-        scored_ent_list[eid] += score
-
-    # use the scored entity list to score documents in the testing data
-    key = 'e2d-map-%s' % query_id
-    eid_list = scored_ent_list.keys()
-    eid_list.sort(key=lambda x: int(x))
-    e2d_list = self._test_edmap_db.hmget(key, eid_list)
-
-    # generate the scored document list
-    scored_test_doc_list = {}
-    #for e2d_str in e2d_list:
-    for idx, e2d_str in enumerate(e2d_list):
-      if None == e2d_str:
-        continue
-      e2d = json.loads(e2d_str)
-      eid = eid_list[idx]
-      ent_score = scored_ent_list[eid]
-      for did in e2d:
-        score = e2d[did] * ent_score
-
-        if did not in scored_test_doc_list:
-          scored_test_doc_list[did] = 0
-        scored_test_doc_list[did] += score
-
-    # apply normalization to the score to [0, 1]
-    # get the maximal score: http://stackoverflow.com/a/268285
-    max_score = max(scored_test_doc_list.iteritems(), key=operator.itemgetter(1))[1]
-    max_score = max_score / 1000
-    for did in scored_test_doc_list:
-      score = scored_test_doc_list[did]
-      score = round(score / max_score)
-      scored_test_doc_list[did] = score
+    # the relevant documents, every document of the map has at least one of
+    # the entities
+    rel_doc_vector = train_map.doc_vector(
+        [did for did in train_qrels if train_qrels[did]])
+
+    # use the relevant documents to score the entities (d2e)
+    ent_scores = train_map.ent_scores(rel_doc_vector)
+    scored_ent_list = train_map.ent_dict(ent_scores,
+        train_map.ent_presence(rel_doc_vector))
+
+    # use the scored entity list to score documents in the testing data (e2d)
+    ent_vector = test_map.entity_vector(scored_ent_list)
+    doc_scores = test_map.doc_scores(ent_vector)
+    present = test_map.doc_presence(ent_vector)
+
+    # apply normalization to the score to [0, 1000]
+    doc_scores[present] = edmap.normalize_scores(doc_scores[present])
+    scored_test_doc_list = test_map.doc_dict(doc_scores, present)
 
     self._ret_list[query_id] = scored_test_doc_list
     #self._cutoff_list[query_id] = cutoff
@@ -343,21 +233,10 @@ class PropagationNetwork():
     '''
     Get the scored doc list for a given related entity list from training data
     '''
-    key = 'e2d-map-%s' % query_id
-    eid_list.sort(key=lambda x: int(x))
-    e2d_list = self._train_edmap_db.hmget(key, eid_list)
-
-    # generate the document list
-    scored_doc_list = {}
-    for e2d_str in e2d_list:
-      e2d = json.loads(e2d_str)
-      for did in e2d:
-        score = e2d[did]
-        if did not in scored_doc_list:
-          scored_doc_list[did] = 0
-        scored_doc_list[did] += score
-
-    return scored_doc_list
+    train_map = self.load_maps(query_id)[0]
+    ent_vector = train_map.entity_vector(eid_list)
+    return train_map.doc_dict(train_map.doc_scores(ent_vector),
+        train_map.doc_presence(ent_vector))
 
   def max_score(self, scores, measure):
     '''
@@ -391,20 +270,21 @@ def main():
   parser.add_argument(
     '--debug', default=False, action='store_true', dest='debug',
     help='print out debugging diagnostics')
+  parser.add_argument('--num-workers', type=int, default=None,
+    dest='num_workers',
+    help='number of queries scored in parallel, default: number of cores')
   args = parser.parse_args()
 
   pn = PropagationNetwork()
 
-  # run over all the queries
-  query_id_list = range(0, 29, 1)
+  # run over all the queries, spread across the workers
+  query_id_list = [str(query_id) for query_id in range(0, 29, 1)]
   score_list = []
 
-  for query_id in query_id_list:
-    score = pn.estimate_score(str(query_id))
-    print 'Query %d - %.3f' %(query_id, score)
+  for query_id, score in topics.tune_topics(pn, pn.estimate_score,
+      query_id_list, args.num_workers):
+    print 'Query %s - %.3f' %(query_id, score)
     score_list.append(score)
-    #if len(score_list) > 5:
-      #break
 
   if len(score_list):
     avg = reduce(lambda x, y: x+y, score_list) / len(score_list)
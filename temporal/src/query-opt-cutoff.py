@@ -19,6 +19,7 @@ TEST_RET_DIR = 'ret/test/'
 g_cutoff_step = 1
 
 import os
+import sys
 import csv
 import gzip
 import json
@@ -26,8 +27,16 @@ import argparse
 import datetime
 from collections import defaultdict
 
+try:
+  from confusion import confusion_matrix
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+from confusion import confusion_matrix
 
 REL_ENT_DIST_DB = redis.Redis(host=RedisDB.host, port=RedisDB.port,
     db=RedisDB.rel_ent_dist_db)
@@ -135,17 +144,17 @@ def score_confusion_matrix (path_to_run_file, annotation, debug):
     else:
         run_file = open(path_to_run_file, 'r')
 
-    ## Create a dictionary containing the confusion matrix (CM)
     cutoffs = range(99, 200, 1)
-    CM = dict()
 
     ## count the total number of assertions per entity
     num_assertions = {}
 
     query = ''
 
-    for cutoff in cutoffs:
-        CM[cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
+    ## the scores of the relevant, non-relevant and unannotated documents
+    rel_scores = []
+    non_scores = []
+    unjudged_scores = []
 
     ## Iterate through every row of the run
     for onerow in run_file:
@@ -178,31 +187,12 @@ def score_confusion_matrix (path_to_run_file, annotation, debug):
         if in_annotation_set:
             num_assertions[urlname]['in_annotation_set'] += 1
 
-        ## In the annotation set and relevant
         if in_annotation_set and annotation[(stream_id, urlname)]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## If above the cutoff: true-positive
-                    CM[cutoff]['TP'] += 1
-
-        ## In the annotation set and non-relevant
-        elif in_annotation_set and not annotation[(stream_id, urlname)]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-        ## Not in the annotation set so its a negative (if flag is true)
-        elif unannotated_is_TN:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
+            rel_scores.append(score)
+        elif in_annotation_set:
+            non_scores.append(score)
+        else:
+            unjudged_scores.append(score)
 
     ## Correct FN for things in the annotation set that are NOT in the run
     ## First, calculate number of true things in the annotation set
@@ -212,10 +202,11 @@ def score_confusion_matrix (path_to_run_file, annotation, debug):
         urlname = key[1]
         annotation_positives[urlname] += annotation[(stream_id,urlname)]
 
-    for cutoff in CM:
-        ## Then subtract the number of TP at each cutoffs
-        ## (since FN+TP==True things in annotation set)
-        CM[cutoff]['FN'] = annotation_positives[query] - CM[cutoff]['TP']
+    ## Not in the annotation set so its a negative (if flag is true)
+    if not unannotated_is_TN:
+        unjudged_scores = None
+    CM = confusion_matrix(rel_scores, non_scores, annotation_positives[query],
+        cutoffs, unjudged_scores)
 
     if debug:
         print 'showing assertion counts:'
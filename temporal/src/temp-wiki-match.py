@@ -24,8 +24,17 @@ import datetime
 from collections import defaultdict
 from cStringIO import StringIO
 
+try:
+  import normalize
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+import normalize
+import tokens
 
 QUERY_ENT_MATCH_SCORE = 100
 WIKI_ENT_MATCH_SCORE = 1
@@ -52,33 +61,13 @@ class WikiMatch():
     '''
     format the original query
     '''
-    # remove parentheses
-    parentheses_regex = re.compile( '\(.*\)' )
-    query = parentheses_regex.sub( '', query)
-
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    query = non_word_regex.sub( ' ', query)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    query = space_regex.sub( ' ', query)
-
-    return query.lower()
+    return normalize.format_query(query)
 
   def sanitize(self, str):
     '''
     sanitize the streaming item
     '''
-    ## replace non word character to space
-    non_word_regex = re.compile( '(\W+|\_+)' )
-    str = non_word_regex.sub( ' ', str)
-
-    ## compress multiple spaces
-    space_regex = re.compile ( '\s+' )
-    str = space_regex.sub( ' ', str)
-
-    return str.lower()
+    return normalize.sanitize(str)
 
   def calc_score(self, query, doc, rel_ent_list):
     '''
@@ -168,22 +157,15 @@ class WikiMatch():
 
     print 'Loading documents for query: %s' % query
 
-    doc_item_list = self._exact_match_db.lrange(RedisDB.ret_item_list, 0, num)
-    for ret_id in doc_item_list:
-      doc_item_keys = ['id', 'query', 'file', 'stream_id', 'stream_data']
-      db_item = self._exact_match_db.hmget(ret_id, doc_item_keys)
-
-      doc_item = {}
-      doc_item['id'] = db_item[0]
-      doc_item['query'] = db_item[1]
-      doc_item['file'] = db_item[2]
-      doc_item['stream_id'] = db_item[3]
-      doc_item['stream_data'] = self.sanitize(db_item[4])
-
+    vocab = tokens.Vocabulary(self._exact_match_db)
+    doc_item_keys = ['id', 'query', 'file', 'stream_id']
+    for ret_id, doc_item, text in vocab.iter_doc_texts(RedisDB.ret_item_list,
+        doc_item_keys):
       # for one process, we only handle the documents for the current query only
       if doc_item['query'] != query:
         continue
 
+      doc_item['stream_data'] = text
       self._doc_item_list.append(doc_item)
 
 def main():
@@ -9,6 +9,7 @@ train-test-opt-ent.py
 from __future__ import division
 
 import os
+import sys
 import csv
 import gzip
 import json
@@ -17,8 +18,18 @@ import datetime
 import operator
 from collections import defaultdict
 
+try:
+  import edmap
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+import edmap
+from confusion import score_confusion_matrix
+import topics
 
 def getMedian(numericValues):
     '''
@@ -102,95 +113,6 @@ def performance_metrics (CM, debug=False):
             CM[cutoff]['FP'], CM[cutoff]['FN'])
     return Scores
 
-def score_confusion_matrix (scored_doc_list, annotation, debug=False):
-    '''
-    This function generates the confusion matrix (number of true/false positives
-    and true/false negatives.
-
-    path_to_run_file: str, a filesystem link to the run submission
-    annotation: dict, containing the annotation data
-    unannotated_is_TN: boolean, true to count unannotated as negatives
-    include_training: boolean, true to include training documents
-
-    returns a confusion matrix dictionary for each urlname
-    '''
-    # default: false
-    unannotated_is_TN = False
-
-    END_OF_2012 = 1325375999
-
-    ## Create a dictionary containing the confusion matrix (CM)
-    cutoffs = range(0, 100, 1)
-    CM = dict()
-
-    ## count the total number of assertions per entity
-    num_assertions = {'total': 0,
-                      'in_TTR': 0,
-                      'in_ETR': 0,
-                      'in_annotation_set': 0}
-    for cutoff in cutoffs:
-        CM[cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
-
-    ## Iterate through every row of the run
-    for did in scored_doc_list:
-        score = scored_doc_list[did]
-        timestamp = int(did.split('-')[0])
-
-        ## keep track of total number of assertions per entity
-        num_assertions['total'] += 1
-        if timestamp <= END_OF_2012:
-            num_assertions['in_TTR'] += 1
-        else:
-            num_assertions['in_ETR'] += 1
-
-        in_annotation_set = did in annotation
-
-        if in_annotation_set:
-            num_assertions['in_annotation_set'] += 1
-
-        ## In the annotation set and relevant
-        if in_annotation_set and annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## If above the cutoff: true-positive
-                    CM[cutoff]['TP'] += 1
-
-        ## In the annotation set and non-relevant
-        elif in_annotation_set and not annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-        ## Not in the annotation set so its a negative (if flag is true)
-        elif unannotated_is_TN:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-
-    ## Correct FN for things in the annotation set that are NOT in the run
-    ## First, calculate number of true things in the annotation set
-    annotation_positives = 0
-    for did in annotation:
-        annotation_positives += annotation[did]
-
-    for cutoff in CM:
-        ## Then subtract the number of TP at each cutoffs
-        ## (since FN+TP==True things in annotation set)
-        CM[cutoff]['FN'] = annotation_positives - CM[cutoff]['TP']
-
-    if debug:
-        print 'showing assertion counts:'
-        print json.dumps(num_assertions, indent=4, sort_keys=True)
-
-    return CM
-
 class TuneQueryOptEnt():
   def __init__(self):
     self._train_edmap_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
@@ -198,6 +120,7 @@ class TuneQueryOptEnt():
 
     self._test_edmap_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.test_edmap_db)
+    self._test_edmap_reader = edmap.MapReader(self._test_edmap_db)
 
     self._qrels_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.qrels_db)
@@ -266,16 +189,14 @@ class TuneQueryOptEnt():
     '''
     Get the scored doc list for a given related entity list
     '''
-    key = 'e2d-map-%s' % query_id
     eid_list.sort(key=lambda x: int(x))
-    e2d_list = self._test_edmap_db.hmget(key, eid_list)
+    e2d_list = self._test_edmap_reader.e2d_list(query_id, eid_list)
 
     # generate the document list
     scored_doc_list = {}
-    for e2d_str in e2d_list:
-      if None == e2d_str:
+    for e2d in e2d_list:
+      if None == e2d:
         continue
-      e2d = json.loads(e2d_str)
       for did in e2d:
         score = e2d[did]
         if did not in scored_doc_list:
@@ -309,15 +230,18 @@ def main():
   parser.add_argument(
     '--debug', default=False, action='store_true', dest='debug',
     help='print out debugging diagnostics')
+  parser.add_argument('--num-workers', type=int, default=None,
+    dest='num_workers',
+    help='number of queries tuned in parallel, default: number of cores')
   args = parser.parse_args()
 
-  # run over all the queries
-  query_id_list = range(0, 29, 1)
+  # run over all the queries, spread across the workers
+  query_id_list = [str(query_id) for query_id in range(0, 29, 1)]
 
   tuner = TuneQueryOptEnt()
-  for query_id in query_id_list:
-    print 'Query %d' % query_id
-    tuner.greedy_tune(str(query_id))
+  for query_id, score in topics.tune_topics(tuner, tuner.greedy_tune,
+      query_id_list, args.num_workers):
+    print 'Query %s' % query_id
 
   #tuner.save_run_file('runs/tune/c-opt_greedy')
   tuner.save_run_file('runs/tune/rc-opt_greedy')
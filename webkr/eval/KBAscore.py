@@ -21,6 +21,7 @@ python KBAscore.py --annotation after.txt --run-dir submissions
 END_OF_2012 = 1325375999
 
 import os
+import sys
 import csv
 import gzip
 import json
@@ -31,6 +32,14 @@ import argparse
 plt = None
 from collections import defaultdict
 
+try:
+    from confusion import confusion_matrix
+except ImportError:
+    ## not on the PYTHONPATH, the shared modules are in ../../src
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, os.pardir, 'src'))
+    from confusion import confusion_matrix
+
 def getMedian(numericValues):
     '''
     Returns the median from a list
@@ -279,9 +288,13 @@ def score_confusion_matrix (path_to_run_file, annotation, cutoff_step, unannotat
     else:
         run_file = open(path_to_run_file, 'r')
 
-    ## Create a dictionary containing the confusion matrix (CM)
     cutoffs = range(0, 999, cutoff_step)
-    CM = dict()
+
+    ## the scores of the relevant, non-relevant and unannotated documents of
+    ## each urlname
+    rel_scores = dict()
+    non_scores = dict()
+    unjudged_scores = dict()
 
     ## count the total number of assertions per entity
     num_assertions = {}
@@ -311,11 +324,11 @@ def score_confusion_matrix (path_to_run_file, annotation, cutoff_step, unannotat
         else:
             num_assertions[urlname]['in_ETR'] += 1
 
-        ## If the entity has been seen yet create a confusion matrix for it
-        if not urlname in CM:
-            CM[urlname] = dict()
-            for cutoff in cutoffs:
-                CM[urlname][cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
+        ## If the entity has not been seen yet create its score lists
+        if not urlname in rel_scores:
+            rel_scores[urlname] = []
+            non_scores[urlname] = []
+            unjudged_scores[urlname] = []
 
         if (not include_training) and (timestamp <= END_OF_2012):
             continue
@@ -326,31 +339,12 @@ def score_confusion_matrix (path_to_run_file, annotation, cutoff_step, unannotat
             num_assertions[urlname]['in_annotation_set'] += 1
 
 
-        ## In the annotation set and relevant
         if in_annotation_set and annotation[(stream_id, urlname)]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## If above the cutoff: true-positive
-                    CM[urlname][cutoff]['TP'] += 1
-
-        ## In the annotation set and non-relevant
-        elif in_annotation_set and not annotation[(stream_id, urlname)]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[urlname][cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[urlname][cutoff]['TN'] += 1
-        ## Not in the annotation set so its a negative (if flag is true)
-        elif unannotated_is_TN:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[urlname][cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[urlname][cutoff]['TN'] += 1
+            rel_scores[urlname].append(score)
+        elif in_annotation_set:
+            non_scores[urlname].append(score)
+        else:
+            unjudged_scores[urlname].append(score)
 
     ## Correct FN for things in the annotation set that are NOT in the run
     ## First, calculate number of true things in the annotation set
@@ -365,11 +359,15 @@ def score_confusion_matrix (path_to_run_file, annotation, cutoff_step, unannotat
         urlname = key[1]
         annotation_positives[urlname] += annotation[(stream_id,urlname)]
 
-    for urlname in CM:
-        for cutoff in CM[urlname]:
-            ## Then subtract the number of TP at each cutoffs
-            ## (since FN+TP==True things in annotation set)
-            CM[urlname][cutoff]['FN'] = annotation_positives[urlname] - CM[urlname][cutoff]['TP']
+    CM = dict()
+    for urlname in rel_scores:
+        ## Not in the annotation set so its a negative (if flag is true)
+        unjudged = None
+        if unannotated_is_TN:
+            unjudged = unjudged_scores[urlname]
+        CM[urlname] = confusion_matrix(rel_scores[urlname],
+            non_scores[urlname], annotation_positives[urlname], cutoffs,
+            unjudged)
 
     if debug:
         print 'showing assertion counts:'
@@ -20,8 +20,16 @@ import datetime
 # see: https://github.com/dcramer/py-wikimarkup
 from wikimarkup import parse, registerInternalLinkHook
 
+try:
+  import normalize
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+import normalize
 
 ## the current query
 g_cur_idx = 0
@@ -166,19 +174,7 @@ def format_query(query):
   '''
   format the original query
   '''
-  # remove parentheses
-  parentheses_regex = re.compile( '\(.*\)' )
-  query = parentheses_regex.sub( '', query)
-
-  ## replace non word character to space
-  non_word_regex = re.compile( '(\W+|\_+)' )
-  query = non_word_regex.sub( ' ', query)
-
-  ## compress multiple spaces
-  space_regex = re.compile ( '\s+' )
-  query = space_regex.sub( ' ', query)
-
-  return query.lower()
+  return normalize.format_query(query)
 
 def load_data():
   '''
@@ -216,15 +212,7 @@ def sanitize(str):
   '''
   sanitize the streaming item
   '''
-  ## replace non word character to space
-  non_word_regex = re.compile( '(\W+|\_+)' )
-  str = non_word_regex.sub( ' ', str)
-
-  ## compress multiple spaces
-  space_regex = re.compile ( '\s+' )
-  str = space_regex.sub( ' ', str)
-
-  return str.lower()
+  return normalize.sanitize(str)
 
 def wikipediaLinkHook(parser_env, namespace, body):
   # namespace is going to be 'Wikipedia'
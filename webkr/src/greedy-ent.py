@@ -10,6 +10,7 @@ greedy-ent.py <query_id>
 from __future__ import division
 
 import os
+import sys
 import csv
 import gzip
 import json
@@ -18,8 +19,19 @@ import datetime
 import operator
 from collections import defaultdict
 
+try:
+  import edmap
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+import edmap
+from greedy import GreedyEvaluator
+from confusion import score_confusion_matrix
+import topics
 
 def getMedian(numericValues):
     '''
@@ -103,96 +115,6 @@ def performance_metrics (CM, debug=False):
             CM[cutoff]['FP'], CM[cutoff]['FN'])
     return Scores
 
-def score_confusion_matrix (scored_doc_list, annotation, debug=False):
-    '''
-    This function generates the confusion matrix (number of true/false positives
-    and true/false negatives.
-
-    path_to_run_file: str, a filesystem link to the run submission
-    annotation: dict, containing the annotation data
-    unannotated_is_TN: boolean, true to count unannotated as negatives
-    include_training: boolean, true to include training documents
-
-    returns a confusion matrix dictionary for each urlname
-    '''
-    # default: false
-    unannotated_is_TN = False
-
-    END_OF_2012 = 1325375999
-
-    ## Create a dictionary containing the confusion matrix (CM)
-    ## cutoff step 1, from 0 to 99
-    cutoffs = range(0, 100, 1)
-    CM = dict()
-
-    ## count the total number of assertions per entity
-    num_assertions = {'total': 0,
-                      'in_TTR': 0,
-                      'in_ETR': 0,
-                      'in_annotation_set': 0}
-    for cutoff in cutoffs:
-        CM[cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
-
-    ## Iterate through every row of the run
-    for did in scored_doc_list:
-        score = scored_doc_list[did]
-        timestamp = int(did.split('-')[0])
-
-        ## keep track of total number of assertions per entity
-        num_assertions['total'] += 1
-        if timestamp <= END_OF_2012:
-            num_assertions['in_TTR'] += 1
-        else:
-            num_assertions['in_ETR'] += 1
-
-        in_annotation_set = did in annotation
-
-        if in_annotation_set:
-            num_assertions['in_annotation_set'] += 1
-
-        ## In the annotation set and relevant
-        if in_annotation_set and annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## If above the cutoff: true-positive
-                    CM[cutoff]['TP'] += 1
-
-        ## In the annotation set and non-relevant
-        elif in_annotation_set and not annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-        ## Not in the annotation set so its a negative (if flag is true)
-        elif unannotated_is_TN:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-
-    ## Correct FN for things in the annotation set that are NOT in the run
-    ## First, calculate number of true things in the annotation set
-    annotation_positives = 0
-    for did in annotation:
-        annotation_positives += annotation[did]
-
-    for cutoff in CM:
-        ## Then subtract the number of TP at each cutoffs
-        ## (since FN+TP==True things in annotation set)
-        CM[cutoff]['FN'] = annotation_positives - CM[cutoff]['TP']
-
-    if debug:
-        print 'showing assertion counts:'
-        print json.dumps(num_assertions, indent=4, sort_keys=True)
-
-    return CM
-
 class TuneQueryOptEnt():
   def __init__(self, opt, t_opt):
     edmap_dict = {'train': RedisDB.train_edmap_db, 'test': RedisDB.test_edmap_db}
@@ -213,6 +135,9 @@ class TuneQueryOptEnt():
     self._ret_list = {}
     self._cutoff_list = {}
 
+    # the E-D map of each query, as an entity x document matrix
+    self._ed_matrices = {}
+
     self._opt = opt
     self._t_opt = t_opt
 
@@ -230,10 +155,9 @@ class TuneQueryOptEnt():
     qrels = json.loads(str)
 
     # get all the available entity candidates
-    key = 'e2d-map-%s' % query_id
-    all_eid = self._edmap_db.hkeys(key)
+    ed_matrix = self.load_map(query_id)
+    all_eid = list(ed_matrix.eids)
 
-    all_eid.sort(key=lambda x: int(x))
     key = 'ent-list-%s' % query_id
     db_item = self._edmap_db.hmget(key, all_eid)
 
@@ -242,7 +166,9 @@ class TuneQueryOptEnt():
       eid = all_eid[idx]
       ent_hash[eid] = ent
 
-    # TODO select the subset of entities incrementally in a greedy way
+    # select the subset of entities incrementally in a greedy way, the
+    # evaluator keeps the scores of the selected entities in memory
+    evaluator = GreedyEvaluator(ed_matrix, qrels)
     sel_eid = {}
     left_eid = {}
     for eid in all_eid:
@@ -262,19 +188,18 @@ class TuneQueryOptEnt():
       # iterate over all the left entities, and try to add one of them to the
       # selected entity list to see whether it can lead to better prformance
       for eid in left_eid:
-        cur_sel_eid = sel_eid.copy()
-        cur_sel_eid[eid] = 1
-        (cutoff, score) = self.max_perf(query_id, cur_sel_eid.keys(), qrels)
+        (cutoff, score) = evaluator.trial(eid)
 
         if score > max_score:
-          max_eid = cur_sel_eid.copy()
+          max_eid = eid
           max_score = score
 
       # if we can keep increasing the max performance in this round, keep
       # going
       if max_score > g_max_score:
         g_max_score = max_score
-        sel_eid = max_eid.copy()
+        sel_eid[max_eid] = 1
+        evaluator.add(max_eid)
 
         # remove the selected entity in this round from the left_eid list
         left_eid_copy = left_eid.copy()
@@ -292,7 +217,7 @@ class TuneQueryOptEnt():
       else:
         break
 
-    (cutoff, score) = self.max_perf(query_id, sel_eid.keys(), qrels)
+    (cutoff, score) = evaluator.best()
     scored_doc_list = self.get_doc_list(query_id, sel_eid.keys())
     self._ret_list[query_id] = scored_doc_list
     self._cutoff_list[query_id] = cutoff
@@ -361,25 +286,23 @@ class TuneQueryOptEnt():
     (cutoff, max) = self.max_score(scores, 'F')
     return (cutoff, max)
 
+  def load_map(self, query_id):
+    '''
+    Load the E-D map of a query as a sparse matrix, once
+    '''
+    if query_id not in self._ed_matrices:
+      self._ed_matrices[query_id] = edmap.EDMatrix.load(self._edmap_db,
+          query_id)
+    return self._ed_matrices[query_id]
+
   def get_doc_list(self, query_id, eid_list):
     '''
     Get the scored doc list for a given related entity list
     '''
-    key = 'e2d-map-%s' % query_id
-    eid_list.sort(key=lambda x: int(x))
-    e2d_list = self._edmap_db.hmget(key, eid_list)
-
-    # generate the document list
-    scored_doc_list = {}
-    for e2d_str in e2d_list:
-      e2d = json.loads(e2d_str)
-      for did in e2d:
-        score = e2d[did]
-        if did not in scored_doc_list:
-          scored_doc_list[did] = 0
-        scored_doc_list[did] += score
-
-    return scored_doc_list
+    ed_matrix = self.load_map(query_id)
+    ent_vector = ed_matrix.entity_vector(eid_list)
+    return ed_matrix.doc_dict(ed_matrix.doc_scores(ent_vector),
+        ed_matrix.doc_presence(ent_vector))
 
   def max_score(self, scores, measure):
     '''
@@ -413,6 +336,9 @@ def main():
   parser.add_argument(
     '--debug', default=False, action='store_true', dest='debug',
     help='print out debugging diagnostics')
+  parser.add_argument('--num-workers', type=int, default=None,
+    dest='num_workers',
+    help='number of queries tuned in parallel, default: number of cores')
   args = parser.parse_args()
 
   #opt = 'c'
@@ -425,19 +351,16 @@ def main():
   train_test_dict = {'train': 'training', 'test': 'testing'}
   qrels_key = '%s-%s' %(train_test_dict[t_opt], opt)
 
-  # run over all the queries
-  query_id_list = range(0, 29, 1)
+  # run over all the queries, spread across the workers
+  query_id_list = [str(query_id) for query_id in range(0, 29, 1)]
   score_list = []
 
-  for query_id in query_id_list:
-    print 'Query %d' % query_id
-    score = tuner.greedy_tune(str(query_id), qrels_key)
+  tune = lambda query_id: tuner.greedy_tune(query_id, qrels_key)
+  for query_id, score in topics.tune_topics(tuner, tune, query_id_list,
+      args.num_workers):
+    print 'Query %s - %.3f' %(query_id, score)
     score_list.append(score)
 
-    # for debug only
-    #if len(score_list) > 5:
-      #break
-
   if len(score_list):
     avg = reduce(lambda x, y: x+y, score_list) / len(score_list)
     print 'Average: %6.3f' % avg
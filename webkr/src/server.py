@@ -5,11 +5,19 @@ Provide a web interface to browse the temporal information of related entities
 """
 
 import os
+import sys
 import re
 import json
 import time
 import datetime
 
+try:
+  import dbpool
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import tornado.ioloop
 import tornado.web
 import tornado.options
@@ -17,9 +25,17 @@ import tornado.httpserver
 
 import redis
 from config import RedisDB
+import dbpool
+import edmap
+from confusion import score_confusion_matrix
 from tornado.options import define, options
 
 define("port", default=2012, help="run on the given port", type=int)
+define("edmap_cache_size", default=edmap.CACHE_SIZE,
+    help="number of queries whose E-D map is kept in memory", type=int)
+define("db_threads", default=dbpool.POOL_SIZE,
+    help="number of threads running the blocking work of the requests",
+    type=int)
 
 class DictItem(dict):
   """
@@ -31,7 +47,7 @@ class DictItem(dict):
     except KeyError:
       raise AttributeError(name)
 
-class BaseHandler(tornado.web.RequestHandler):
+class BaseHandler(dbpool.PoolHandler):
   @property
   def _ent_db(self):
     return self.application._ent_db
@@ -52,6 +68,10 @@ class BaseHandler(tornado.web.RequestHandler):
   def _test_edmap_db(self):
     return self.application._test_edmap_db
 
+  @property
+  def _test_edmap_cache(self):
+    return self.application._test_edmap_cache
+
   @property
   def _train_greedy_db(self):
     return self.application._train_greedy_db
@@ -74,6 +94,7 @@ class HomeHandler(BaseHandler):
     self.redirect(url)
 
 class EntIndexHandler(BaseHandler):
+  @dbpool.blocking
   def get(self):
     num = self._ent_db.llen(RedisDB.query_ent_list)
     if 0 == num:
@@ -94,6 +115,7 @@ class EntIndexHandler(BaseHandler):
     self.render("ent-index.html", title='KBA Query Entities', ret_items=ret_items)
 
 class EntViewHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ent_id):
     hash_key = 'query-%s' % ent_id
     keys = self._ent_db.hkeys(hash_key)
@@ -122,6 +144,7 @@ class EntViewHandler(BaseHandler):
     self.render("ent-view.html", ent_id=ent_id, ent=ent, date_list=date_list)
 
 class EntRevHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ent_id, date):
     ## check whether this revision exists or not
     rel_ent_hash_key = 'query-rel-ent-%s' % ent_id
@@ -138,6 +161,7 @@ class EntRevHandler(BaseHandler):
         rel_ent_list=rel_ent_list)
 
 class EntDistHandler(BaseHandler):
+  @dbpool.blocking
   def get(self, ent_id):
     hash_key = 'query-%s' % ent_id
     keys = self._ent_db.hkeys(hash_key)
@@ -217,6 +241,7 @@ class TuneHandler(BaseHandler):
   Tune the performance by adding or removing any related entities. The
   performance will be reported by F1 at diffrent levels of cutoffs.
   '''
+  @dbpool.blocking
   def get(self, query_id, c_or_rc):
     if c_or_rc not in ['c', 'rc']:
       msg = 'Invalid URL. c or rc only!'
@@ -235,23 +260,19 @@ class TuneHandler(BaseHandler):
     ## retrieve the list of related entities
     ## here we only retrieve the entities which have occurred in the relevant
     ## documents, i.e. effective entities
-    key = 'e2d-map-%s' % query_id
-    eid_keys = self._test_edmap_db.hkeys(key)
-    eid_keys.sort(key=lambda x: int(x))
-    map_db_item = self._test_edmap_db.hmget(key, eid_keys)
+    ed_matrix = self._test_edmap_cache.get(query_id)
+    eid_keys = ed_matrix.eids
+    doc_nums = ed_matrix.doc_nums()
 
     key = 'ent-list-%s' % query_id
     db_item = self._test_edmap_db.hmget(key, eid_keys)
 
     ent_list = []
     for idx, ent in enumerate(db_item):
-      eid = eid_keys[idx]
-      map_str = map_db_item[idx]
-      map_json = json.loads(map_str)
       item = DictItem()
-      item['eid'] = eid
+      item['eid'] = eid_keys[idx]
       item['ent'] = ent
-      item['doc_num'] = len(map_json.keys())
+      item['doc_num'] = int(doc_nums[idx])
       ent_list.append(item)
 
     if 'c' == c_or_rc:
@@ -264,6 +285,7 @@ class TunePerfHandler(BaseHandler):
   Tune the performance by changing the related entities (either adding,
   removing). The performance is reported by F1 (or SU) at each cufoff level
   '''
+  @dbpool.blocking
   def get(self, query_id, ent_str, c_or_rc):
     if c_or_rc not in ['c', 'rc']:
       msg = 'Invalid URL. c or rc only!'
@@ -280,9 +302,8 @@ class TunePerfHandler(BaseHandler):
     rc_qrels = json.loads(str)
 
     # generate the document list
-    scored_doc_list = {}
-    key = 'e2d-map-%s' % query_id
-    eid_keys = self._test_edmap_db.hkeys(key)
+    ed_matrix = self._test_edmap_cache.get(query_id)
+    eid_keys = ed_matrix.eids
 
     # get the ent list specified by the parameters from passed-in URL
     if ' ' != ent_str:
@@ -298,15 +319,9 @@ class TunePerfHandler(BaseHandler):
       self.write(line)
       return
 
-    eid_keys.sort(key=lambda x: int(x))
-    e2d_list = self._test_edmap_db.hmget(key, eid_keys)
-    for e2d_str in e2d_list:
-      e2d = json.loads(e2d_str)
-      for did in e2d:
-        score = e2d[did]
-        if did not in scored_doc_list:
-          scored_doc_list[did] = 0
-        scored_doc_list[did] += score
+    ent_vector = ed_matrix.entity_vector(eid_keys)
+    scored_doc_list = ed_matrix.doc_dict(ed_matrix.doc_scores(ent_vector),
+        ed_matrix.doc_presence(ent_vector))
 
     # applying filtering over the scored document on different cutoffs
     c_CM = score_confusion_matrix(scored_doc_list, c_qrels)
@@ -324,6 +339,7 @@ class TrainGreedyPerfHandler(BaseHandler):
   '''
   Get the related entity list selected by the greedy algorithm
   '''
+  @dbpool.blocking
   def get(self, query_id, c_or_rc):
     if c_or_rc not in ['c', 'rc']:
       msg = 'Invalid URL. c or rc only!'
@@ -352,6 +368,7 @@ class TestGreedyPerfHandler(BaseHandler):
   '''
   Get the related entity list selected by the greedy algorithm
   '''
+  @dbpool.blocking
   def get(self, query_id, c_or_rc):
     if c_or_rc not in ['c', 'rc']:
       msg = 'Invalid URL. c or rc only!'
@@ -445,100 +462,12 @@ def performance_metrics (CM, debug=False):
             CM[cutoff]['FP'], CM[cutoff]['FN'])
     return Scores
 
-def score_confusion_matrix (scored_doc_list, annotation, debug=False):
-    '''
-    This function generates the confusion matrix (number of true/false positives
-    and true/false negatives.
-
-    path_to_run_file: str, a filesystem link to the run submission
-    annotation: dict, containing the annotation data
-    unannotated_is_TN: boolean, true to count unannotated as negatives
-    include_training: boolean, true to include training documents
-
-    returns a confusion matrix dictionary for each urlname
-    '''
-    # default: false
-    unannotated_is_TN = False
-
-    END_OF_2012 = 1325375999
-
-    ## Create a dictionary containing the confusion matrix (CM)
-    cutoffs = range(0, 100, 1)
-    CM = dict()
-
-    ## count the total number of assertions per entity
-    num_assertions = {'total': 0,
-                      'in_TTR': 0,
-                      'in_ETR': 0,
-                      'in_annotation_set': 0}
-    for cutoff in cutoffs:
-        CM[cutoff] = dict(TP=0, FP=0, FN=0, TN=0)
-
-    ## Iterate through every row of the run
-    for did in scored_doc_list:
-        score = scored_doc_list[did]
-        timestamp = int(did.split('-')[0])
-
-        ## keep track of total number of assertions per entity
-        num_assertions['total'] += 1
-        if timestamp <= END_OF_2012:
-            num_assertions['in_TTR'] += 1
-        else:
-            num_assertions['in_ETR'] += 1
-
-        in_annotation_set = did in annotation
-
-        if in_annotation_set:
-            num_assertions['in_annotation_set'] += 1
-
-        ## In the annotation set and relevant
-        if in_annotation_set and annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## If above the cutoff: true-positive
-                    CM[cutoff]['TP'] += 1
-
-        ## In the annotation set and non-relevant
-        elif in_annotation_set and not annotation[did]:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-        ## Not in the annotation set so its a negative (if flag is true)
-        elif unannotated_is_TN:
-            for cutoff in cutoffs:
-                if score > cutoff:
-                    ## Above the cutoff: false-positive
-                    CM[cutoff]['FP'] += 1
-                else:
-                    ## Below the cutoff: true-negative
-                    CM[cutoff]['TN'] += 1
-
-    ## Correct FN for things in the annotation set that are NOT in the run
-    ## First, calculate number of true things in the annotation set
-    annotation_positives = 0
-    for did in annotation:
-        annotation_positives += annotation[did]
-
-    for cutoff in CM:
-        ## Then subtract the number of TP at each cutoffs
-        ## (since FN+TP==True things in annotation set)
-        CM[cutoff]['FN'] = annotation_positives - CM[cutoff]['TP']
-
-    if debug:
-        print 'showing assertion counts:'
-        print json.dumps(num_assertions, indent=4, sort_keys=True)
-
-    return CM
-
 class TempHandler(BaseHandler):
   '''
   Explore the correlations between the temporal distributions of related
   entities
   '''
+  @dbpool.blocking
   def get(self, query_id):
     hash_key = 'query-%s' % query_id
     keys = self._ent_db.hkeys(hash_key)
@@ -552,23 +481,19 @@ class TempHandler(BaseHandler):
     ## retrieve the list of related entities
     ## here we only retrieve the entities which have occurred in the relevant
     ## documents, i.e. effective entities
-    key = 'e2d-map-%s' % query_id
-    eid_keys = self._test_edmap_db.hkeys(key)
-    eid_keys.sort(key=lambda x: int(x))
-    map_db_item = self._test_edmap_db.hmget(key, eid_keys)
+    ed_matrix = self._test_edmap_cache.get(query_id)
+    eid_keys = ed_matrix.eids
+    doc_nums = ed_matrix.doc_nums()
 
     key = 'ent-list-%s' % query_id
     db_item = self._test_edmap_db.hmget(key, eid_keys)
 
     ent_list = []
     for idx, ent in enumerate(db_item):
-      eid = eid_keys[idx]
-      map_str = map_db_item[idx]
-      map_json = json.loads(map_str)
       item = DictItem()
-      item['eid'] = eid
+      item['eid'] = eid_keys[idx]
       item['ent'] = ent
-      item['doc_num'] = len(map_json.keys())
+      item['doc_num'] = int(doc_nums[idx])
       ent_list.append(item)
 
     self.render("temp-view.html", query_id=query_id, query=query, ent_list=ent_list)
@@ -577,6 +502,7 @@ class TempQueryHandler(BaseHandler):
   '''
   Return the temporal distribution of query entity
   '''
+  @dbpool.blocking
   def get(self, query_id):
     # generate the document list
     key = 'd2e-map-%s' % query_id
@@ -603,6 +529,7 @@ class TempEntHandler(BaseHandler):
   '''
   Return the temporal distribution of a related entity
   '''
+  @dbpool.blocking
   def get(self, query_id, ent_id):
     # generate the document list
     key = 'e2d-map-%s' % query_id
@@ -611,8 +538,7 @@ class TempEntHandler(BaseHandler):
       self.render("error.html", msg=msg)
       return
 
-    e2d_str = self._test_edmap_db.hget(key, ent_id)
-    e2d = json.loads(e2d_str)
+    e2d = self._test_edmap_cache.get(query_id).ent_docs(ent_id)
     doc_dist_hash = {}
     for did in e2d:
       epoch = float(did.split('-')[0])
@@ -647,6 +573,7 @@ class IDFCorrelDistHandler(BaseHandler):
   0 : non-relevant entities
   1 : relevant entities (selected by greedy algorithm)
   '''
+  @dbpool.blocking
   def get(self):
     query_num = self._ent_db.llen(RedisDB.query_ent_list)
     if 0 == query_num:
@@ -713,6 +640,9 @@ class Application(tornado.web.Application):
 
     tornado.web.Application.__init__(self, handlers, **settings)
 
+    # the threads of the handlers reading Redis, the IOLoop is never blocked
+    self._db_pool = dbpool.DBPool(options.db_threads)
+
     # global database connections for all handles
     self._ent_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
         db=RedisDB.ent_db)
@@ -729,6 +659,10 @@ class Application(tornado.web.Application):
     self._test_edmap_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.test_edmap_db)
 
+    # the decoded E-D maps of the latest queries
+    self._test_edmap_cache = edmap.EDMapCache(self._test_edmap_db,
+      options.edmap_cache_size)
+
     self._train_greedy_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
         db=RedisDB.train_greedy_db)
 
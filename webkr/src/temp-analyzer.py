@@ -3,6 +3,7 @@
 Apply different temporal analytical methods over the data the mine the latent
 relations between topic entity and its related entities
 
+temp-analyzer.py [--series-dir DIR] [--rebuild] [--cor-rel [--max-lag N]]
 '''
 ## use float division instead of integer division
 from __future__ import division
@@ -20,18 +21,22 @@ from collections import defaultdict
 from cStringIO import StringIO
 import numpy as np
 
+try:
+  import timeseries
+except ImportError:
+  ## not on the PYTHONPATH, the shared modules are in ../../src
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+      os.pardir, os.pardir, 'src'))
+
 import redis
 from config import RedisDB
+import timeseries
+import dftable
 
 def log(m, newline='\n'):
   sys.stderr.write(m + newline)
   sys.stderr.flush()
 
-# http://stackoverflow.com/a/1060330/219617
-def daterange(start_date, end_date):
-  for n in range(int ((end_date - start_date).days)):
-    yield start_date + datetime.timedelta(n)
-
 class DictItem(dict):
   """
   A dict that allows for object-like property access syntax.
@@ -66,226 +71,132 @@ class TempAnalyzer():
   _temp_db = redis.Redis(host=RedisDB.host, port=RedisDB.port,
       db=RedisDB.temp_db)
 
-  _total_doc_num = 36546 + 63564
+  # the range of the whole data (both training and testing data)
+  _start_date = datetime.date(2011, 10, 07)
+  _end_date = datetime.date(2012, 5, 3)
 
-  def idf(self, query_id):
+  def __init__(self, series_dir='series', rebuild=False):
+    self._series_dir = series_dir
+    self._rebuild = rebuild
+
+  def load_series(self, query_id):
     '''
-    Estimate the IDF of topic entity and its related entities
+    Load the daily document counts of topic entity and its related entities,
+    they are built from the E-D maps the first time and whenever the maps
+    have changed since
     '''
-    # collect all related entities throught all revisions
-    key = 'e2d-map-%s' % query_id
-    eid_keys = self._test_edmap_db.hkeys(key)
-    eid_keys.sort(key=lambda x: int(x))
-    key = 'ent-list-%s' % query_id
-    db_item = self._test_edmap_db.hmget(key, eid_keys)
-    log('%d entities' % len(db_item))
-
-    idf_key = 'idf-%s' % query_id
+    path = os.path.join(self._series_dir, '%s.npz' % query_id)
+    if os.path.isfile(path) and not self._rebuild:
+      series = timeseries.DailySeries.load(path)
+      if series.stamp == timeseries.map_stamp(self._train_edmap_db,
+          self._test_edmap_db):
+        return series
+      log('E-D maps changed, rebuilding the series of query %s' % query_id)
+
+    series = timeseries.build(query_id, self._train_edmap_db,
+        self._test_edmap_db, self._start_date, self._end_date)
+    if not os.path.isdir(self._series_dir):
+      os.makedirs(self._series_dir)
+    series.save(path)
+    return series
 
-    ent_list = []
-    for idx, ent in enumerate(db_item):
-      ent_id = eid_keys[idx]
-      doc_list = self.ent_doc_list(query_id, ent_id)
-      doc_num = len(doc_list)
-      p_occ = doc_num / self._total_doc_num
-      log_idf = - math.log(p_occ)
-      #print 'IDF [%s / %s (%s)] %f' %(query_id, ent_id, ent, log_idf)
-      # write to DB
-      self._temp_db.hset(idf_key, ent_id, log_idf)
-
-  def ent_doc_list(self, query_id, ent_id):
+  def idf(self, query_id):
     '''
-    Get all the documents which mention the related entity
+    Estimate the IDF of topic entity and its related entities
     '''
-    key = 'e2d-map-%s' % query_id
-    if not self._test_edmap_db.hexists(key, ent_id):
-      msg = 'Invalid ent_id: %s' % ent_id
-      log(msg)
-      return
-
-    doc_hash = {}
-
-    # training data
-    if self._train_edmap_db.hexists(key, ent_id):
-      e2d_str = self._train_edmap_db.hget(key, ent_id)
-      e2d = json.loads(e2d_str)
-      for did in e2d:
-        doc_hash[did] = 1
-
-    # testing data
-    e2d_str = self._test_edmap_db.hget(key, ent_id)
-    e2d = json.loads(e2d_str)
-    for did in e2d:
-      doc_hash[did] = 1
-
-    return doc_hash
+    eid_keys = self._test_edmap_db.hkeys('e2d-map-%s' % query_id)
+    log('%d entities' % len(eid_keys))
+
+    # the number of training and testing documents of each entity, from the
+    # table saved by gen-ed-map.py
+    table = dftable.DFTable(self._ent_db)
+    for split in dftable.SPLITS:
+      if not table.doc_num([split]):
+        raise RuntimeError('the document frequencies of the %s split are '
+            'empty, run gen-ed-map.py over the %s documents' %(split, split))
+    idf_list = table.idf(['%s:%s' %(query_id, ent_id) for ent_id in eid_keys])
+
+    # write to DB
+    idf_key = 'idf-%s' % query_id
+    pipe = self._temp_db.pipeline(transaction=False)
+    for ent_id, val in zip(eid_keys, idf_list):
+      if val is None:
+        log('no document: %s - %s' %(query_id, ent_id))
+        continue
+      pipe.hset(idf_key, ent_id, val)
+    pipe.execute()
 
-  def cor_rel(self, query_id):
+  def cor_rel(self, query_id, max_lag=0):
     '''
     Estimate the corrleation between the temporal distribution of topic entity
-    and its related entities
+    and its related entities, and their cross-correlation with the related
+    entities shifted by up to max_lag days
     '''
-    # get the topic entity
-    query = self._ent_db.hget(RedisDB.query_ent_hash, query_id)
-
-    # collect all related entities throught all revisions
-    key = 'e2d-map-%s' % query_id
-    eid_keys = self._test_edmap_db.hkeys(key)
-    eid_keys.sort(key=lambda x: int(x))
+    series = self.load_series(query_id)
+    eid_keys = series.eids
     key = 'ent-list-%s' % query_id
-    db_item = self._test_edmap_db.hmget(key, eid_keys)
+    db_item = self._test_edmap_db.hmget(key, eid_keys) if eid_keys else []
     log('%d entities' % len(db_item))
 
-    ent_list = []
-    for idx, ent in enumerate(db_item):
-      eid = eid_keys[idx]
-      item = DictItem()
-      item['eid'] = eid
-      item['ent'] = ent
-      ent_list.append(item)
-
-    # estimate the temporal distribution for topic entity and its related
-    # entities
-    topic_dist = self.est_doc_dist_query(query_id)
-    topic_norm_list = self.normalize_dist(topic_dist)
+    # the days out of the range only count for the documents on them, an
+    # entity which is not on the same number of them as the topic entity
+    # cannot be compared with it
+    outside = ~series.in_range()
+    topic_outside = np.count_nonzero(series.topic[outside])
+    ent_outside = np.count_nonzero(series.ents[:, outside], axis=1)
+    ent_sums = series.ents.sum(axis=1)
+
+    # normalize the temporal distributions, and correlate all the related
+    # entities with the topic entity at once, over every lag
+    lag_correl = timeseries.lagged_correlation(
+        timeseries.normalize(series.ents), timeseries.normalize(series.topic),
+        max_lag)
+    correl_list = lag_correl[:, max_lag].tolist()
 
     correl_key = 'correl-%s' % query_id
-    for ent in ent_list:
-      ent_id = ent['eid']
-      ent_str = ent['ent']
-      ent_dist = self.est_doc_dist_ent(query_id, ent_id)
-
-      if len(topic_dist) != len(ent_dist):
-        log('dist length mismatch: %s - %s [%s] (%d : %d)' %(query_id, ent_id,
-          ent_str, len(topic_dist), len(ent_dist)))
-        continue
-
-      ent_norm_list = self.normalize_dist(ent_dist)
-      correl_array = np.correlate(topic_norm_list, ent_norm_list)
-      if 1 != len(correl_array):
-        log('Invalid correlation array: %s - %s [%s]' %(query_id, ent_id,
+    lag_key = 'lag-correl-%s' % query_id
+    pipe = self._temp_db.pipeline(transaction=False)
+    if max_lag:
+      # the lags of a former window are not left behind
+      pipe.delete(lag_key)
+    for idx, ent_id in enumerate(eid_keys):
+      ent_str = db_item[idx]
+      if ent_outside[idx] != topic_outside or 0 == ent_sums[idx]:
+        log('dist length mismatch: %s - %s [%s]' %(query_id, ent_id,
           ent_str))
-      correl = correl_array[0]
+        continue
 
       # write to DB
-      self._temp_db.hset(correl_key, ent_id, correl)
+      pipe.hset(correl_key, ent_id, correl_list[idx])
+      if max_lag:
+        # the correlation of each lag, from -max_lag to max_lag
+        pipe.hset(lag_key, ent_id, json.dumps(lag_correl[idx].tolist()))
 
       #print 'Correlation [ %s - %s (%s) ]: %f' % (query_id, ent_id, ent_str,
-          #correl)
-
-  def normalize_dist(self, dist_hash):
-    '''
-    Apply normalization over the temporal distribution, generate the list of
-    float values
-    '''
-    sum = 0
-    norm_list = []
-    for d_time in dist_hash:
-      val = dist_hash[d_time]
-      norm_list.append(val)
-      sum = sum + val
-
-    for idx, val in enumerate(norm_list):
-      val = val / sum
-      norm_list[idx] = val
-
-    return norm_list
-
-  def date_range(self):
-    '''
-    Date range for whole data (both training and testing data)
-    '''
-    start_date = datetime.date(2011, 10, 07)
-    end_date = datetime.date(2012, 5, 3)
-    return daterange(start_date, end_date)
-
-  def est_doc_dist_query(self, query_id):
-    '''
-    estimate the temporal distribution of topic entity
-    '''
-    doc_dist_hash = {}
-
-    # padding 0 for all available dates
-    for d_time in self.date_range():
-      d_date = '%d-%.2d-%.2d' %(d_time.year, d_time.month, d_time.day)
-      doc_dist_hash[d_date] = 0
-
-    # training data
-    key = 'd2e-map-%s' % query_id
-    did_keys = self._train_edmap_db.hkeys(key)
-    for did in did_keys:
-      epoch = float(did.split('-')[0])
-      d_time = datetime.datetime.utcfromtimestamp(epoch)
-      d_date = '%d-%.2d-%.2d' %(d_time.year, d_time.month, d_time.day)
-      if d_date not in doc_dist_hash:
-        doc_dist_hash[d_date] = 1
-      else:
-        doc_dist_hash[d_date] += 1
-
-    # testing data
-    key = 'd2e-map-%s' % query_id
-    did_keys = self._test_edmap_db.hkeys(key)
-    for did in did_keys:
-      epoch = float(did.split('-')[0])
-      d_time = datetime.datetime.utcfromtimestamp(epoch)
-      d_date = '%d-%.2d-%.2d' %(d_time.year, d_time.month, d_time.day)
-      if d_date not in doc_dist_hash:
-        doc_dist_hash[d_date] = 1
-      else:
-        doc_dist_hash[d_date] += 1
-
-    return doc_dist_hash
-
-  def est_doc_dist_ent(self, query_id, ent_id):
-    '''
-    estimate the temporal distribution of related entity
-    '''
-    key = 'e2d-map-%s' % query_id
-    if not self._test_edmap_db.hexists(key, ent_id):
-      msg = 'Invalid ent_id: %s' % ent_id
-      log(msg)
-      return
-
-    doc_dist_hash = {}
-    # padding 0 for all available dates
-    for d_time in self.date_range():
-      d_date = '%d-%.2d-%.2d' %(d_time.year, d_time.month, d_time.day)
-      doc_dist_hash[d_date] = 0
-
-    # training data
-    if self._train_edmap_db.hexists(key, ent_id):
-      e2d_str = self._train_edmap_db.hget(key, ent_id)
-      e2d = json.loads(e2d_str)
-      for did in e2d:
-        epoch = float(did.split('-')[0])
-        d_time = datetime.datetime.utcfromtimestamp(epoch)
-        d_date = '%d-%.2d-%.2d' %(d_time.year, d_time.month, d_time.day)
-        if d_date not in doc_dist_hash:
-          doc_dist_hash[d_date] = 1
-        else:
-          doc_dist_hash[d_date] += 1
-
-    # testing data
-    e2d_str = self._test_edmap_db.hget(key, ent_id)
-    e2d = json.loads(e2d_str)
-    for did in e2d:
-      epoch = float(did.split('-')[0])
-      d_time = datetime.datetime.utcfromtimestamp(epoch)
-      d_date = '%d-%.2d-%.2d' %(d_time.year, d_time.month, d_time.day)
-      if d_date not in doc_dist_hash:
-        doc_dist_hash[d_date] = 1
-      else:
-        doc_dist_hash[d_date] += 1
-
-    return doc_dist_hash
+          #correl_list[idx])
+    pipe.execute()
 
 def main():
-  analyzer = TempAnalyzer()
+  import argparse
+  parser = argparse.ArgumentParser(usage=__doc__)
+  parser.add_argument('--series-dir', default='series', dest='series_dir',
+      help='directory of the daily document counts of each query')
+  parser.add_argument('--rebuild', default=False, action='store_true',
+      help='build the daily document counts again from the E-D maps')
+  parser.add_argument('--cor-rel', default=False, action='store_true',
+      dest='cor_rel', help='correlate the related entities with the topic '
+      'entity too')
+  parser.add_argument('--max-lag', type=int, default=0, dest='max_lag',
+      help='correlate over the lags of [-N, N] days, in lag-correl-<query_id>')
+  args = parser.parse_args()
+
+  analyzer = TempAnalyzer(args.series_dir, args.rebuild)
 
   query_id_list = range(0, 29, 1)
   for query_id in query_id_list:
     log('Query %d' % query_id)
-    #analyzer.cor_rel(query_id)
+    if args.cor_rel:
+      analyzer.cor_rel(query_id, args.max_lag)
     analyzer.idf(query_id)
 
 if __name__ == '__main__':